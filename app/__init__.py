@@ -1 +1,66 @@
-# This file makes 'app' a Python package
+import os
+from flask import Flask
+from app.config import CONFIGS
+from app.database import configure_database, init_database
+from app.extensions import db, login_manager
+
+# templates/ and static/ live next to the package, not inside it
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def create_app(config_name=None):
+    """Create Flask application"""
+    config_name = config_name or os.getenv('APP_CONFIG', 'development')
+    app = Flask(__name__,
+                template_folder=os.path.join(PROJECT_ROOT, 'templates'),
+                static_folder=os.path.join(PROJECT_ROOT, 'static'))
+    
+    # Configuration (profiles in app/config.py, overridable from the environment)
+    app.config.from_object(CONFIGS[config_name])
+    if not app.config['TILE_CACHE_DIR']:
+        app.config['TILE_CACHE_DIR'] = os.path.join(app.instance_path, 'tile_cache')
+    if not app.config['SNAPSHOT_DIR']:
+        app.config['SNAPSHOT_DIR'] = os.path.join(app.instance_path, 'snapshots')
+    configure_database(app)
+    
+    # Initialize extensions with app
+    db.init_app(app)
+    init_database(app, db)
+    login_manager.init_app(app)
+    login_manager.login_view = 'auth.login'
+    
+    # Import and register blueprints
+    from app.routes.main import main
+    from app.routes.auth import auth
+    from app.routes.admin_urls import admin
+    from app.routes.tiles import tiles
+    
+    app.register_blueprint(main)
+    app.register_blueprint(auth, url_prefix='/auth')
+    app.register_blueprint(admin, url_prefix='/admin')
+    app.register_blueprint(tiles, url_prefix='/tiles')
+    
+    # Flush listeners (table versions, admin counters, competitor counts)
+    # must be installed before the first write, whatever views are loaded
+    from app.services import admin_stats, data_version, write_hooks  # noqa: F401
+    
+    # Latency/SQL instrumentation and /metrics (registered before compression
+    # so response sizes are measured after it)
+    from app.metrics import init_metrics
+    init_metrics(app)
+    
+    # gzip/brotli for API responses
+    from app.compression import init_compression
+    init_compression(app)
+    
+    # CLI commands (flask warm-tiles, ...)
+    from app.cli import register_commands
+    register_commands(app)
+    
+    # Schema changes run once per deploy (`flask upgrade-db`); booting
+    # only reads the schema version
+    from app.schema import check_schema
+    with app.app_context():
+        check_schema(app)
+    
+    return app
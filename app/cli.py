@@ -0,0 +1,221 @@
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+
+def register_commands(app):
+    """Attach the maintenance commands to `flask`"""
+    app.cli.add_command(upgrade_db)
+    app.cli.add_command(warm_tiles)
+    app.cli.add_command(compute_competitor_density)
+    app.cli.add_command(load_zip_centroids)
+    app.cli.add_command(import_demographics)
+    app.cli.add_command(import_locations)
+    app.cli.add_command(load_geocodes)
+    app.cli.add_command(load_boundaries)
+    app.cli.add_command(assign_zips)
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db():
+    """Apply pending schema migrations (run once per deploy)."""
+    from app.schema import SCHEMA_VERSION, upgrade
+
+    applied = upgrade(log=click.echo)
+    if not applied:
+        click.echo(f'Schema is up to date (version {SCHEMA_VERSION})')
+
+
+@click.command('warm-tiles')
+@click.option('--metric', 'metrics', multiple=True, default=['population'],
+              help='Metric to render; repeat for several (default: population).')
+@click.option('--min-zoom', default=4, show_default=True)
+@click.option('--max-zoom', default=10, show_default=True)
+@click.option('--bbox', default=None,
+              help='min_lon,min_lat,max_lon,max_lat (default: extent of the data).')
+@with_appcontext
+def warm_tiles(metrics, min_zoom, max_zoom, bbox):
+    """Pre-render heat map tiles into the tile cache."""
+    from app.services.data_version import data_version
+    from app.services.demographic_query import parse_bbox
+    from app.services.geo import tiles_covering
+    from app.services.heatmap import METRICS, load_points, get_tile
+    from app.services.tile_cache import get_tile_cache
+
+    cache = get_tile_cache(current_app)
+    filters = {'income': [], 'population': [], 'home_value': [], 'q': '', 'bbox': None}
+
+    for metric in metrics:
+        if metric not in METRICS:
+            raise click.BadParameter(f'unknown metric {metric!r}', param_hint='--metric')
+        # Location heat is per user; warm the admin (all locations) view
+        scope = 'all' if METRICS[metric][0] == 'locations' else None
+        points = load_points(metric, filters, scope, None, data_version(METRICS[metric][0]))
+        extent = parse_bbox(bbox) if bbox else points.extent()
+        if extent is None:
+            click.echo(f'{metric}: no points with coordinates, skipping')
+            continue
+
+        started = time.perf_counter()
+        count = 0
+        for zoom in range(min_zoom, max_zoom + 1):
+            for x, y in tiles_covering(extent, zoom):
+                get_tile(cache, metric, filters, zoom, x, y, 'png', scope)
+                count += 1
+        elapsed = time.perf_counter() - started
+        click.echo(f'{metric}: {count} tiles for zoom {min_zoom}-{max_zoom} in {elapsed:.1f}s')
+
+
+@click.command('compute-competitor-density')
+@click.option('--business-type', default=None, help='Only rebuild this business type.')
+@with_appcontext
+def compute_competitor_density(business_type):
+    """Rebuild the competitor_density table from all locations."""
+    from app.services.competitor_density import recompute
+
+    started = time.perf_counter()
+    written = recompute(business_type)
+    click.echo(f'{written} competitor density rows written in {time.perf_counter() - started:.1f}s')
+
+
+@click.command('load-zip-centroids')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--create-missing', is_flag=True,
+              help='Add rows for ZIPs that have no demographics yet.')
+@with_appcontext
+def load_zip_centroids(path, create_missing):
+    """Load ZIP centroids from a Census Gazetteer ZCTA file or CSV."""
+    from app.services.gazetteer import load_centroids
+    from app.services.competitor_density import recompute
+
+    stats = load_centroids(path, create_missing=create_missing)
+    rate = stats['read'] / stats['seconds'] if stats['seconds'] else 0
+    click.echo(f"{stats['read']} centroids read ({stats['skipped']} skipped), "
+               f"{stats['changed']} rows changed in {stats['seconds']:.1f}s ({rate:,.0f} rows/s)")
+    if stats['changed']:
+        # Competitor counts are measured from the centroids
+        written = recompute()
+        click.echo(f'{written} competitor density rows rebuilt')
+
+
+@click.command('import-demographics')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=5000, show_default=True)
+@with_appcontext
+def import_demographics(path, batch_size):
+    """Upsert demographics from a CSV or Parquet file (ACS column names work)."""
+    from app.services.demographic_import import ImportFileError, import_demographics as run
+    from app.services.columns import demographic_columns
+    from app.services.competitor_density import recompute
+
+    try:
+        stats = run(path, batch_size=batch_size)
+    except ImportFileError as exc:
+        raise click.ClickException(str(exc))
+    rate = stats['read'] / stats['seconds'] if stats['seconds'] else 0
+    click.echo(f"Columns: {', '.join(stats['columns'])}")
+    click.echo(f"{stats['read']} rows read ({stats['rejected']} rejected), "
+               f"{stats['changed']} rows changed in {stats['seconds']:.1f}s ({rate:,.0f} rows/s)")
+    for line, reason in stats['errors']:
+        click.echo(f'  line {line}: {reason}', err=True)
+    if not stats['changed']:
+        return
+    # Publish the new snapshot now rather than on the first request
+    columns = demographic_columns()
+    click.echo(f'Snapshot {columns.version} written ({len(columns)} ZIPs)')
+    if 'latitude' in stats['columns'] or 'longitude' in stats['columns']:
+        # Competitor counts are measured from the centroids
+        written = recompute()
+        click.echo(f'{written} competitor density rows rebuilt')
+
+
+@click.command('import-locations')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'owner', required=True, help='Username or id that will own the locations.')
+@click.option('--batch-size', default=5000, show_default=True)
+@click.option('--require-coordinates', is_flag=True,
+              help='Reject rows that could not be geocoded instead of importing them without.')
+@with_appcontext
+def import_locations(path, owner, batch_size, require_coordinates):
+    """Bulk insert business locations from a CSV, geocoding them offline."""
+    from app.extensions import db
+    from app.models import User
+    from app.services.location_import import ImportFileError, import_locations as run
+
+    user = User.query.filter_by(username=owner).first()
+    if user is None and owner.isdigit():
+        user = db.session.get(User, int(owner))
+    if user is None:
+        raise click.ClickException(f'No such user: {owner}')
+    try:
+        stats = run(path, user.id, batch_size=batch_size, require_coordinates=require_coordinates)
+    except ImportFileError as exc:
+        raise click.ClickException(str(exc))
+    rate = stats['read'] / stats['seconds'] if stats['seconds'] else 0
+    click.echo(f"Columns: {', '.join(stats['columns'])}")
+    click.echo(f"{stats['read']} rows read ({stats['rejected']} rejected), "
+               f"{stats['imported']} locations imported in {stats['seconds']:.1f}s ({rate:,.0f} rows/s)")
+    geocoded = stats['geocoded']
+    click.echo(f"Coordinates: {geocoded['file']} from the file, {geocoded['cache']} from the "
+               f"geocode cache, {geocoded['zip']} ZIP centroids, {geocoded['missing']} missing")
+    for line, reason in stats['errors']:
+        click.echo(f'  line {line}: {reason}', err=True)
+
+
+@click.command('load-geocodes')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@with_appcontext
+def load_geocodes(path):
+    """Seed the geocode cache from a CSV of addresses with latitude/longitude."""
+    from app.services.location_import import ImportFileError, load_geocodes as run
+
+    try:
+        stats = run(path)
+    except ImportFileError as exc:
+        raise click.ClickException(str(exc))
+    click.echo(f"{stats['read']} rows read ({stats['rejected']} rejected), "
+               f"{stats['cached']} addresses cached in {stats['seconds']:.1f}s")
+    for line, reason in stats['errors']:
+        click.echo(f'  line {line}: {reason}', err=True)
+
+
+@click.command('load-boundaries')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--replace', is_flag=True, help='Delete every stored boundary first.')
+@with_appcontext
+def load_boundaries(path, replace):
+    """Load ZIP (ZCTA) polygons from GeoJSON or a shapefile and simplify them per zoom."""
+    from app.services.boundaries import BoundaryFileError, load_boundaries as run
+
+    try:
+        stats = run(path, replace=replace)
+    except BoundaryFileError as exc:
+        raise click.ClickException(str(exc))
+    click.echo(f"{stats['read']} features read ({stats['rejected']} rejected), "
+               f"{stats['loaded']} boundaries with {stats['vertices']:,} vertices "
+               f"loaded in {stats['seconds']:.1f}s")
+    click.echo('Shapes per zoom: ' + ', '.join(f'z{zoom} {count}' for zoom, count in stats['shapes'].items()))
+    for number, reason in stats['errors']:
+        click.echo(f'  feature {number}: {reason}', err=True)
+
+
+@click.command('assign-zips')
+@click.option('--table', 'tables', multiple=True, type=click.Choice(['locations', 'saved_addresses']),
+              help='Table to update; repeat for both (default: both).')
+@click.option('--overwrite', is_flag=True, help='Also correct rows that already have a ZIP.')
+@with_appcontext
+def assign_zips(tables, overwrite):
+    """Set zip_code of locations and saved addresses from the ZIP boundaries."""
+    from app.services.zip_lookup import ASSIGN_TABLES, assign_zips as run, boundary_index
+
+    if not len(boundary_index()):
+        raise click.ClickException('No ZIP boundaries loaded; run `flask load-boundaries` first')
+    for table in tables or ASSIGN_TABLES:
+        stats = run(table, overwrite=overwrite)
+        detail = f"{stats['outside']} outside every boundary"
+        if table == 'saved_addresses':
+            detail += f", {stats['ungeocoded']} not in the geocode cache"
+        click.echo(f"{table}: {stats['checked']} rows checked, {stats['located']} inside a ZIP, "
+                   f"{stats['changed']} changed in {stats['seconds']:.1f}s ({detail})")
@@ -0,0 +1,60 @@
+"""gzip / brotli response compression, negotiated from Accept-Encoding.
+
+Brotli is used when the optional `brotli` package is installed and the
+client accepts it. A compressed response keeps a strong ETag with the
+encoding appended, so conditional requests still match (see etag_variants).
+"""
+import gzip
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies aren't worth the CPU or the extra header
+MIN_SIZE = 1024
+COMPRESSIBLE = ('application/json', 'application/vnd.heatmap.columns', 'text/html',
+                'text/csv', 'text/plain')
+GZIP_LEVEL = 6
+# Quality 5 compresses close to gzip -9 at a fraction of brotli -11's CPU
+BROTLI_QUALITY = 5
+
+
+def _encodings():
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+
+def etag_variants(etag):
+    """The ETag and its per-encoding forms, for matching If-None-Match"""
+    return [etag] + [f'{etag}-{encoding}' for encoding in _encodings()]
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_response(response):
+    """after_request hook: compress the body if the client accepts it"""
+    if response.status_code != 200 or response.direct_passthrough \
+            or response.is_streamed or 'Content-Encoding' in response.headers \
+            or response.mimetype not in COMPRESSIBLE:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = next((e for e in _encodings() if request.accept_encodings[e]), None)
+    data = response.get_data()
+    if encoding is None or len(data) < MIN_SIZE:
+        return response
+
+    response.set_data(_compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+
+def init_compression(app):
+    app.after_request(compress_response)
@@ -0,0 +1,89 @@
+"""Configuration profiles, selected by create_app(config_name).
+
+Every setting can be overridden from the environment. Paths left as None
+default to directories under the Flask instance folder.
+"""
+import os
+
+
+def _int(name, default):
+    return int(os.getenv(name, default))
+
+
+def _float(name, default):
+    return float(os.getenv(name, default))
+
+
+class Config:
+    SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-please-change')
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///business_heatmap.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Separate pool for read-only API queries (a replica for Postgres);
+    # None derives a read-only connection to the primary SQLite file
+    DATABASE_READ_URL = os.getenv('DATABASE_READ_URL')
+    DATABASE_READ_POOL = False
+    # Applied to every new SQLite connection (ignored for other databases);
+    # journal_mode is only set by the read-write pool
+    SQLITE_PRAGMAS = {}
+    # Seconds the driver waits on a locked database
+    SQLITE_TIMEOUT = _float('SQLITE_TIMEOUT', 5)
+    # Pool options for SQLAlchemy's create_engine; None leaves its default
+    DATABASE_POOL_SIZE = None
+    DATABASE_MAX_OVERFLOW = None
+    DATABASE_POOL_RECYCLE = None
+    DATABASE_POOL_PRE_PING = False
+
+    TILE_CACHE_DIR = os.getenv('TILE_CACHE_DIR')
+    TILE_CACHE_MAX_BYTES = _int('TILE_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+    # Memory-mapped demographic column snapshots shared by all workers
+    SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR')
+    # Search history write-behind: flush every N seconds or at N entries
+    HISTORY_FLUSH_INTERVAL = _float('HISTORY_FLUSH_INTERVAL', 5)
+    HISTORY_FLUSH_SIZE = _int('HISTORY_FLUSH_SIZE', 200)
+    # Log requests slower than this with their SQL (0 disables)
+    SLOW_REQUEST_SECONDS = _float('SLOW_REQUEST_SECONDS', 1.0)
+    # Loaded users cached per process (TTL 0 disables the cache)
+    USER_CACHE_SIZE = _int('USER_CACHE_SIZE', 1024)
+    USER_CACHE_TTL = _float('USER_CACHE_TTL', 60)
+    # Read-only APIs trust the signed session's id/admin claims this long (0 disables)
+    SESSION_CLAIMS_MAX_AGE = _int('SESSION_CLAIMS_MAX_AGE', 300)
+    # Password hashing: werkzeug method string (cost), pool processes per
+    # worker (0 hashes inline) and hashes in flight before logins get a 429
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    PASSWORD_HASH_WORKERS = _int('PASSWORD_HASH_WORKERS', 2)
+    PASSWORD_HASH_QUEUE = _int('PASSWORD_HASH_QUEUE', 16)
+    # Require `Authorization: Bearer <token>` on /metrics when set
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    # Apply pending schema migrations at boot; otherwise boot refuses an
+    # outdated database and `flask upgrade-db` has to be run at deploy time
+    SCHEMA_AUTO_UPGRADE = os.getenv('SCHEMA_AUTO_UPGRADE', '1') == '1'
+
+
+class DevelopmentConfig(Config):
+    pass
+
+
+class ProductionConfig(Config):
+    """Several gunicorn workers sharing one SQLite file"""
+    # WAL lets readers run alongside the single writer; NORMAL only syncs
+    # at checkpoints, which is safe in WAL mode
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': _int('SQLITE_BUSY_TIMEOUT_MS', 5000),
+        'cache_size': _int('SQLITE_CACHE_SIZE', -64000),
+        'mmap_size': _int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'temp_store': 'MEMORY',
+    }
+    DATABASE_READ_POOL = os.getenv('DATABASE_READ_POOL', '1') == '1'
+    DATABASE_POOL_SIZE = _int('DATABASE_POOL_SIZE', 5)
+    DATABASE_MAX_OVERFLOW = _int('DATABASE_MAX_OVERFLOW', 10)
+    DATABASE_POOL_RECYCLE = _int('DATABASE_POOL_RECYCLE', 3600)
+    DATABASE_POOL_PRE_PING = True
+    SCHEMA_AUTO_UPGRADE = os.getenv('SCHEMA_AUTO_UPGRADE', '0') == '1'
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+}
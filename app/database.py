@@ -0,0 +1,112 @@
+"""Engine configuration: pool options, SQLite pragmas and the read-only pool.
+
+Everything is driven by the config profile (app/config.py). For SQLite
+the production profile turns on WAL and friends on every new connection
+and adds a second pool of read-only connections to the same file, which
+the read-only API endpoints use; for Postgres, DATABASE_READ_URL can point
+that pool at a replica and the pragmas are skipped.
+"""
+from functools import wraps
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+READ_BIND = 'readonly'
+
+
+def _is_sqlite(url):
+    return url.get_backend_name() == 'sqlite'
+
+
+def _is_memory(url):
+    return _is_sqlite(url) and url.database in (None, '', ':memory:')
+
+
+def read_only_url(url):
+    """A read-only (mode=ro) URL for the same SQLite file"""
+    url = make_url(url)
+    database = url.database
+    if not database.startswith('file:'):
+        database = 'file:' + database
+    return url.set(database=database).update_query_dict({'mode': 'ro', 'uri': 'true'})
+
+
+def _pool_options(config, url):
+    if _is_memory(url):
+        # Flask-SQLAlchemy uses a StaticPool; pool sizes don't apply
+        return {}
+    options = {'pool_pre_ping': config['DATABASE_POOL_PRE_PING']}
+    for key, option in (('DATABASE_POOL_SIZE', 'pool_size'),
+                        ('DATABASE_MAX_OVERFLOW', 'max_overflow'),
+                        ('DATABASE_POOL_RECYCLE', 'pool_recycle')):
+        if config.get(key) is not None:
+            options[option] = config[key]
+    if _is_sqlite(url):
+        options['connect_args'] = {'timeout': config['SQLITE_TIMEOUT']}
+    return options
+
+
+def configure_database(app):
+    """Fill in engine options and binds from the profile (before db.init_app)"""
+    config = app.config
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = dict(_pool_options(config, url), **config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    read_url = config.get('DATABASE_READ_URL')
+    if config.get('DATABASE_READ_POOL') and not read_url and _is_sqlite(url) and not _is_memory(url):
+        read_url = read_only_url(url)
+    if read_url:
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        binds[READ_BIND] = dict(_pool_options(config, make_url(read_url)), url=read_url)
+        config['SQLALCHEMY_BINDS'] = binds
+
+
+def _pragma_listener(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+    return set_pragmas
+
+
+def init_database(app, db):
+    """Install the pragma hooks on the app's engines (after db.init_app)"""
+    pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+    if not pragmas:
+        return
+    with app.app_context():
+        engines = db.engines
+        for key, engine in engines.items():
+            if not _is_sqlite(engine.url):
+                continue
+            # journal_mode is a property of the file, set by the writers
+            applied = pragmas if key != READ_BIND else \
+                {k: v for k, v in pragmas.items() if k != 'journal_mode'}
+            if key == READ_BIND:
+                applied = dict(applied, query_only='ON')
+            event.listen(engine, 'connect', _pragma_listener(applied))
+
+
+# ============= READ-ONLY ROUTING =============
+
+def read_only(f):
+    """Run a view's queries on the read-only pool (if one is configured)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.read_only = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+class RoutingSession(Session):
+    """Session that sends reads in read_only views to the read-only pool"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() and g.get('read_only'):
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -1,10 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from app.database import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 
 @login_manager.user_loader
 def load_user(user_id):
-    from app.models import User
-    return User.query.get(int(user_id))
\ No newline at end of file
+    # Cached, so authenticated requests don't each query the user table
+    from app.services.identity import load_user as load_cached_user
+    return load_cached_user(int(user_id))
\ No newline at end of file
@@ -0,0 +1,211 @@
+"""Request instrumentation and the Prometheus /metrics endpoint.
+
+Per endpoint it records latency, response size and the number and total
+time of SQL statements (counted with SQLAlchemy engine events). Services
+report cache hits and misses with cache_event(). Requests slower than
+SLOW_REQUEST_SECONDS are logged with the statements they ran.
+
+Everything is kept in plain in-process counters: a lock, a bisect and a
+few additions per observation. Each gunicorn worker exports its own
+numbers; scrape every worker or sum them in Prometheus.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+from flask import g, has_request_context, request, current_app, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# Statements kept per request for the slow-request log
+MAX_LOGGED_STATEMENTS = 50
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1.0):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            yield f'{self.name}{_labels(self.labels, label_values)} {_number(value)}'
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # label values -> [bucket counts..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(bound)
+                yield f'{self.name}_bucket{_labels(self.labels + ("le",), label_values + (le,))} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labels, label_values)} {_number(series[-1])}'
+            yield f'{self.name}_count{_labels(self.labels, label_values)} {cumulative}'
+
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+
+    def __init__(self, name, help, read):
+        self.name, self.help, self.read = name, help, read
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            return
+        if value is None:
+            return
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} gauge'
+        yield f'{self.name} {_number(value)}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency by endpoint.',
+                            ('endpoint', 'method', 'status'))
+RESPONSE_SIZE = Histogram('http_response_size_bytes', 'Response body size by endpoint.',
+                          ('endpoint',), SIZE_BUCKETS)
+REQUEST_QUERIES = Histogram('http_request_sql_queries', 'SQL statements per request by endpoint.',
+                            ('endpoint',), QUERY_BUCKETS)
+SQL_SECONDS = Counter('sql_query_seconds_total', 'Time spent in SQL statements by endpoint.',
+                      ('endpoint',))
+SQL_QUERIES = Counter('sql_queries_total', 'SQL statements executed by endpoint.', ('endpoint',))
+CACHE_EVENTS = Counter('cache_requests_total', 'Cache lookups by cache and result.',
+                       ('cache', 'result'))
+SLOW_REQUESTS = Counter('http_slow_requests_total', 'Requests over the slow-request threshold.',
+                        ('endpoint',))
+
+_registry = [REQUEST_LATENCY, RESPONSE_SIZE, REQUEST_QUERIES, SQL_QUERIES, SQL_SECONDS,
+             CACHE_EVENTS, SLOW_REQUESTS]
+
+
+def register(metric):
+    """Add a metric (e.g. a Gauge) to the /metrics output"""
+    _registry.append(metric)
+    return metric
+
+
+def cache_event(cache, hit):
+    """Count a cache hit or miss"""
+    CACHE_EVENTS.inc(cache, 'hit' if hit else 'miss')
+
+
+# ============= SQL TIMING =============
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    if not has_request_context():
+        return
+    stats = g.get('_sql_stats')
+    if stats is None:
+        return
+    stats[0] += 1
+    stats[1] += elapsed
+    if len(stats[2]) < MAX_LOGGED_STATEMENTS:
+        stats[2].append((elapsed, statement))
+
+
+# ============= REQUEST HOOKS =============
+
+def _start_request():
+    g._request_started = time.perf_counter()
+    g._sql_stats = [0, 0.0, []]
+
+
+def _finish_request(response):
+    started = g.pop('_request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    queries, sql_seconds, statements = g.pop('_sql_stats', (0, 0.0, []))
+    endpoint = request.endpoint or 'unmatched'
+
+    REQUEST_LATENCY.observe(elapsed, endpoint, request.method, str(response.status_code))
+    REQUEST_QUERIES.observe(queries, endpoint)
+    if queries:
+        SQL_QUERIES.inc(endpoint, amount=queries)
+        SQL_SECONDS.inc(endpoint, amount=sql_seconds)
+    if not response.is_streamed:
+        RESPONSE_SIZE.observe(response.calculate_content_length() or 0, endpoint)
+
+    threshold = current_app.config.get('SLOW_REQUEST_SECONDS')
+    if threshold and elapsed >= threshold:
+        SLOW_REQUESTS.inc(endpoint)
+        lines = [f'  {seconds * 1000:.1f}ms  {" ".join(statement.split())[:300]}'
+                 for seconds, statement in statements]
+        current_app.logger.warning('Slow request %s %s: %.0fms, %d queries (%.0fms)\n%s',
+                                   request.method, request.full_path, elapsed * 1000,
+                                   queries, sql_seconds * 1000, '\n'.join(lines))
+    return response
+
+
+def metrics_view():
+    """Prometheus text exposition of this process's metrics"""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Unauthorized\n', 401, mimetype='text/plain')
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def init_metrics(app):
+    """Install the request hooks and the /metrics endpoint"""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -4,5 +4,14 @@ from app.models.demographic import Demographic
 from app.models.location import Location
 from app.models.search_history import SearchHistory
 from app.models.saved_address import SavedAddress
+from app.models.competitor_density import CompetitorDensity
+from app.models.data_version import DataVersion
+from app.models.tombstone import Tombstone
+from app.models.admin_stat import AdminStat
+from app.models.geocode_cache import GeocodeCache
+from app.models.zip_boundary import ZipBoundary
+from app.models.zip_boundary_shape import ZipBoundaryShape
 
-__all__ = ['User', 'Demographic', 'Location', 'SearchHistory', 'SavedAddress']
+__all__ = ['User', 'Demographic', 'Location', 'SearchHistory', 'SavedAddress',
+           'CompetitorDensity', 'DataVersion', 'Tombstone', 'AdminStat', 'GeocodeCache',
+           'ZipBoundary', 'ZipBoundaryShape']
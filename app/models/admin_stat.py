@@ -0,0 +1,14 @@
+from app.extensions import db
+
+
+class AdminStat(db.Model):
+    """One admin dashboard counter, kept up to date by the writes themselves"""
+    __tablename__ = 'admin_stats'
+    
+    # e.g. ('locations', ''), ('locations_by_type', 'cafe'), ('signups', '2024-05-01')
+    metric = db.Column(db.String(50), primary_key=True)
+    key = db.Column(db.String(100), primary_key=True, default='')
+    value = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<AdminStat {self.metric}[{self.key}]={self.value}>'
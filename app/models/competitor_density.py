@@ -0,0 +1,31 @@
+from app.extensions import db
+from datetime import datetime
+
+# Radius bands in miles; each row counts competitors within that distance
+# of the ZIP centroid (cumulative, so 3 includes everything within 1)
+RADIUS_BANDS = (1, 3, 5, 10)
+
+
+class CompetitorDensity(db.Model):
+    __tablename__ = 'competitor_density'
+    
+    zip_code = db.Column(db.String(10), primary_key=True)
+    business_type = db.Column(db.String(50), primary_key=True)
+    radius_miles = db.Column(db.Integer, primary_key=True)
+    competitors = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_competitor_density_type_radius', 'business_type', 'radius_miles'),
+    )
+    
+    def to_dict(self):
+        return {
+            'zip_code': self.zip_code,
+            'business_type': self.business_type,
+            'radius_miles': self.radius_miles,
+            'competitors': self.competitors
+        }
+    
+    def __repr__(self):
+        return f'<CompetitorDensity {self.zip_code} {self.business_type} {self.radius_miles}mi>'
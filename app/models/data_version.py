@@ -0,0 +1,14 @@
+from app.extensions import db
+from datetime import datetime
+
+
+class DataVersion(db.Model):
+    """Per-table change counter, bumped in the transaction that writes the table"""
+    __tablename__ = 'data_versions'
+    
+    table_name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DataVersion {self.table_name} v{self.version}>'
@@ -1,9 +1,47 @@
 from app.extensions import db
 from datetime import datetime
 
+# Filter buckets shared by the API and the map sidebar: key -> (min, max),
+# min inclusive, max exclusive, None meaning unbounded
+INCOME_BUCKETS = {
+    'low': (None, 40000),
+    'middle': (40000, 75000),
+    'upper': (75000, 120000),
+    'high': (120000, None),
+}
+
+POPULATION_BUCKETS = {
+    'small': (None, 1000),
+    'medium': (1000, 10000),
+    'large': (10000, None),
+}
+
+HOME_VALUE_BUCKETS = {
+    'low': (None, 100000),
+    'mid': (100000, 200000),
+    'high': (200000, None),
+}
+
+INCOME_LABELS = {
+    'low': 'Low Income',
+    'middle': 'Middle Income',
+    'upper': 'Upper Middle Income',
+    'high': 'High Income',
+}
+
+
+def income_range(median_income):
+    """Label for a median income value"""
+    if not median_income:
+        return 'Unknown'
+    for key, (low, high) in INCOME_BUCKETS.items():
+        if high is None or median_income < high:
+            return INCOME_LABELS[key]
+
+
 class Demographic(db.Model):
     __tablename__ = 'demographics'
-    
+
     id = db.Column(db.Integer, primary_key=True)
     zip_code = db.Column(db.String(10), unique=True, nullable=False)
     city = db.Column(db.String(100), nullable=True)
@@ -13,19 +51,25 @@ class Demographic(db.Model):
     median_age = db.Column(db.Float, nullable=True)
     median_home_value = db.Column(db.Integer, nullable=True)
     households = db.Column(db.Integer, nullable=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    
+
+    # Indexes backing the /api/demographics filters and data versioning
+    __table_args__ = (
+        db.Index('ix_demographics_income_population', 'median_income', 'population'),
+        db.Index('ix_demographics_population_income', 'population', 'median_income'),
+        db.Index('ix_demographics_home_value', 'median_home_value'),
+        db.Index('ix_demographics_lat_lon', 'latitude', 'longitude'),
+        db.Index('ix_demographics_city_lower', db.func.lower(city)),
+        db.Index('ix_demographics_updated_at', 'updated_at'),
+        # Sort orders of the admin listing
+        db.Index('ix_demographics_state', 'state'),
+        db.Index('ix_demographics_population', 'population'),
+    )
+
     def __repr__(self):
         return f'<Demographic {self.zip_code} - {self.city}, {self.state}>'
-    
+
     def get_income_range(self):
-        if not self.median_income:
-            return 'Unknown'
-        if self.median_income < 40000:
-            return 'Low Income'
-        elif self.median_income < 75000:
-            return 'Middle Income'
-        elif self.median_income < 120000:
-            return 'Upper Middle Income'
-        else:
-            return 'High Income'
\ No newline at end of file
+        return income_range(self.median_income)
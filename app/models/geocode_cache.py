@@ -0,0 +1,18 @@
+from app.extensions import db
+from datetime import datetime
+
+
+class GeocodeCache(db.Model):
+    """Known coordinates of a street address, keyed on its normalized form"""
+    __tablename__ = 'geocode_cache'
+    
+    # See location_import.address_key(), e.g. '123 n main st|springfield|il|62701'
+    address_key = db.Column(db.String(400), primary_key=True)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    # 'import' (coordinates that came with an imported row) or 'file' (load-geocodes)
+    source = db.Column(db.String(20), nullable=False, default='import')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<GeocodeCache {self.address_key}>'
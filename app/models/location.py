@@ -15,10 +15,19 @@ class Location(db.Model):
     longitude = db.Column(db.Float)
     business_type = db.Column(db.String(50))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Foreign key - MUST be 'user.id' NOT 'users.id'
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
+    __table_args__ = (
+        db.Index('ix_locations_user_updated_at', 'user_id', 'updated_at'),
+        # Sort orders of the admin listing
+        db.Index('ix_locations_created_at', 'created_at'),
+        db.Index('ix_locations_name', 'name'),
+        db.Index('ix_locations_business_type', 'business_type'),
+    )
+    
     def to_dict(self):
         """Convert to dictionary for JSON responses"""
         return {
@@ -31,7 +40,8 @@ class Location(db.Model):
             'latitude': self.latitude,
             'longitude': self.longitude,
             'business_type': self.business_type,
-            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M') if self.created_at else None
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M') if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
     
     def __repr__(self):
@@ -0,0 +1,22 @@
+from app.extensions import db
+from datetime import datetime
+
+
+class Tombstone(db.Model):
+    """A deleted row, kept for a while so ?since= clients can drop it too"""
+    __tablename__ = 'tombstones'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    # Primary or natural key of the deleted row (location id, zip code)
+    row_key = db.Column(db.String(50), nullable=False)
+    # Owner of the deleted row, for tables scoped per user
+    user_id = db.Column(db.Integer, nullable=True)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_tombstones_table_deleted_at', 'table_name', 'deleted_at'),
+    )
+    
+    def __repr__(self):
+        return f'<Tombstone {self.table_name} {self.row_key}>'
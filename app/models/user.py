@@ -1,7 +1,7 @@
 from app.extensions import db
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from app.services.passwords import hash_password, verify_password
 
 class User(UserMixin, db.Model):
     __tablename__ = 'user'
@@ -12,18 +12,18 @@ class User(UserMixin, db.Model):
     email = db.Column(db.String(120), unique=True, nullable=True)
     phone = db.Column(db.String(20), nullable=True)
     is_admin = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     # Relationships
     locations = db.relationship('Location', backref='user', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        """Hash and set password"""
-        self.password_hash = generate_password_hash(password)
+        """Hash and set password (on the hashing pool; may raise HashingBusy)"""
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        """Check if password matches hash"""
-        return check_password_hash(self.password_hash, password)
+        """Check if password matches hash (on the hashing pool; may raise HashingBusy)"""
+        return verify_password(self.password_hash, password)
     
     def to_dict(self):
         """Convert to dictionary"""
@@ -0,0 +1,23 @@
+from app.extensions import db
+from datetime import datetime
+
+
+class ZipBoundary(db.Model):
+    """Full-resolution ZCTA polygon, stored as packed NumPy arrays"""
+    __tablename__ = 'zip_boundaries'
+    
+    zip_code = db.Column(db.String(10), primary_key=True)
+    min_lon = db.Column(db.Float, nullable=False)
+    min_lat = db.Column(db.Float, nullable=False)
+    max_lon = db.Column(db.Float, nullable=False)
+    max_lat = db.Column(db.Float, nullable=False)
+    # float64 lon, lat pairs of every ring, rings closed
+    vertices = db.Column(db.LargeBinary, nullable=False)
+    # int32 vertex count of each ring, and ring count of each polygon
+    # (exterior ring first, then its holes)
+    ring_sizes = db.Column(db.LargeBinary, nullable=False)
+    polygon_sizes = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ZipBoundary {self.zip_code}>'
@@ -0,0 +1,16 @@
+from app.extensions import db
+
+
+class ZipBoundaryShape(db.Model):
+    """A ZIP boundary simplified for one zoom level, TopoJSON-encoded"""
+    __tablename__ = 'zip_boundary_shapes'
+    
+    zip_code = db.Column(db.String(10), db.ForeignKey('zip_boundaries.zip_code'), primary_key=True)
+    zoom = db.Column(db.Integer, primary_key=True)
+    # JSON list of delta-encoded, quantized ring arcs (see services.boundaries)
+    arcs = db.Column(db.Text, nullable=False)
+    # JSON list of the ring count of each polygon
+    rings = db.Column(db.Text, nullable=False)
+    
+    def __repr__(self):
+        return f'<ZipBoundaryShape {self.zip_code} z{self.zoom}>'
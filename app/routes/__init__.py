@@ -1 +1,16 @@
 # This file makes 'routes' a Python package
+from werkzeug.utils import import_string
+
+
+class LazyView:
+    """A view imported from its module on the first request that needs it"""
+
+    def __init__(self, import_name):
+        self.__module__, self.__name__ = import_name.rsplit('.', 1)
+        self.import_name = import_name
+        self._view = None
+
+    def __call__(self, *args, **kwargs):
+        if self._view is None:
+            self._view = import_string(self.import_name)
+        return self._view(*args, **kwargs)
@@ -1,11 +1,15 @@
-from flask import Blueprint, render_template, redirect, url_for, flash
+from flask import (render_template, redirect, url_for, flash, request, abort, jsonify,
+                   Response, stream_with_context, current_app)
 from flask_login import login_required, current_user
 from functools import wraps
 from app.models import User, Location, Demographic
-from app.extensions import db
+from app.models.demographic import INCOME_LABELS
+from app.services import admin_stats
+from app.services.keyset import keyset_page, parse_limit, CursorError
+from app.services.history_buffer import get_history_buffer
+from app.services.exports import MIMETYPES, ExportError, check_export, stream_export
 
-# Changed from 'bp' to 'admin' and removed url_prefix (it's in app/__init__.py)
-admin = Blueprint('admin', __name__)
+# Routed lazily from app/routes/admin_urls.py (url_prefix is in app/__init__.py)
 
 def admin_required(f):
     """Decorator to require admin role"""
@@ -21,50 +25,90 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-@admin.route('/')
 @login_required
 @admin_required
 def panel():
     """Admin panel - only accessible by admins"""
-    users = User.query.all()
-    locations = Location.query.all()
-    demographics = Demographic.query.all()
-    
-    # Get statistics - is_admin is a boolean field, not a method
-    total_users = len(users)
-    total_admins = sum(1 for u in users if u.is_admin)
-    total_locations = len(locations)
-    total_demographics = len(demographics)
-    
+    # Counters kept up to date on write; no table scans here
+    stats = admin_stats.summary()
+    totals = stats['totals']
     return render_template('admin/panel.html',
-                         users=users,
-                         locations=locations,
-                         demographics=demographics,
-                         total_users=total_users,
-                         total_admins=total_admins,
-                         total_locations=total_locations,
-                         total_demographics=total_demographics)
+                         groups=stats['groups'],
+                         income_labels=INCOME_LABELS,
+                         signup_days=admin_stats.SIGNUP_DAYS,
+                         total_users=totals['users'],
+                         total_admins=totals['admins'],
+                         total_locations=totals['locations'],
+                         total_demographics=totals['demographics'])
+
+
+# ============= LISTINGS =============
+
+# sort name -> column; every one of them is indexed (with id as tie-breaker)
+USER_SORTS = {'created_at': User.created_at, 'username': User.username, 'id': User.id}
+LOCATION_SORTS = {'created_at': Location.created_at, 'name': Location.name,
+                  'business_type': Location.business_type, 'id': Location.id}
+DEMOGRAPHIC_SORTS = {'zip_code': Demographic.zip_code, 'state': Demographic.state,
+                     'population': Demographic.population, 'id': Demographic.id}
+
+
+def _listing(model, sorts, default_sort, default_dir, template, name):
+    """Render one keyset-paginated page of a table"""
+    sort = request.args.get('sort', default_sort)
+    if sort not in sorts:
+        sort = default_sort
+    direction = request.args.get('dir', default_dir if sort == default_sort else 'asc')
+    if direction not in ('asc', 'desc'):
+        direction = 'asc'
+    limit = parse_limit(request.args.get('limit'))
+    try:
+        records, next_cursor = keyset_page(model.query, sorts[sort], model.id,
+                                           descending=direction == 'desc',
+                                           cursor=request.args.get('after'), limit=limit)
+    except CursorError:
+        abort(400)
+    return render_template(template, **{name: records},
+                           sort=sort, direction=direction, limit=limit,
+                           next_cursor=next_cursor,
+                           first_page=not request.args.get('after'))
+
 
-@admin.route('/users')
 @login_required
 @admin_required
 def manage_users():
     """Manage all users"""
-    users = User.query.order_by(User.created_at.desc()).all()
-    return render_template('admin/users.html', users=users)
+    return _listing(User, USER_SORTS, 'created_at', 'desc', 'admin/users.html', 'users')
 
-@admin.route('/locations')
 @login_required
 @admin_required
 def manage_locations():
     """Manage all locations"""
-    locations = Location.query.order_by(Location.created_at.desc()).all()
-    return render_template('admin/locations.html', locations=locations)
+    return _listing(Location, LOCATION_SORTS, 'created_at', 'desc', 'admin/locations.html', 'locations')
 
-@admin.route('/demographics')
 @login_required
 @admin_required
 def manage_demographics():
     """Manage demographic data"""
-    demographics = Demographic.query.order_by(Demographic.zip_code).all()
-    return render_template('admin/demographics.html', demographics=demographics)
\ No newline at end of file
+    return _listing(Demographic, DEMOGRAPHIC_SORTS, 'zip_code', 'asc', 'admin/demographics.html', 'demographics')
+
+
+# ============= EXPORTS =============
+
+@login_required
+@admin_required
+def export(table, fmt):
+    """Stream a whole table as CSV, NDJSON or Parquet (?gzip=1 to compress)"""
+    compress = request.args.get('gzip') == '1'
+    try:
+        check_export(table, fmt, compress)
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+    if table == 'search_history':
+        # Include searches still waiting in this worker's write buffer
+        get_history_buffer(current_app).flush()
+    filename = f'{table}.{fmt}' + ('.gz' if compress else '')
+    response = Response(stream_with_context(stream_export(table, fmt, compress)),
+                        mimetype='application/gzip' if compress else MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,17 @@
+from flask import Blueprint
+from app.routes import LazyView
+
+# URL rules for the admin pages. The views (and what they import) live in
+# app/routes/admin.py, which is only imported once an admin page is hit.
+admin = Blueprint('admin', __name__)
+
+ADMIN_VIEWS = [
+    ('/', 'panel'),
+    ('/users', 'manage_users'),
+    ('/locations', 'manage_locations'),
+    ('/demographics', 'manage_demographics'),
+    ('/export/<table>.<fmt>', 'export'),
+]
+
+for rule, endpoint in ADMIN_VIEWS:
+    admin.add_url_rule(rule, endpoint, LazyView(f'app.routes.admin.{endpoint}'))
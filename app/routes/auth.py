@@ -2,10 +2,20 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
 from app.extensions import db
 from app.models import User
+from app.services.identity import store_claims, clear_claims
+from app.services.passwords import HashingBusy, needs_rehash
 
 # Changed from 'bp' to 'auth' and removed url_prefix (it's in app/__init__.py)
 auth = Blueprint('auth', __name__)
 
+# Seconds a client is asked to wait when the hashing pool is saturated
+RETRY_AFTER = 2
+
+def busy(template):
+    """429 page for when every password hashing slot is taken"""
+    flash('The server is busy, please try again in a moment.', 'error')
+    return render_template(template), 429, {'Retry-After': str(RETRY_AFTER)}
+
 @auth.route('/login', methods=['GET', 'POST'])
 def login():
     # If user is already logged in, redirect to map
@@ -22,8 +32,23 @@ def login():
         
         user = User.query.filter_by(username=username).first()
         
-        if user and user.check_password(password):
+        try:
+            valid = user is not None and user.check_password(password)
+        except HashingBusy:
+            return busy('auth/login.html')
+
+        # Hash cost was changed since this password was set; upgrade it now
+        if valid and needs_rehash(user.password_hash):
+            try:
+                user.set_password(password)
+                db.session.commit()
+            except HashingBusy:
+                # Keep the existing hash; a later login upgrades it
+                pass
+
+        if valid:
             login_user(user)
+            store_claims(user)
             flash(f'Welcome back, {user.username}!', 'success')
             
             # Redirect to next page or map
@@ -69,7 +94,10 @@ def register():
         
         # Create new user
         new_user = User(username=username, email=email, is_admin=False)
-        new_user.set_password(password)
+        try:
+            new_user.set_password(password)
+        except HashingBusy:
+            return busy('auth/register.html')
         
         db.session.add(new_user)
         db.session.commit()
@@ -83,5 +111,6 @@ def register():
 @login_required
 def logout():
     logout_user()
+    clear_claims()
     flash('You have been logged out.', 'success')
     return redirect(url_for('auth.login'))
\ No newline at end of file
@@ -1,11 +1,28 @@
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+import hashlib
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, make_response, current_app
 from flask_login import login_required, current_user
+from app.database import read_only
 from app.extensions import db
 from app.models import Demographic, Location, User, SearchHistory, SavedAddress
+from app.services.demographic_query import (FilterError, parse_filters, parse_fields,
+                                            parse_limit, parse_since, query_demographics,
+                                            changed_outside)
+from app.services.history_buffer import get_history_buffer
+from app.services import admin_stats
+from app.services.identity import identity, identity_required
+from app.services.passwords import HashingBusy
+from app.routes.auth import busy
+from app.compression import etag_variants
+from app.services.data_version import (data_version, deleted_since, sync_timestamp,
+                                       within_retention)
 from datetime import datetime
 
 main = Blueprint('main', __name__)
 
+# The analytics services (NumPy column stores, spatial index, scoring) are
+# imported inside the API views that use them, so booting a worker doesn't
+# pay for them
+
 # ============= PAGE ROUTES =============
 
 @main.route('/')
@@ -41,12 +58,15 @@ def profile():
                 return redirect(url_for('main.profile'))
             
             if current_password:
-                from werkzeug.security import check_password_hash, generate_password_hash
-                if check_password_hash(current_user.password_hash, current_password):
-                    current_user.password_hash = generate_password_hash(new_password)
-                else:
-                    flash('Current password is incorrect!', 'error')
-                    return redirect(url_for('main.profile'))
+                try:
+                    if current_user.check_password(current_password):
+                        current_user.set_password(new_password)
+                    else:
+                        flash('Current password is incorrect!', 'error')
+                        return redirect(url_for('main.profile'))
+                except HashingBusy:
+                    db.session.rollback()
+                    return busy('profile.html')
         
         db.session.commit()
         flash('Profile updated successfully!', 'success')
@@ -75,81 +95,392 @@ def dashboard():
 
 # ============= API ENDPOINTS =============
 
+def _etag(*tables):
+    """Strong ETag for this request (URL and viewer) at the current table versions"""
+    viewer = identity()
+    viewer = f'{viewer.id}:{viewer.is_admin}' if viewer else ''
+    key = f'{data_version(*tables)}|{viewer}|{request.full_path}'
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def _not_modified(etag):
+    """304 response if the client already has this version, else None"""
+    if any(request.if_none_match.contains(tag) for tag in etag_variants(etag)):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def _parse_format():
+    from app.services.columnar import FORMATS
+    fmt = request.args.get('format', 'json')
+    if fmt not in FORMATS:
+        raise FilterError(f'format must be one of {", ".join(FORMATS)}')
+    return fmt
+
+def _tagged(payload, etag, private=False, fmt='json', arrays=None):
+    """Response in the requested format; `arrays` are the row columns"""
+    from app.services.columnar import BINARY_MIMETYPE, json_columns, pack
+    if fmt == 'binary':
+        response = make_response(pack(payload, arrays))
+        response.mimetype = BINARY_MIMETYPE
+    else:
+        if fmt == 'columnar':
+            payload['columns'] = json_columns(arrays)
+        response = jsonify(payload)
+    response.set_etag(etag)
+    # Revalidate every time; unchanged data costs a 304
+    response.headers['Cache-Control'] = 'private, no-cache' if private else 'no-cache'
+    return response
+
 @main.route('/api/demographics')
+@read_only
 def api_demographics():
-    """Get all demographics data"""
-    demographics = Demographic.query.all()
+    """Get demographics filtered by income, population, home value, zip/city prefix and bbox"""
+    from app.services.columnar import select_page, demographic_arrays
+    from app.services.columns import demographic_columns
+    from app.services.competitor_density import parse_radius, density_for, density_column
+    try:
+        filters = parse_filters(request.args)
+        fields = parse_fields(request.args.get('fields'))
+        limit = parse_limit(request.args.get('limit'))
+        radius = parse_radius(request.args.get('radius'))
+        since = parse_since(request.args.get('since'))
+        fmt = _parse_format()
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Competitors of a business type within `radius` miles of each ZIP
+    business_type = request.args.get('business_type')
+    etag = _etag('demographics', 'locations') if business_type else _etag('demographics')
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+    
+    as_of = sync_timestamp()
+    # Too old a since (tombstones expired) gets the full set
+    delta = since is not None and within_retention(since)
+    after = request.args.get('after')
+    
+    if fmt == 'json':
+        rows, next_cursor = query_demographics(filters, fields, limit, after,
+                                               since=since if delta else None)
+        if business_type:
+            counts = density_for([row['zip_code'] for row in rows], business_type, radius)
+            for row in rows:
+                row['competitors'] = counts.get(row['zip_code'], 0)
+        payload = {'demographics': rows, 'count': len(rows)}
+        arrays = None
+    else:
+        # Cut straight from the column store: no SQL, no per-row dicts
+        columns = demographic_columns()
+        page = select_page(columns, filters, limit, after, since=since if delta else None)
+        extra = {'competitors': density_column(columns, business_type, radius)} if business_type else None
+        arrays = demographic_arrays(columns, page, fields, extra)
+        next_cursor = page.next_cursor
+        payload = {'count': len(page.idx)}
+    
+    payload['next_cursor'] = next_cursor
+    payload['as_of'] = as_of.isoformat()
+    if since is not None:
+        payload['full'] = not delta
+        # Deleted rows and rows that changed out of the filter; sent with the first page
+        deleted = []
+        if delta and not after:
+            outside = changed_outside(filters, since) if fmt == 'json' else page.changed_outside
+            deleted = sorted(set(deleted_since('demographics', since)) | set(outside))
+        payload['deleted'] = deleted
+    return _tagged(payload, etag, fmt=fmt, arrays=arrays)
+
+@main.route('/api/demographics/<zip_code>/similar')
+@read_only
+def api_similar_zips(zip_code):
+    """ZIPs with the most similar demographics, optionally in a state or radius"""
+    from app.services.similarity import parse_similar_args, similar_zips
+    try:
+        options = parse_similar_args(request.args)
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    etag = _etag('demographics')
+    cached = _not_modified(etag)
+    if cached:
+        return cached
     
-    result = []
-    for demo in demographics:
-        # Determine income range
-        if demo.median_income:
-            if demo.median_income < 40000:
-                income_range = 'Low Income'
-            elif demo.median_income < 75000:
-                income_range = 'Middle Income'
-            elif demo.median_income < 120000:
-                income_range = 'Upper Middle'
-            else:
-                income_range = 'High Income'
+    try:
+        similar = similar_zips(zip_code, **options)
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
+    if similar is None:
+        return jsonify({'error': 'Unknown ZIP code'}), 404
+    return _tagged({'zip_code': zip_code, 'similar': similar, 'count': len(similar)}, etag)
+
+@main.route('/api/search/suggest')
+@read_only
+def api_search_suggest():
+    """Typeahead matches for a ZIP, city or state, most populous first"""
+    from app.services.suggest import parse_suggest_args, suggest
+    try:
+        query, limit = parse_suggest_args(request.args)
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
+
+    etag = _etag('demographics')
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+
+    suggestions = suggest(query, limit)
+    return _tagged({'query': query, 'suggestions': suggestions, 'count': len(suggestions)}, etag)
+
+@main.route('/api/boundaries')
+@read_only
+def api_boundaries():
+    """ZIP boundary shapes in a bbox as TopoJSON, simplified for the zoom"""
+    from app.services.boundaries import parse_boundary_args, topology
+    try:
+        bbox, zoom = parse_boundary_args(request.args)
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    etag = _etag('zip_boundaries')
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+    
+    # Stored pre-encoded; served without building a payload dict
+    response = make_response(topology(bbox, zoom))
+    response.mimetype = 'application/json'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@main.route('/api/boundaries/lookup')
+@read_only
+def api_boundary_lookup():
+    """The ZIP whose boundary contains lat/lon"""
+    from app.services.zip_lookup import parse_point_args, zip_at
+    try:
+        lat, lon = parse_point_args(request.args)
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
+    zip_code = zip_at(lat, lon)
+    if zip_code is None:
+        return jsonify({'error': 'No ZIP boundary contains this point'}), 404
+    return jsonify({'zip_code': zip_code, 'lat': lat, 'lon': lon})
+
+@main.route('/api/trade-area', methods=['GET', 'POST'])
+@read_only
+def api_trade_area():
+    """Population, households and weighted medians within radii of sites"""
+    from app.services.trade_area import parse_trade_area_args, parse_trade_area_json, trade_areas
+    try:
+        if request.method == 'POST':
+            # A batch of candidate sites, evaluated in one pass
+            sites, radii, weighting, ids = parse_trade_area_json(request.get_json(silent=True))
         else:
-            income_range = 'Unknown'
-        
-        result.append({
-            'id': demo.id,
-            'zip_code': demo.zip_code,
-            'city': demo.city,
-            'state': demo.state,
-            'population': demo.population,
-            'median_income': demo.median_income,
-            'median_age': demo.median_age,
-            'median_home_value': demo.median_home_value,
-            'households': demo.households,
-            'income_range': income_range
-        })
+            sites, radii, weighting = parse_trade_area_args(request.args)
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify({
-        'demographics': result,
-        'count': len(result)
-    })
+    if request.method == 'POST':
+        results = []
+        for site_id, (lat, lon), rings in zip(ids, sites, trade_areas(sites, radii, weighting)):
+            result = {'lat': lat, 'lon': lon, 'rings': rings}
+            if site_id is not None:
+                result['id'] = site_id
+            results.append(result)
+        return jsonify({'sites': results, 'count': len(results), 'weighting': weighting})
+    
+    etag = _etag('demographics')
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+    (lat, lon), = sites
+    rings = trade_areas(sites, radii, weighting)[0]
+    return _tagged({'lat': lat, 'lon': lon, 'rings': rings, 'weighting': weighting}, etag)
 
 @main.route('/api/locations')
+@read_only
 def api_locations():
-    """Get all business locations"""
-    if current_user.is_authenticated and current_user.is_admin:
-        locations = Location.query.all()
-    elif current_user.is_authenticated:
-        locations = Location.query.filter_by(user_id=current_user.id).all()
-    else:
-        locations = []
+    """Get business locations, optionally within a bbox or nearest to a point"""
+    import numpy as np
+    from app.services.columnar import LOCATION_FIELDS, location_arrays
+    from app.services.spatial_index import parse_spatial_args, find_locations
+    viewer = identity()
+    if viewer is None:
+        return jsonify({'locations': [], 'count': 0})
+    
+    try:
+        spatial = parse_spatial_args(request.args)
+        since = parse_since(request.args.get('since'))
+        fmt = _parse_format()
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
+    if spatial is not None and since is not None:
+        return jsonify({'error': 'since cannot be combined with bbox or near'}), 400
+    
+    etag = _etag('locations')
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+    as_of = sync_timestamp()
+    
+    # Admins see every location, everyone else only their own
+    user_id = None if viewer.is_admin else viewer.id
+    # Column tuples instead of ORM objects for the column formats
+    query = Location.query if fmt == 'json' else \
+        db.session.query(*[getattr(Location, f) for f in LOCATION_FIELDS])
+    
+    if spatial is None:
+        if user_id is not None:
+            query = query.filter(Location.user_id == user_id)
+        delta = since is not None and within_retention(since)
+        if delta:
+            query = query.filter(Location.updated_at > since)
+        records = query.all()
+        payload = {'count': len(records), 'as_of': as_of.isoformat()}
+        if since is not None:
+            payload['full'] = not delta
+            payload['deleted'] = [int(key) for key in deleted_since('locations', since, user_id)] \
+                if delta else []
+        if fmt == 'json':
+            payload['locations'] = [loc.to_dict() for loc in records]
+            return _tagged(payload, etag, private=True)
+        return _tagged(payload, etag, private=True, fmt=fmt, arrays=location_arrays(records))
+    
+    ids, distances = find_locations(spatial, user_id)
+    
+    by_id = {}
+    for start in range(0, len(ids), 500):
+        for record in query.filter(Location.id.in_(ids[start:start + 500])):
+            by_id[record.id] = record
+    
+    found = [i for i, location_id in enumerate(ids) if location_id in by_id]
+    records = [by_id[ids[i]] for i in found]
+    payload = {'count': len(records), 'as_of': as_of.isoformat()}
+    
+    if fmt == 'json':
+        result = []
+        for i, record in zip(found, records):
+            row = record.to_dict()
+            if distances is not None:
+                row['distance_miles'] = round(distances[i], 3)
+            result.append(row)
+        payload['locations'] = result
+        return _tagged(payload, etag, private=True)
+    
+    arrays = location_arrays(records)
+    if distances is not None:
+        arrays['distance_miles'] = np.round(np.asarray(distances, dtype=np.float64)[found], 3)
+    return _tagged(payload, etag, private=True, fmt=fmt, arrays=arrays)
+
+
+@main.route('/api/locations/clusters')
+@identity_required
+@read_only
+def api_location_clusters():
+    """Marker clusters (count, centroid, business types) for a map viewport"""
+    from app.services.clusters import parse_cluster_args, find_clusters
+    viewer = identity()
+    try:
+        view = parse_cluster_args(request.args)
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    etag = _etag('locations')
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+    
+    # Same ownership rule as /api/locations
+    clusters = find_clusters(view, None if viewer.is_admin else viewer.id)
+    payload = {'clusters': clusters, 'count': len(clusters),
+               'locations': sum(c['count'] for c in clusters), 'zoom': view.zoom}
+    return _tagged(payload, etag, private=True)
+
+
+@main.route('/api/locations/import', methods=['POST'])
+@login_required
+def api_import_locations():
+    """Bulk insert the current user's locations from an uploaded CSV"""
+    from app.services.location_import import ImportFileError, import_locations
+    # A multipart upload (field "file") or the CSV as the request body
+    upload = request.files.get('file')
+    source = upload.stream if upload else request.stream
+    require = request.args.get('require_coordinates', '').lower() in ('1', 'true', 'yes')
+    try:
+        # The geocode cache is shared: only admins' files add to it
+        stats = import_locations(source, current_user.id, require_coordinates=require,
+                                 learn_geocodes=current_user.is_admin)
+    except ImportFileError as e:
+        return jsonify({'error': str(e)}), 400
+    stats['errors'] = [{'line': line, 'reason': reason} for line, reason in stats['errors']]
+    stats['seconds'] = round(stats['seconds'], 3)
+    return jsonify(stats), 201 if stats['imported'] else 200
+
+
+@main.route('/api/scores')
+@identity_required
+@read_only
+def api_scores():
+    """Rank ZIPs by a weighted opportunity score"""
+    from app.services.competitor_density import parse_radius
+    from app.services.scoring import parse_weights, parse_top, score_zips
+    try:
+        weights = parse_weights(request.args.get('weights'))
+        limit = parse_top(request.args.get('limit'))
+        radius = parse_radius(request.args.get('radius'))
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    scores = score_zips(weights,
+                        business_type=request.args.get('business_type') or None,
+                        state=request.args.get('state') or None,
+                        limit=limit,
+                        radius=radius)
     
     return jsonify({
-        'locations': [loc.to_dict() for loc in locations],
-        'count': len(locations)
+        'scores': scores,
+        'count': len(scores),
+        'weights': weights
     })
 
 
 # ============= SEARCH HISTORY API =============
 
 @main.route('/api/search-history', methods=['GET', 'POST'])
-@login_required
+@identity_required
 def api_search_history():
     """Save and retrieve search history"""
+    user_id = identity().id
+    buffer = get_history_buffer(current_app)
     if request.method == 'POST':
-        data = request.json
-        
-        search = SearchHistory(
-            user_id=current_user.id,
-            zip_code=data.get('zip_code'),
-            filters=data.get('filters', {})
-        )
-        db.session.add(search)
-        db.session.commit()
-        
-        return jsonify({'success': True, 'id': search.id})
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'body must be a JSON object'}), 400
+        # Checked here: a value the insert can't bind would fail the whole batch
+        zip_code = data.get('zip_code')
+        if isinstance(zip_code, int) and not isinstance(zip_code, bool):
+            zip_code = str(zip_code)
+        if zip_code is not None and not isinstance(zip_code, str):
+            return jsonify({'error': 'zip_code must be a string'}), 400
+        zip_code = (zip_code or '').strip() or None
+        if zip_code and len(zip_code) > 10:
+            return jsonify({'error': 'zip_code is at most 10 characters'}), 400
+        filters = data.get('filters')
+        if filters is None:
+            filters = {}
+        if not isinstance(filters, dict):
+            return jsonify({'error': 'filters must be an object'}), 400
+
+        # Written in batches by the history buffer, not per click
+        status = buffer.add(user_id, zip_code, filters)
+        return jsonify({'success': True, 'status': status})
     
-    # GET request - retrieve history
-    searches = SearchHistory.query.filter_by(user_id=current_user.id)\
+    # GET request - retrieve history, including entries still buffered
+    if buffer.has_pending(user_id):
+        buffer.flush()
+    searches = SearchHistory.query.filter_by(user_id=user_id)\
         .order_by(SearchHistory.search_date.desc())\
         .limit(20).all()
     
@@ -223,11 +554,13 @@ def api_admin_stats():
     if not current_user.is_admin:
         return jsonify({'error': 'Unauthorized'}), 403
     
+    totals = admin_stats.summary()['totals']
     return jsonify({
-        'users': User.query.count(),
-        'locations': Location.query.count(),
-        'demographics': Demographic.query.count(),
-        'saved_addresses': SavedAddress.query.count()
+        'users': totals['users'],
+        'locations': totals['locations'],
+        'demographics': totals['demographics'],
+        'saved_addresses': SavedAddress.query.count(),
+        'search_history_buffer': get_history_buffer(current_app).snapshot_stats()
     })
 
 
@@ -0,0 +1,53 @@
+import hashlib
+from flask import Blueprint, request, jsonify, make_response, current_app
+from app.database import read_only
+from app.services.demographic_query import FilterError, parse_filters
+from app.services.tile_cache import get_tile_cache
+from app.services.identity import identity
+
+tiles = Blueprint('tiles', __name__)
+
+MAX_ZOOM = 18
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'f32': 'application/octet-stream',
+}
+
+
+@tiles.route('/<metric>/<int:z>/<int:x>/<int:y>')
+@tiles.route('/<metric>/<int:z>/<int:x>/<int:y>.<fmt>')
+@read_only
+def tile(metric, z, x, y, fmt='png'):
+    """Heat map tile for a demographic metric or business locations"""
+    # The renderer (NumPy) is only imported once tiles are requested
+    from app.services.heatmap import METRICS, get_tile
+    if metric not in METRICS or fmt not in CONTENT_TYPES:
+        return jsonify({'error': 'Unknown metric or format'}), 404
+    if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': 'Tile out of range'}), 404
+    
+    try:
+        filters = parse_filters(request.args)
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
+    # The tile itself is the viewport
+    filters['bbox'] = None
+    
+    scope = None
+    business_type = None
+    if METRICS[metric][0] == 'locations':
+        # Same ownership rules as /api/locations
+        viewer = identity()
+        if viewer is None:
+            return jsonify({'error': 'Unauthorized'}), 401
+        scope = 'all' if viewer.is_admin else viewer.id
+        business_type = request.args.get('business_type') or None
+    
+    key, data = get_tile(get_tile_cache(current_app), metric, filters, z, x, y,
+                         fmt, scope, business_type)
+    
+    response = make_response(data)
+    response.headers['Content-Type'] = CONTENT_TYPES[fmt]
+    response.headers['Cache-Control'] = 'private, max-age=60' if scope else 'public, max-age=60'
+    response.set_etag(hashlib.sha1(key.encode()).hexdigest())
+    return response.make_conditional(request)
@@ -0,0 +1,117 @@
+"""Versioned schema migrations, run once per deploy instead of on every boot.
+
+The database records the last migration applied in the one-row
+schema_version table. Booting only reads that row: the development
+profile applies whatever is pending right there, the production profile
+refuses to start until `flask upgrade-db` has been run, so N gunicorn
+workers don't each reflect every table and race each other's ALTERs.
+
+New schema changes are appended to MIGRATIONS; never edit an applied one.
+"""
+import click
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+from app.extensions import db
+
+schema_version = db.Table('schema_version', db.Column('version', db.Integer, nullable=False))
+
+# Columns added after a table was first created. create_all() only
+# creates missing tables, so existing databases get these via ALTER TABLE,
+# optionally followed by an expression to fill existing rows with.
+ADDED_COLUMNS = [
+    ('demographics', 'latitude', 'FLOAT', None),
+    ('demographics', 'longitude', 'FLOAT', None),
+    ('locations', 'updated_at', 'DATETIME', 'created_at'),
+]
+
+
+class SchemaOutdated(RuntimeError):
+    """The database is behind the code and auto-upgrade is off"""
+
+
+def _baseline(connection):
+    """Create missing tables, add legacy columns and indexes, build admin stats"""
+    from app import models  # noqa: F401  (registers every table on the metadata)
+    from app.services.admin_stats import rebuild as rebuild_admin_stats
+    db.metadata.create_all(connection)
+
+    inspector = inspect(connection)
+    for table, column, ddl, backfill in ADDED_COLUMNS:
+        existing = {c['name'] for c in inspector.get_columns(table)}
+        if column not in existing:
+            connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+            if backfill:
+                connection.execute(text(f'UPDATE {table} SET {column} = {backfill}'))
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+    if not connection.execute(text("SELECT 1 FROM admin_stats WHERE metric = 'users'")).first():
+        rebuild_admin_stats(connection)
+
+
+def _geocode_cache(connection):
+    from app.models import GeocodeCache
+    GeocodeCache.__table__.create(connection, checkfirst=True)
+
+
+def _zip_boundaries(connection):
+    from app.models import ZipBoundary, ZipBoundaryShape
+    for model in (ZipBoundary, ZipBoundaryShape):
+        model.__table__.create(connection, checkfirst=True)
+
+
+# (version, description, step(connection)), applied in order
+MIGRATIONS = [
+    (1, 'baseline tables, columns, indexes and admin stats', _baseline),
+    (2, 'geocode_cache table for bulk location imports', _geocode_cache),
+    (3, 'zip_boundaries and zip_boundary_shapes tables', _zip_boundaries),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version():
+    """The database's schema version (0 for a database that predates versioning)"""
+    try:
+        # On its own connection: a failed statement aborts a Postgres transaction
+        with db.engine.connect() as connection:
+            return connection.execute(select(db.func.max(schema_version.c.version))).scalar() or 0
+    except DBAPIError:
+        return 0
+
+
+def upgrade(log=None):
+    """Apply pending migrations; returns the versions applied"""
+    applied = []
+    version = current_version()
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        with db.engine.begin() as connection:
+            step(connection)
+            connection.execute(schema_version.delete())
+            connection.execute(schema_version.insert().values(version=number))
+        applied.append(number)
+        if log:
+            log(f'Applied schema migration {number}: {description}')
+    return applied
+
+
+def check_schema(app):
+    """Boot-time check: one SELECT, upgrading only when the profile allows it"""
+    version = current_version()
+    if version >= SCHEMA_VERSION:
+        return
+    if app.config.get('SCHEMA_AUTO_UPGRADE'):
+        upgrade(log=app.logger.info)
+        return
+    message = (f'Database schema is at version {version}, the code needs '
+               f'{SCHEMA_VERSION}; run `flask upgrade-db` before starting the app')
+    if click.get_current_context(silent=True) is not None:
+        # Loaded by the `flask` command, which has to work to run upgrade-db
+        app.logger.warning(message)
+        return
+    raise SchemaOutdated(message)
@@ -0,0 +1 @@
+# Query, indexing and analytics helpers used by the routes
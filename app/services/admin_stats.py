@@ -0,0 +1,202 @@
+"""Counters behind the admin dashboard, maintained incrementally.
+
+The dashboard reads a few hundred rows from admin_stats instead of
+counting and grouping the users, locations and demographics tables on
+every page view. ORM writes adjust the counters in the same transaction
+through flush listeners: the old values of updated and deleted rows are
+read before the flush and the new values after it, and only the
+difference is applied. Core-level bulk writers call rebuild() for the
+tables they touched, which recounts them with GROUP BY queries.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+from app.extensions import db
+from app.models import AdminStat, Demographic, Location, User
+from app.models.demographic import INCOME_BUCKETS
+from app.services.upsert import insert_for
+
+INCOME_UNKNOWN = 'unknown'
+SIGNUP_DAYS = 30
+TOP_GROUPS = 15
+
+
+def income_key(median_income):
+    """INCOME_BUCKETS key for an income ('unknown' when missing or zero)"""
+    if not median_income:
+        return INCOME_UNKNOWN
+    for key, (low, high) in INCOME_BUCKETS.items():
+        if high is None or median_income < high:
+            return key
+
+
+def _income_case(column):
+    whens = [(db.or_(column.is_(None), column == 0), INCOME_UNKNOWN)]
+    whens += [(column < high, key) for key, (low, high) in INCOME_BUCKETS.items() if high is not None]
+    last = [key for key, (low, high) in INCOME_BUCKETS.items() if high is None][0]
+    return db.case(*whens, else_=last)
+
+
+def _day(value):
+    return value.strftime('%Y-%m-%d') if value else ''
+
+
+# table -> model, the columns the counters depend on, a function from a
+# row to its (metric, key) pairs, and per metric the GROUP BY expression
+# (None for a total) and an optional WHERE condition for rebuild()
+TRACKED = {
+    'user': (
+        User, ('is_admin', 'created_at'),
+        lambda row: [('users', ''), ('signups', _day(row['created_at']))]
+        + ([('admins', '')] if row['is_admin'] else []),
+        {'users': (None, None), 'admins': (None, User.is_admin.is_(True)),
+         'signups': (db.cast(db.func.date(User.created_at), db.String), None)},
+    ),
+    'locations': (
+        Location, ('business_type', 'state'),
+        lambda row: [('locations', ''), ('locations_by_type', row['business_type'] or ''),
+                     ('locations_by_state', row['state'] or '')],
+        {'locations': (None, None), 'locations_by_type': (Location.business_type, None),
+         'locations_by_state': (Location.state, None)},
+    ),
+    'demographics': (
+        Demographic, ('state', 'median_income'),
+        lambda row: [('demographics', ''), ('demographics_by_state', row['state'] or ''),
+                     ('demographics_by_income', income_key(row['median_income']))],
+        {'demographics': (None, None), 'demographics_by_state': (Demographic.state, None),
+         'demographics_by_income': (_income_case(Demographic.median_income), None)},
+    ),
+}
+
+
+def _rows(connection, model, names, ids):
+    if not ids:
+        return []
+    columns = [getattr(model, name) for name in names]
+    return [dict(row._mapping) for row in
+            connection.execute(select(*columns).where(model.id.in_(list(ids))))]
+
+
+def apply(connection, deltas):
+    """Add {(metric, key): delta} to the counters"""
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    table = AdminStat.__table__
+    insert = insert_for(connection, table)
+    connection.execute(insert.on_conflict_do_update(
+        index_elements=['metric', 'key'],
+        set_={'value': table.c.value + insert.excluded.value},
+    ), [{'metric': metric, 'key': key, 'value': value} for (metric, key), value in deltas.items()])
+    if any(value < 0 for value in deltas.values()):
+        # Groups that emptied out
+        connection.execute(table.delete().where(table.c.value <= 0, table.c.key != ''))
+
+
+def rebuild(connection, *tables):
+    """Recount the tables' counters from scratch (for bulk writes)"""
+    table = AdminStat.__table__
+    for name in tables or TRACKED:
+        model, _, _, metrics = TRACKED[name]
+        connection.execute(table.delete().where(table.c.metric.in_(list(metrics))))
+        rows = []
+        for metric, (group, condition) in metrics.items():
+            if group is None:
+                query = select(db.func.count()).select_from(model.__table__)
+                if condition is not None:
+                    query = query.where(condition)
+                rows.append({'metric': metric, 'key': '', 'value': connection.execute(query).scalar()})
+                continue
+            query = select(group, db.func.count()).group_by(group)
+            rows += [{'metric': metric, 'key': key or '', 'value': count}
+                     for key, count in connection.execute(query)]
+        connection.execute(table.insert(), _merge(rows))
+
+
+def _merge(rows):
+    # '' and NULL groups both end up under ''
+    merged = {}
+    for row in rows:
+        merged[(row['metric'], row['key'])] = merged.get((row['metric'], row['key']), 0) + row['value']
+    return [{'metric': metric, 'key': key, 'value': value} for (metric, key), value in merged.items()]
+
+
+def summary():
+    """Totals and the largest groups for the dashboard"""
+    since = _day(datetime.utcnow() - timedelta(days=SIGNUP_DAYS))
+    rows = db.session.query(AdminStat.metric, AdminStat.key, AdminStat.value)\
+        .filter(db.or_(AdminStat.metric != 'signups', AdminStat.key >= since)).all()
+    totals = {}
+    groups = {}
+    for metric, key, value in rows:
+        if metric in ('users', 'admins', 'locations', 'demographics'):
+            totals[metric] = value
+        else:
+            groups.setdefault(metric, []).append((key or 'Unspecified', value))
+    for metric, values in groups.items():
+        if metric == 'signups':
+            values.sort()
+        else:
+            values.sort(key=lambda item: (-item[1], item[0]))
+            if len(values) > TOP_GROUPS:
+                values[TOP_GROUPS - 1:] = [('Other', sum(v for _, v in values[TOP_GROUPS - 1:]))]
+    for metric in ('users', 'admins', 'locations', 'demographics'):
+        totals.setdefault(metric, 0)
+    return {'totals': totals, 'groups': groups}
+
+
+# ============= FLUSH LISTENERS =============
+
+def _changed(state, names):
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+@event.listens_for(Session, 'before_flush')
+def _before_flush(session, flush_context, instances):
+    pending = {}
+
+    def entry_for(obj):
+        return pending.setdefault(obj.__tablename__, {'new': [], 'old': set(), 'dirty': set()})
+
+    # session.new / dirty / deleted are rebuilt on every access: walk each once
+    for obj in session.new:
+        if getattr(obj, '__tablename__', None) in TRACKED:
+            entry_for(obj)['new'].append(obj)
+    deleted = set()
+    for obj in session.deleted:
+        if getattr(obj, '__tablename__', None) in TRACKED:
+            entry_for(obj)['old'].add(obj.id)
+            deleted.add(id(obj))
+    for obj in session.dirty:
+        name = getattr(obj, '__tablename__', None)
+        if name in TRACKED and id(obj) not in deleted and _changed(inspect(obj), TRACKED[name][1]):
+            entry = entry_for(obj)
+            entry['old'].add(obj.id)
+            entry['dirty'].add(obj.id)
+    if not pending:
+        return
+    connection = session.connection()
+    # The database still holds the old values
+    for name, entry in pending.items():
+        model, names, _, _ = TRACKED[name]
+        entry['old'] = _rows(connection, model, names, entry['old'])
+    session.info['admin_stats'] = pending
+
+
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    pending = session.info.pop('admin_stats', None)
+    if not pending:
+        return
+    connection = session.connection()
+    deltas = {}
+    for name, entry in pending.items():
+        model, names, contributes, _ = TRACKED[name]
+        ids = entry['dirty'] | {obj.id for obj in entry['new'] if obj.id is not None}
+        for row in entry['old']:
+            for item in contributes(row):
+                deltas[item] = deltas.get(item, 0) - 1
+        for row in _rows(connection, model, names, ids):
+            for item in contributes(row):
+                deltas[item] = deltas.get(item, 0) + 1
+    apply(connection, deltas)
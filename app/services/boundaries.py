@@ -0,0 +1,342 @@
+"""ZIP (ZCTA) boundary polygons and their per-zoom choropleth shapes.
+
+Boundaries are loaded from a local GeoJSON (or GeoJSON sequence) file, or
+a shapefile with the optional `pyshp` package, e.g. the Census cartographic
+boundary file cb_2020_us_zcta520_500k. The full-resolution rings are kept
+as packed float64 arrays for the point-in-polygon index (zip_lookup).
+
+At load time every ZIP is also simplified once per zoom in SIMPLIFY_ZOOMS:
+its coordinates are snapped to a lon/lat grid STEPS_PER_PIXEL steps per
+pixel at that zoom, then Douglas-Peucker simplified to TOLERANCE_PIXELS.
+Each zoom is simplified from the next finer one, and rings that collapse
+below a pixel are dropped. The result is stored already delta-encoded as
+TopoJSON arcs, so a choropleth request is one indexed query and string
+concatenation: no geometry work and no JSON re-encoding per request.
+"""
+import json
+import os
+import time
+from datetime import datetime
+import numpy as np
+from app.extensions import db
+from app.models import ZipBoundary, ZipBoundaryShape
+from app.services.data_version import bump, invalidate
+from app.services.demographic_query import FilterError, parse_bbox
+from app.services.geo import TILE_SIZE
+
+SIMPLIFY_ZOOMS = (4, 6, 8, 10, 12)
+STEPS_PER_PIXEL = 4
+TOLERANCE_PIXELS = 0.75
+MAX_ZOOM = 22
+# Features written per executemany
+CHUNK_SIZE = 500
+
+# Feature properties that hold the ZIP, most specific first
+ZIP_PROPERTIES = ('zcta5ce20', 'zcta5ce10', 'geoid20', 'geoid10', 'zcta5', 'zip_code',
+                  'zipcode', 'zip', 'geoid')
+SEQUENCE_EXTENSIONS = ('.geojsonl', '.geojsons', '.geojsonseq', '.ndjson', '.jsonl')
+
+# How many rejected features to keep for the report
+MAX_ERRORS = 20
+
+
+class BoundaryFileError(ValueError):
+    pass
+
+
+def grid_step(zoom):
+    """Degrees per quantization step of a zoom's shapes"""
+    return 360.0 / (TILE_SIZE * 2 ** zoom) / STEPS_PER_PIXEL
+
+
+def shape_zoom(zoom):
+    """The stored zoom that serves a map zoom"""
+    return max([z for z in SIMPLIFY_ZOOMS if z <= zoom] or [SIMPLIFY_ZOOMS[0]])
+
+
+# ============= READING =============
+
+def _shapefile_features(path):
+    try:
+        import shapefile
+    except ImportError:
+        raise BoundaryFileError('Reading shapefiles needs pyshp (pip install pyshp)')
+    with shapefile.Reader(path) as reader:
+        names = [field[0] for field in reader.fields[1:]]
+        for record in reader.iterShapeRecords():
+            yield dict(zip(names, record.record)), record.shape.__geo_interface__
+
+
+def _features(path):
+    """Yield (properties, geometry) of every feature in the file"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.shp', '.zip'):
+        yield from _shapefile_features(path)
+        return
+    with open(path, encoding='utf-8-sig') as f:
+        if extension in SEQUENCE_EXTENSIONS:
+            # One feature per line (ogr2ogr -f GeoJSONSeq): streamed
+            for line in f:
+                line = line.strip().lstrip('\x1e')
+                if line:
+                    feature = json.loads(line)
+                    yield feature.get('properties') or {}, feature.get('geometry')
+            return
+        try:
+            document = json.load(f)
+        except ValueError as exc:
+            raise BoundaryFileError(f'Not a GeoJSON file: {exc}')
+    for feature in document.get('features', ()):
+        yield feature.get('properties') or {}, feature.get('geometry')
+
+
+def _zip_of(properties):
+    values = {str(key).lower(): value for key, value in properties.items()}
+    for name in ZIP_PROPERTIES:
+        value = str(values.get(name) or '').strip()
+        if value:
+            if value.isdigit():
+                value = value.zfill(5)
+            if len(value) <= 10:
+                return value
+    raise ValueError('no ZIP/ZCTA property')
+
+
+def _ring(coordinates):
+    """A closed (n, 2) lon/lat ring, or None if it has fewer than 3 points"""
+    ring = np.asarray(coordinates, dtype=np.float64)
+    if ring.ndim != 2 or len(ring) < 3:
+        return None
+    ring = ring[:, :2]
+    if not np.array_equal(ring[0], ring[-1]):
+        ring = np.vstack([ring, ring[:1]])
+    return ring if len(ring) >= 4 else None
+
+
+def _polygons(geometry):
+    """List of polygons, each a list of closed rings, exterior first"""
+    kind = (geometry or {}).get('type')
+    if kind == 'Polygon':
+        parts = [geometry['coordinates']]
+    elif kind == 'MultiPolygon':
+        parts = geometry['coordinates']
+    else:
+        raise ValueError(f'geometry is {kind or "missing"}, not a (Multi)Polygon')
+    polygons = []
+    for part in parts:
+        rings = [_ring(ring) for ring in part]
+        # A degenerate exterior ring takes its holes with it
+        if rings and rings[0] is not None:
+            polygons.append([ring for ring in rings if ring is not None])
+    if not polygons:
+        raise ValueError('no ring with at least three points')
+    return polygons
+
+
+# ============= SIMPLIFICATION =============
+
+def _douglas_peucker(points, tolerance):
+    """Indexes of the points kept by Douglas-Peucker simplification"""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    points = points.astype(np.float64)
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        middle = points[first + 1:last]
+        dx, dy = end - start
+        length = np.hypot(dx, dy)
+        if length:
+            distance = np.abs(dx * (middle[:, 1] - start[1]) - dy * (middle[:, 0] - start[0])) / length
+        else:
+            # A closed ring's first and last points coincide
+            distance = np.hypot(middle[:, 0] - start[0], middle[:, 1] - start[1])
+        farthest = int(np.argmax(distance))
+        if distance[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.nonzero(keep)[0]
+
+
+def _simplify_ring(ring, tolerance):
+    """A quantized closed ring simplified, or None if it collapses"""
+    # Snapping puts runs of vertices on the same grid point
+    moved = np.any(ring[1:] != ring[:-1], axis=1)
+    ring = ring[np.concatenate([[True], moved])]
+    if len(ring) < 4:
+        return None
+    ring = ring[_douglas_peucker(ring, tolerance)]
+    if len(ring) < 4:
+        return None
+    x, y = ring[:, 0], ring[:, 1]
+    if not np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]):
+        return None
+    return ring
+
+
+def simplify(polygons):
+    """{zoom: list of polygons of quantized rings} for SIMPLIFY_ZOOMS"""
+    finest = max(SIMPLIFY_ZOOMS)
+    step = grid_step(finest)
+    current = [[np.round((ring + [180.0, 90.0]) / step).astype(np.int64) for ring in rings]
+               for rings in polygons]
+    previous_zoom = finest
+    tolerance = TOLERANCE_PIXELS * STEPS_PER_PIXEL
+    shapes = {}
+    for zoom in sorted(SIMPLIFY_ZOOMS, reverse=True):
+        # Grid steps halve per zoom level, so coarser grids are a shift away
+        shift = previous_zoom - zoom
+        simplified = []
+        for rings in current:
+            exterior = _simplify_ring(rings[0] >> shift, tolerance)
+            if exterior is None:
+                continue
+            holes = [_simplify_ring(ring >> shift, tolerance) for ring in rings[1:]]
+            simplified.append([exterior] + [hole for hole in holes if hole is not None])
+        shapes[zoom] = simplified
+        current, previous_zoom = simplified, zoom
+    return shapes
+
+
+def encode(polygons):
+    """(arcs, rings) JSON texts of quantized polygons: delta-encoded TopoJSON arcs"""
+    arcs = []
+    for rings in polygons:
+        for ring in rings:
+            deltas = np.vstack([ring[:1], np.diff(ring, axis=0)])
+            arcs.append(json.dumps(deltas.tolist(), separators=(',', ':')))
+    return '[' + ','.join(arcs) + ']', json.dumps([len(rings) for rings in polygons])
+
+
+def pack(polygons):
+    """ZipBoundary column values of full-resolution polygons"""
+    rings = [ring for polygon in polygons for ring in polygon]
+    vertices = np.vstack(rings)
+    return {
+        'min_lon': float(vertices[:, 0].min()),
+        'min_lat': float(vertices[:, 1].min()),
+        'max_lon': float(vertices[:, 0].max()),
+        'max_lat': float(vertices[:, 1].max()),
+        'vertices': vertices.astype(np.float64).tobytes(),
+        'ring_sizes': np.array([len(ring) for ring in rings], dtype=np.int32).tobytes(),
+        'polygon_sizes': np.array([len(polygon) for polygon in polygons], dtype=np.int32).tobytes(),
+    }
+
+
+# ============= LOADING =============
+
+def _write(connection, boundaries, shapes, now):
+    zip_codes = [row['zip_code'] for row in boundaries]
+    shape_table, boundary_table = ZipBoundaryShape.__table__, ZipBoundary.__table__
+    connection.execute(shape_table.delete().where(shape_table.c.zip_code.in_(zip_codes)))
+    connection.execute(boundary_table.delete().where(boundary_table.c.zip_code.in_(zip_codes)))
+    connection.execute(boundary_table.insert(), [dict(row, updated_at=now) for row in boundaries])
+    if shapes:
+        connection.execute(shape_table.insert(), shapes)
+
+
+def load_boundaries(path, replace=False):
+    """Store the ZIP polygons of a GeoJSON/shapefile and their simplified shapes.
+
+    A ZIP already stored is replaced; with replace=True every stored
+    boundary is deleted first. Returns read / rejected / loaded counts,
+    the total vertices, shapes per zoom, the first rejected features as
+    (feature number, reason), and the elapsed seconds.
+    """
+    started = time.perf_counter()
+    stats = {'read': 0, 'rejected': 0, 'loaded': 0, 'vertices': 0, 'errors': [],
+             'shapes': {zoom: 0 for zoom in SIMPLIFY_ZOOMS}}
+    now = datetime.utcnow()
+    boundaries, shapes, seen = [], [], set()
+    with db.engine.begin() as connection:
+        if replace:
+            connection.execute(ZipBoundaryShape.__table__.delete())
+            connection.execute(ZipBoundary.__table__.delete())
+        for number, (properties, geometry) in enumerate(_features(path), start=1):
+            stats['read'] += 1
+            try:
+                zip_code = _zip_of(properties)
+                polygons = _polygons(geometry)
+            except (ValueError, KeyError, TypeError, IndexError) as exc:
+                stats['rejected'] += 1
+                if len(stats['errors']) < MAX_ERRORS:
+                    stats['errors'].append((number, str(exc)))
+                continue
+            if zip_code in seen:
+                stats['rejected'] += 1
+                if len(stats['errors']) < MAX_ERRORS:
+                    stats['errors'].append((number, f'{zip_code} appears more than once'))
+                continue
+            seen.add(zip_code)
+            boundaries.append(dict(pack(polygons), zip_code=zip_code))
+            stats['vertices'] += sum(len(ring) for rings in polygons for ring in rings)
+            for zoom, simplified in simplify(polygons).items():
+                if simplified:
+                    arcs, rings = encode(simplified)
+                    shapes.append({'zip_code': zip_code, 'zoom': zoom, 'arcs': arcs, 'rings': rings})
+                    stats['shapes'][zoom] += 1
+            if len(boundaries) >= CHUNK_SIZE:
+                _write(connection, boundaries, shapes, now)
+                stats['loaded'] += len(boundaries)
+                boundaries, shapes = [], []
+        if boundaries:
+            _write(connection, boundaries, shapes, now)
+            stats['loaded'] += len(boundaries)
+        if stats['loaded'] or replace:
+            bump(connection, 'zip_boundaries')
+    invalidate('zip_boundaries')
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+# ============= CHOROPLETH =============
+
+def parse_boundary_args(args):
+    """bbox and zoom of /api/boundaries"""
+    bbox = parse_bbox(args.get('bbox'))
+    if bbox is None:
+        raise FilterError('bbox is required')
+    try:
+        zoom = int(args.get('zoom', ''))
+    except ValueError:
+        raise FilterError('zoom must be an integer')
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise FilterError(f'zoom must be between 0 and {MAX_ZOOM}')
+    return bbox, zoom
+
+
+def topology(bbox, zoom):
+    """TopoJSON text of the ZIP shapes intersecting bbox at a map zoom.
+
+    One object, "zips", holds a MultiPolygon per ZIP with the ZIP as its
+    id. Arcs are quantized and delta-encoded (see the TopoJSON spec's
+    "transform"); each ring is its own arc.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    stored = shape_zoom(zoom)
+    rows = db.session.query(ZipBoundaryShape.zip_code, ZipBoundaryShape.arcs, ZipBoundaryShape.rings)\
+        .join(ZipBoundary, ZipBoundary.zip_code == ZipBoundaryShape.zip_code)\
+        .filter(ZipBoundaryShape.zoom == stored,
+                ZipBoundary.max_lon >= min_lon, ZipBoundary.min_lon <= max_lon,
+                ZipBoundary.max_lat >= min_lat, ZipBoundary.min_lat <= max_lat)\
+        .order_by(ZipBoundaryShape.zip_code)
+    geometries, arcs, count = [], [], 0
+    for zip_code, zip_arcs, rings in rows:
+        polygons = []
+        for ring_count in json.loads(rings):
+            polygons.append([[count + i] for i in range(ring_count)])
+            count += ring_count
+        geometries.append({'type': 'MultiPolygon', 'id': zip_code, 'arcs': polygons})
+        arcs.append(zip_arcs[1:-1])
+    step = grid_step(stored)
+    header = {'type': 'Topology', 'zoom': stored, 'count': len(geometries),
+              'transform': {'scale': [step, step], 'translate': [-180.0, -90.0]}}
+    objects = {'zips': {'type': 'GeometryCollection', 'geometries': geometries}}
+    return (json.dumps(header, separators=(',', ':'))[:-1]
+            + ',"objects":' + json.dumps(objects, separators=(',', ':'))
+            + ',"arcs":[' + ','.join(arcs) + ']}')
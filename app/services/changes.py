@@ -0,0 +1,101 @@
+"""Committed row-change notifications for in-memory indexes.
+
+ORM writes are collected on flush and delivered once the transaction
+commits (and dropped on rollback), so an index never sees rows that did
+not make it to the database. Code that writes with Core statements
+(bulk importers) calls notify() itself.
+
+Subscribers get (added, removed) lists of plain dict snapshots of the
+row's columns, and the table's data version counters around the write
+as versions = (counter before, (counter, updated_at) after), or None
+when the writer can't tell. An in-memory copy known to be at `before`
+is exactly current after applying the rows; any other copy has missed
+someone else's write and must reload. An UPDATE is reported as the old
+row removed and the new row added.
+"""
+from collections import defaultdict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+_subscribers = defaultdict(list)
+
+
+def subscribe(table, callback):
+    """Call callback(added, removed, versions) after each commit touching a table"""
+    if callback not in _subscribers[table]:
+        _subscribers[table].append(callback)
+
+
+def notify(table, added=(), removed=(), versions=None):
+    """Deliver changes to subscribers (used directly by Core-level writers)"""
+    if not added and not removed:
+        return
+    for callback in _subscribers.get(table, ()):
+        callback(list(added), list(removed), versions)
+
+
+def record_versions(session, written):
+    """Note the {table: (counter, updated_at)} a flush's bump() wrote"""
+    versions = session.info.setdefault('pending_versions', {})
+    for table, after in written.items():
+        # Several flushes in one transaction: keep the counter before the first
+        before = versions[table][0] if table in versions else after[0] - 1
+        versions[table] = (before, after)
+
+
+def snapshot(obj):
+    """Current column values of an ORM object"""
+    return {c.key: getattr(obj, c.key) for c in inspect(obj).mapper.column_attrs}
+
+
+def old_snapshot(obj):
+    """Column values of an ORM object before its pending changes"""
+    state = inspect(obj)
+    values = {}
+    for attr in state.mapper.column_attrs:
+        history = state.attrs[attr.key].history
+        if history.deleted:
+            values[attr.key] = history.deleted[0]
+        elif history.unchanged:
+            values[attr.key] = history.unchanged[0]
+        else:
+            values[attr.key] = getattr(obj, attr.key)
+    return values
+
+
+def _pending(session):
+    return session.info.setdefault('pending_changes', defaultdict(lambda: ([], [])))
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect(session, flush_context):
+    pending = _pending(session)
+    for obj in session.new:
+        table = getattr(obj, '__tablename__', None)
+        if table in _subscribers:
+            pending[table][0].append(snapshot(obj))
+    for obj in session.dirty:
+        table = getattr(obj, '__tablename__', None)
+        if table in _subscribers and session.is_modified(obj, include_collections=False):
+            pending[table][1].append(old_snapshot(obj))
+            pending[table][0].append(snapshot(obj))
+    for obj in session.deleted:
+        table = getattr(obj, '__tablename__', None)
+        if table in _subscribers:
+            pending[table][1].append(old_snapshot(obj))
+
+
+@event.listens_for(Session, 'after_commit')
+def _deliver(session):
+    pending = session.info.pop('pending_changes', None)
+    versions = session.info.pop('pending_versions', {})
+    if not pending:
+        return
+    for table, (added, removed) in pending.items():
+        notify(table, added, removed, versions.get(table))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard(session, previous_transaction):
+    session.info.pop('pending_changes', None)
+    session.info.pop('pending_versions', None)
@@ -0,0 +1,241 @@
+"""Server-side marker clusters over a quadtree (Morton order) grid.
+
+Every location gets a cell on a fixed 2^24 x 2^24 Web Mercator grid, and
+the points are kept sorted by the cell's Morton code. Morton order is a
+quadtree walk, so at any coarser level a grid cell is one contiguous run
+of the sorted array: a viewport at zoom z becomes one searchsorted per
+CELL_PIXELS-wide cell, and prefix sums give each cell's count and
+centroid without touching its points. Only the business type breakdown
+looks at the points, with a single bincount.
+
+Scoped (non-admin) queries use a second ordering by (user, cell), so a
+user's points are a contiguous slice too.
+
+There is no second copy of the locations: the Morton ordering is derived
+from the spatial index's arrays (and rebuilt whenever they are), and the
+index's overlay of recently added and removed points is applied on top,
+so clusters follow commits exactly as /api/locations does.
+"""
+import numpy as np
+from app.metrics import cache_event
+from app.services.demographic_query import FilterError, parse_bbox
+from app.services.geo import TILE_SIZE, project
+from app.services.spatial_index import location_index
+
+# Bits per axis of the finest grid (about 2.4m cells at the equator)
+GRID_BITS = 24
+# Clusters are CELL_PIXELS square on screen: 4x4 per 256px tile
+CELL_PIXELS = 64
+CELL_SHIFT = int(np.log2(TILE_SIZE // CELL_PIXELS))
+MAX_ZOOM = GRID_BITS - CELL_SHIFT
+# A viewport covering more cells than this is rejected (wrong zoom for the bbox)
+MAX_CELLS = 4096
+
+# (shift, mask) steps that move the low 32 bits of a word to the even bits
+_SPREAD = [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+           (2, 0x3333333333333333), (1, 0x5555555555555555)]
+_COMPACT = [(1, 0x3333333333333333), (2, 0x0F0F0F0F0F0F0F0F), (4, 0x00FF00FF00FF00FF),
+            (8, 0x0000FFFF0000FFFF), (16, 0x00000000FFFFFFFF)]
+
+
+def _spread(v):
+    """Put the bits of v in the even bit positions"""
+    v = np.asarray(v, dtype=np.uint64)
+    for shift, mask in _SPREAD:
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def _compact(v):
+    """Inverse of _spread()"""
+    v = np.asarray(v, dtype=np.uint64) & np.uint64(0x5555555555555555)
+    for shift, mask in _COMPACT:
+        v = (v | (v >> np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def morton(x, y):
+    """Morton (Z-order) code of grid cells; scalars or arrays"""
+    return (_spread(x) | (_spread(y) << np.uint64(1))).astype(np.int64)
+
+
+def unmorton(code):
+    """(x, y) grid cells of Morton codes"""
+    code = np.asarray(code, dtype=np.uint64)
+    return _compact(code).astype(np.int64), _compact(code >> np.uint64(1)).astype(np.int64)
+
+
+def grid_cells(lat, lon):
+    """(x, y) cells on the finest grid"""
+    # At zoom GRID_BITS - 8 the world is 2^GRID_BITS pixels wide
+    x, y = project(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64),
+                   GRID_BITS - 8)
+    last = 2 ** GRID_BITS - 1
+    return (np.clip(np.floor(x), 0, last).astype(np.int64),
+            np.clip(np.floor(y), 0, last).astype(np.int64))
+
+
+class Viewport:
+    """The grid cells at one level that cover a bbox, numbered row by row"""
+
+    def __init__(self, bbox, zoom):
+        self.zoom = zoom
+        self.level = zoom + CELL_SHIFT
+        self.shift = GRID_BITS - self.level
+        min_lon, min_lat, max_lon, max_lat = bbox
+        x0, y0 = grid_cells(max_lat, min_lon)
+        x1, y1 = grid_cells(min_lat, max_lon)
+        self.x0, self.y0 = int(x0) >> self.shift, int(y0) >> self.shift
+        self.columns = (int(x1) >> self.shift) - self.x0 + 1
+        self.rows = (int(y1) >> self.shift) - self.y0 + 1
+        if self.columns * self.rows > MAX_CELLS:
+            raise FilterError(f'bbox covers more than {MAX_CELLS} clusters at this zoom')
+        self.size = self.columns * self.rows
+
+    def prefixes(self):
+        """Morton codes of every cell at this level, in cell number order"""
+        cell = np.arange(self.size, dtype=np.int64)
+        return morton(self.x0 + cell % self.columns, self.y0 + cell // self.columns)
+
+    def cell_numbers(self, codes):
+        """Cell number of finest-grid Morton codes (-1 outside the viewport)"""
+        x, y = unmorton(codes)
+        x, y = x >> self.shift, y >> self.shift
+        inside = (x >= self.x0) & (x < self.x0 + self.columns) & \
+            (y >= self.y0) & (y < self.y0 + self.rows)
+        return np.where(inside, (y - self.y0) * self.columns + (x - self.x0), -1)
+
+
+class Clusters:
+    """Per-cell count, coordinate sums and type counts for one viewport"""
+
+    def __init__(self, size, types):
+        self.count = np.zeros(size, dtype=np.int64)
+        self.sum_lat = np.zeros(size, dtype=np.float64)
+        self.sum_lon = np.zeros(size, dtype=np.float64)
+        # Column 0 counts untyped locations, column t + 1 type code t
+        self.types = np.zeros((size, types + 1), dtype=np.int64)
+
+    def add(self, cells, lat, lon, codes, sign=1):
+        """Add (or with sign=-1 remove) points given their cell numbers"""
+        keep = cells >= 0
+        cells, lat, lon, codes = cells[keep], lat[keep], lon[keep], codes[keep]
+        np.add.at(self.count, cells, sign)
+        np.add.at(self.sum_lat, cells, sign * lat)
+        np.add.at(self.sum_lon, cells, sign * lon)
+        np.add.at(self.types, (cells, codes + 1), sign)
+
+    def to_list(self, type_names):
+        result = []
+        for cell in np.nonzero(self.count > 0)[0].tolist():
+            count = int(self.count[cell])
+            # Untyped locations only count towards the total
+            breakdown = {type_names[t - 1]: int(n)
+                         for t, n in enumerate(self.types[cell].tolist()) if t and n}
+            result.append({
+                'lat': round(float(self.sum_lat[cell]) / count, 6),
+                'lon': round(float(self.sum_lon[cell]) / count, 6),
+                'count': count,
+                'business_types': breakdown,
+            })
+        return result
+
+
+class MortonOrder:
+    """The spatial index's sorted points, reordered by Morton code.
+
+    Holds only the ordering, its codes and prefix sums: positions refer to
+    the LocationIndex arrays it was built from, so the locations
+    themselves are not copied. It is derived from (and dropped with) the
+    index's arrays, and points added or removed since are applied from
+    the index's overlay at query time.
+    """
+
+    def __init__(self, index):
+        # Morton code of every point, in the index's own order
+        self.codes = morton(*grid_cells(index.lat, index.lon))
+        self.order = np.argsort(self.codes, kind='stable')
+        self.keys = self.codes[self.order]
+        self.cum_lat = np.concatenate(([0.0], np.cumsum(index.lat[self.order])))
+        self.cum_lon = np.concatenate(([0.0], np.cumsum(index.lon[self.order])))
+        # Positions sorted by (user, cell), and by id for removals
+        self.by_user = np.lexsort((self.codes, index.users))
+        self.user_keys = index.users[self.by_user]
+        self.by_id = np.argsort(index.ids)
+        self.sorted_ids = index.ids[self.by_id]
+
+    def _base_all(self, index, view, clusters):
+        """Every point in the viewport, from the Morton runs and prefix sums"""
+        lo_codes = view.prefixes() << (2 * view.shift)
+        lo = np.searchsorted(self.keys, lo_codes, side='left')
+        hi = np.searchsorted(self.keys, lo_codes + (1 << (2 * view.shift)), side='left')
+        clusters.count += hi - lo
+        clusters.sum_lat += self.cum_lat[hi] - self.cum_lat[lo]
+        clusters.sum_lon += self.cum_lon[hi] - self.cum_lon[lo]
+        lengths = hi - lo
+        # Concatenate the [lo, hi) runs without a Python loop
+        idx = np.arange(lengths.sum()) + np.repeat(lo - (np.cumsum(lengths) - lengths), lengths)
+        cells = np.repeat(np.arange(view.size), lengths)
+        width = clusters.types.shape[1]
+        clusters.types += np.bincount(cells * width + index.types[self.order[idx]] + 1,
+                                      minlength=view.size * width).reshape(view.size, width)
+
+    def _base_user(self, index, view, clusters, user_id):
+        """One user's points in the viewport"""
+        lo = np.searchsorted(self.user_keys, user_id, side='left')
+        hi = np.searchsorted(self.user_keys, user_id, side='right')
+        pos = self.by_user[lo:hi]
+        clusters.add(view.cell_numbers(self.codes[pos]), index.lat[pos], index.lon[pos], index.types[pos])
+
+    def _removed(self, index, user_id):
+        """Positions of points hidden by the index's overlay, visible to a user"""
+        removed = index.hidden_ids()
+        if not len(removed) or not len(self.sorted_ids):
+            return np.zeros(0, dtype=np.int64)
+        at = np.minimum(np.searchsorted(self.sorted_ids, removed), len(self.sorted_ids) - 1)
+        pos = self.by_id[at[self.sorted_ids[at] == removed]]
+        if user_id is not None:
+            pos = pos[index.users[pos] == user_id]
+        return pos
+
+    def clusters(self, index, view, user_id=None):
+        """Clusters in a Viewport: every location, or one user's"""
+        clusters = Clusters(view.size, len(index.type_names()))
+        if user_id is None:
+            self._base_all(index, view, clusters)
+        else:
+            self._base_user(index, view, clusters, user_id)
+
+        pos = self._removed(index, user_id)
+        if len(pos):
+            clusters.add(view.cell_numbers(self.codes[pos]), index.lat[pos], index.lon[pos],
+                         index.types[pos], sign=-1)
+        _, lat, lon, users, types = index.added_arrays()
+        if user_id is not None:
+            mine = users == user_id
+            lat, lon, types = lat[mine], lon[mine], types[mine]
+        if len(lat):
+            clusters.add(view.cell_numbers(morton(*grid_cells(lat, lon))), lat, lon,
+                         types.astype(np.int64))
+        return clusters.to_list(index.type_names())
+
+
+def find_clusters(view, user_id=None):
+    """Clusters for a viewport from the up-to-date process-wide spatial index"""
+    with location_index() as index:
+        cache_event('location_clusters', 'morton' in index.derived)
+        return index.derive('morton', lambda: MortonOrder(index)).clusters(index, view, user_id)
+
+
+def parse_cluster_args(args):
+    """The Viewport of /api/locations/clusters"""
+    bbox = parse_bbox(args.get('bbox'))
+    if bbox is None:
+        raise FilterError('bbox is required')
+    try:
+        zoom = int(args.get('zoom', ''))
+    except ValueError:
+        raise FilterError('zoom must be an integer')
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise FilterError(f'zoom must be between 0 and {MAX_ZOOM}')
+    return Viewport(bbox, zoom)
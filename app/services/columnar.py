@@ -0,0 +1,169 @@
+"""Column-oriented payloads for the map APIs.
+
+format=columnar returns one JSON array per field instead of one object
+per row, so key names are sent once. format=binary packs the same
+columns into a single buffer the browser can wrap in typed arrays
+without parsing:
+
+    b'HMC1' | uint32 LE header length | JSON header | column buffers
+
+The header (space padded to a multiple of 4 bytes) holds the response
+metadata plus a `columns` list of {name, type, offset, length}; offsets
+are relative to the end of the header and 4-byte aligned. Numeric
+columns are little-endian float32 with NaN for missing values (exact for
+integers below 2**24, which covers every count and dollar figure here);
+text columns are UTF-8, one value per line, '' for missing.
+
+Demographic pages are cut straight from the cached column store, so no
+SQL runs and no per-row dicts are built.
+"""
+import json
+import struct
+import numpy as np
+from app.models.demographic import INCOME_BUCKETS, POPULATION_BUCKETS, HOME_VALUE_BUCKETS
+from app.services.columns import EPOCH
+
+FORMATS = ('json', 'columnar', 'binary')
+BINARY_MIMETYPE = 'application/vnd.heatmap.columns'
+MAGIC = b'HMC1'
+
+
+class ColumnPage:
+    """Selected row indexes into a column store, plus the page cursor"""
+
+    def __init__(self, idx, next_cursor, changed_outside=()):
+        self.idx = idx
+        self.next_cursor = next_cursor
+        self.changed_outside = changed_outside
+
+
+def _bucket_mask(values, buckets, keys):
+    mask = np.zeros(len(values), dtype=bool)
+    for key in keys:
+        low, high = buckets[key]
+        matched = np.ones(len(values), dtype=bool)
+        if low is not None:
+            matched &= values >= low
+        if high is not None:
+            matched &= values < high
+        if low is None:
+            # Same as the SQL filters: a missing value counts as zero
+            matched |= np.isnan(values)
+        mask |= matched
+    return mask
+
+
+def _prefix_mask(text, prefix):
+    return np.char.startswith(text, prefix)
+
+
+def filter_mask(columns, filters):
+    """Boolean row mask equivalent to demographic_query.filter_conditions"""
+    mask = np.ones(len(columns), dtype=bool)
+    with np.errstate(invalid='ignore'):
+        if filters['income']:
+            mask &= _bucket_mask(columns.median_income, INCOME_BUCKETS, filters['income'])
+        if filters['population']:
+            mask &= _bucket_mask(columns.population, POPULATION_BUCKETS, filters['population'])
+        if filters['home_value']:
+            mask &= _bucket_mask(columns.median_home_value, HOME_VALUE_BUCKETS, filters['home_value'])
+        if filters['bbox']:
+            min_lon, min_lat, max_lon, max_lat = filters['bbox']
+            mask &= (columns.latitude >= min_lat) & (columns.latitude <= max_lat)
+            mask &= (columns.longitude >= min_lon) & (columns.longitude <= max_lon)
+    if filters['q']:
+        city_lower = columns.derive(('lower', 'city'), lambda: np.char.lower(columns.city))
+        mask &= _prefix_mask(columns.zip_code, filters['q']) | _prefix_mask(city_lower, filters['q'])
+    return mask
+
+
+def select_page(columns, filters, limit, after=None, since=None):
+    """Rows of one page, ordered by zip code like query_demographics"""
+    mask = filter_mask(columns, filters)
+    changed_outside = ()
+    if since is not None:
+        with np.errstate(invalid='ignore'):
+            changed = columns.updated_at > (since - EPOCH).total_seconds()
+        changed_outside = columns.zip_code[changed & ~mask].tolist()
+        mask &= changed
+    start = int(np.searchsorted(columns.zip_code, after, side='right')) if after else 0
+    idx = np.flatnonzero(mask[start:]) + start
+    next_cursor = None
+    if len(idx) > limit:
+        idx = idx[:limit]
+        next_cursor = columns.text('zip_code', idx[-1])
+    return ColumnPage(idx, next_cursor, changed_outside)
+
+
+def demographic_arrays(columns, page, fields, extra=None):
+    """{field: array} for a page; `extra` adds aligned full-length columns"""
+    arrays = {}
+    for field in fields:
+        arrays[field] = getattr(columns, field)[page.idx]
+    for name, values in (extra or {}).items():
+        arrays[name] = values[page.idx]
+    return arrays
+
+
+def json_columns(arrays):
+    """{field: list} with NaN/None as null, built with C-level tolist()"""
+    result = {}
+    for name, values in arrays.items():
+        values = np.asarray(values)
+        if values.dtype.kind == 'f':
+            missing = np.isnan(values)
+            known = values[~missing]
+            out = np.empty(len(values), dtype=object)
+            # Counts and dollar figures go out as ints, like the row format
+            whole = np.array_equal(known, np.trunc(known))
+            out[~missing] = (known.astype(np.int64) if whole else known).tolist()
+            values = out
+        elif values.dtype.kind == 'U':
+            # Text columns store missing values as ''
+            out = values.astype(object)
+            out[values == ''] = None
+            values = out
+        result[name] = values.tolist()
+    return result
+
+
+def pack(meta, arrays):
+    """Encode metadata and columns in the binary layout described above"""
+    buffers = []
+    specs = []
+    offset = 0
+    for name, values in arrays.items():
+        values = np.asarray(values)
+        if values.dtype.kind in 'fiub':
+            data = values.astype('<f4').tobytes()
+            kind = 'f32'
+        else:
+            data = '\n'.join('' if v is None else str(v) for v in values).encode('utf-8')
+            kind = 'utf8-lines'
+        specs.append({'name': name, 'type': kind, 'offset': offset, 'length': len(data)})
+        padding = -len(data) % 4
+        buffers.append(data + b'\0' * padding)
+        offset += len(data) + padding
+
+    header = json.dumps(dict(meta, columns=specs), separators=(',', ':')).encode('utf-8')
+    header += b' ' * (-len(header) % 4)
+    return MAGIC + struct.pack('<I', len(header)) + header + b''.join(buffers)
+
+
+LOCATION_FIELDS = ('id', 'name', 'address', 'city', 'state', 'zip_code',
+                   'latitude', 'longitude', 'business_type', 'updated_at')
+NUMERIC_LOCATION_FIELDS = ('id', 'latitude', 'longitude')
+
+
+def location_arrays(records):
+    """{field: array} from Location column tuples (LOCATION_FIELDS order)"""
+    values = list(zip(*records)) if records else [()] * len(LOCATION_FIELDS)
+    arrays = {}
+    for name, column in zip(LOCATION_FIELDS, values):
+        if name in NUMERIC_LOCATION_FIELDS:
+            arrays[name] = np.array(column, dtype=np.float64)
+        elif name == 'updated_at':
+            arrays[name] = np.array([d.isoformat() if d else None for d in column], dtype=object)
+        else:
+            arrays[name] = np.array(column, dtype=object)
+    return arrays
@@ -0,0 +1,213 @@
+"""Column-oriented, in-memory copy of the demographics table.
+
+Analytics (scoring, similarity, trade areas) and the column API formats
+run vectorised over these arrays instead of looping over ORM objects or
+querying SQLite.
+
+The arrays live in an immutable snapshot on disk - one .npy file per
+column in instance/snapshots/demographics-<version>/ - that every worker
+process maps read-only, so the pages are shared through the OS page cache
+and memory does not grow with the number of gunicorn workers. When the
+demographics data version changes, the first process to notice builds
+the new snapshot in a temporary directory, renames it into place and
+swaps the CURRENT pointer file; the others just map it.
+"""
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+import numpy as np
+from flask import current_app
+from app.extensions import db
+from app.metrics import cache_event
+from app.models import Demographic
+from app.models.demographic import INCOME_BUCKETS, INCOME_LABELS
+from app.services.data_version import data_version
+
+TEXT_COLUMNS = ('zip_code', 'city', 'state')
+NUMERIC_COLUMNS = ('id', 'population', 'median_income', 'median_age', 'median_home_value',
+                   'households', 'latitude', 'longitude')
+# Seconds since the epoch (naive UTC, as stored); NaN if never set
+UPDATED_AT = 'updated_at'
+# income_range() labels, precomputed into the snapshot
+INCOME_RANGE = 'income_range'
+ALL_COLUMNS = TEXT_COLUMNS + NUMERIC_COLUMNS + (UPDATED_AT, INCOME_RANGE)
+
+EPOCH = datetime(1970, 1, 1)
+SNAPSHOT_PREFIX = 'demographics-'
+# Snapshots kept (current included) for processes that still have one mapped
+KEEP_SNAPSHOTS = 2
+
+
+def _epoch(value):
+    return (value - EPOCH).total_seconds() if value is not None else np.nan
+
+
+def _text(values):
+    # Fixed-width unicode so the column can be memory-mapped; '' is NULL
+    if not len(values):
+        return np.array([], dtype='U1')
+    return np.array(['' if v is None else v for v in values], dtype=str)
+
+
+def income_ranges(median_income):
+    """income_range() for an array of incomes"""
+    labels = np.full(len(median_income), 'Unknown', dtype=object)
+    known = np.isfinite(median_income) & (median_income != 0)
+    with np.errstate(invalid='ignore'):
+        # Widest bucket first so the lower ones overwrite it
+        for key, (low, high) in reversed(list(INCOME_BUCKETS.items())):
+            below = known if high is None else known & (median_income < high)
+            labels[below] = INCOME_LABELS[key]
+    return _text(labels.tolist())
+
+
+class DemographicColumns:
+    """One NumPy array per column, rows ordered by zip code.
+
+    Text columns are fixed-width unicode arrays with '' for missing
+    values; numeric columns are float64 with NaN for missing values.
+    Arrays mapped from a snapshot are read-only.
+    """
+
+    def __init__(self, arrays, version=None):
+        self.version = version
+        for name in ALL_COLUMNS:
+            setattr(self, name, arrays[name])
+        # Arrays computed from this version of the data (scaled features, ...)
+        self.derived = {}
+
+    @classmethod
+    def from_rows(cls, rows, version=None):
+        """Build from (text..., numeric..., updated_at) query rows"""
+        columns = list(zip(*rows)) if rows else [()] * (len(TEXT_COLUMNS) + len(NUMERIC_COLUMNS) + 1)
+        arrays = {}
+        for name, values in zip(TEXT_COLUMNS, columns):
+            arrays[name] = _text(values)
+        for name, values in zip(NUMERIC_COLUMNS, columns[len(TEXT_COLUMNS):]):
+            arrays[name] = np.array(values, dtype=np.float64)
+        arrays[UPDATED_AT] = np.array([_epoch(d) for d in columns[-1]], dtype=np.float64)
+        arrays[INCOME_RANGE] = income_ranges(arrays['median_income'])
+        return cls(arrays, version)
+
+    def __len__(self):
+        return len(self.zip_code)
+
+    def derive(self, key, compute):
+        """Memoise an array computed from these columns"""
+        if key not in self.derived:
+            self.derived[key] = compute()
+        return self.derived[key]
+
+    def text(self, name, i):
+        """One text value as str, or None if missing"""
+        return str(getattr(self, name)[i]) or None
+
+    def lookup(self, zip_codes):
+        """Row indexes for zip codes (-1 where unknown)"""
+        zip_codes = _text(list(zip_codes))
+        if not len(self) or not len(zip_codes):
+            return np.full(len(zip_codes), -1, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.zip_code, zip_codes), len(self) - 1)
+        return np.where(self.zip_code[idx] == zip_codes, idx, -1).astype(np.int64)
+
+
+# ============= SNAPSHOTS =============
+
+def _snapshot_root():
+    return current_app.config.get('SNAPSHOT_DIR') or os.path.join(current_app.instance_path, 'snapshots')
+
+
+def _current_pointer(root):
+    try:
+        with open(os.path.join(root, 'CURRENT')) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _tmp_suffix():
+    return f'.tmp-{os.getpid()}-{threading.get_ident()}'
+
+
+def write_snapshot(columns, root):
+    """Write the snapshot for columns.version (if missing) and point CURRENT at it"""
+    name = SNAPSHOT_PREFIX + columns.version
+    final = os.path.join(root, name)
+    if not os.path.isdir(final):
+        os.makedirs(root, exist_ok=True)
+        tmp = final + _tmp_suffix()
+        os.makedirs(tmp)
+        for column in ALL_COLUMNS:
+            np.save(os.path.join(tmp, column + '.npy'), getattr(columns, column), allow_pickle=False)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'version': columns.version, 'rows': len(columns),
+                       'created_at': datetime.utcnow().isoformat()}, f)
+        try:
+            os.rename(tmp, final)
+        except OSError:
+            # Another worker finished the same snapshot first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    pointer = os.path.join(root, 'CURRENT' + _tmp_suffix())
+    with open(pointer, 'w') as f:
+        f.write(name)
+    os.replace(pointer, os.path.join(root, 'CURRENT'))
+    _prune(root, name)
+    return final
+
+
+def _prune(root, current):
+    older = sorted((entry for entry in os.scandir(root)
+                    if entry.is_dir() and entry.name.startswith(SNAPSHOT_PREFIX)
+                    and '.tmp-' not in entry.name and entry.name != current),
+                   key=lambda entry: entry.stat().st_mtime, reverse=True)
+    # Unlinking a mapped file is safe; the mapping lives until it is dropped
+    for entry in older[KEEP_SNAPSHOTS - 1:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def load_snapshot(root, version):
+    """Map the snapshot for a version read-only, or None if there isn't one"""
+    path = os.path.join(root, SNAPSHOT_PREFIX + version)
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            rows = json.load(f)['rows']
+    except FileNotFoundError:
+        return None
+    # Empty arrays can't be mapped
+    mode = 'r' if rows else None
+    arrays = {column: np.load(os.path.join(path, column + '.npy'), mmap_mode=mode, allow_pickle=False)
+              for column in ALL_COLUMNS}
+    return DemographicColumns(arrays, version)
+
+
+def _build(version):
+    fields = [getattr(Demographic, name) for name in TEXT_COLUMNS + NUMERIC_COLUMNS]
+    fields.append(Demographic.updated_at)
+    rows = db.session.query(*fields).order_by(Demographic.zip_code).all()
+    return DemographicColumns.from_rows(rows, version)
+
+
+_columns = None
+_lock = threading.Lock()
+
+
+def demographic_columns():
+    """The current columns, mapped from (or first written to) a snapshot"""
+    global _columns
+    version = data_version('demographics')
+    with _lock:
+        if _columns is None or _columns.version != version:
+            root = _snapshot_root()
+            columns = load_snapshot(root, version)
+            cache_event('demographic_snapshot', columns is not None)
+            if columns is None:
+                write_snapshot(_build(version), root)
+                columns = load_snapshot(root, version)
+            elif _current_pointer(root) != SNAPSHOT_PREFIX + version:
+                write_snapshot(columns, root)
+            _columns = columns
+        return _columns
+
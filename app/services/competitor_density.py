@@ -0,0 +1,211 @@
+"""Materialised competitor counts per ZIP, business type and radius band.
+
+recompute() rebuilds the competitor_density table from scratch: locations
+are bucketed into a lat/lon grid whose cells are at least the largest
+band wide, so each ZIP centroid only needs distances to the locations in
+its own and the 8 neighbouring cells. Pairs are generated and measured
+with NumPy in chunks of ZIPs.
+
+Between batch runs the table is kept current incrementally: location
+inserts, updates and deletes adjust the counts inside the same
+transaction that writes the location (see app/services/write_hooks.py,
+which imports this module on the first location write).
+"""
+import math
+from datetime import datetime
+import numpy as np
+from app.extensions import db
+from app.models import Location, CompetitorDensity
+from app.models.competitor_density import RADIUS_BANDS
+from app.services.columns import demographic_columns
+from app.services.demographic_query import FilterError
+from app.services.geo import haversine_miles
+from app.services.upsert import insert_for
+
+DEFAULT_RADIUS = 3
+# Bound memory: ZIP/location pairs measured per chunk
+MAX_PAIRS_PER_CHUNK = 4_000_000
+INSERT_BATCH = 5000
+
+
+def parse_radius(raw):
+    """Radius band from a request arg (defaults to DEFAULT_RADIUS)"""
+    if not raw:
+        return DEFAULT_RADIUS
+    try:
+        radius = int(raw)
+    except ValueError:
+        radius = None
+    if radius not in RADIUS_BANDS:
+        raise FilterError(f'radius must be one of {", ".join(map(str, RADIUS_BANDS))}')
+    return radius
+
+
+def _centroids():
+    """(zip_codes, lat, lon) of ZIPs that have coordinates"""
+    columns = demographic_columns()
+    known = np.isfinite(columns.latitude) & np.isfinite(columns.longitude)
+    return columns.zip_code[known], columns.latitude[known], columns.longitude[known]
+
+
+def _grid(lat, lon, max_abs_lat):
+    """Cell indexes for a grid whose cells are at least the widest band across"""
+    cell_lat = max(RADIUS_BANDS) / 69.0
+    cell_lon = cell_lat / max(math.cos(math.radians(min(max_abs_lat, 85.0))), 0.05)
+    rows = np.floor((lat + 90.0) / cell_lat).astype(np.int64)
+    cols = np.floor((lon + 180.0) / cell_lon).astype(np.int64)
+    return rows, cols, int(math.ceil(360.0 / cell_lon)) + 2
+
+
+def count_competitors(zip_lat, zip_lon, loc_lat, loc_lon):
+    """Competitors within each band: int array of shape (len(zips), len(bands))"""
+    counts = np.zeros((len(zip_lat), len(RADIUS_BANDS)), dtype=np.int64)
+    if not len(zip_lat) or not len(loc_lat):
+        return counts
+
+    max_abs_lat = float(max(np.abs(zip_lat).max(), np.abs(loc_lat).max())) + 1.0
+    zrow, zcol, width = _grid(zip_lat, zip_lon, max_abs_lat)
+    lrow, lcol, _ = _grid(loc_lat, loc_lon, max_abs_lat)
+    loc_keys = lrow * width + lcol
+    order = np.argsort(loc_keys, kind='stable')
+    loc_keys, loc_lat, loc_lon = loc_keys[order], loc_lat[order], loc_lon[order]
+    bands = np.array(RADIUS_BANDS, dtype=np.float64)
+
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            keys = (zrow + dy) * width + (zcol + dx)
+            lo = np.searchsorted(loc_keys, keys, side='left')
+            hi = np.searchsorted(loc_keys, keys, side='right')
+            lengths = hi - lo
+            # Walk the ZIPs in chunks so the pair arrays stay bounded
+            start = 0
+            while start < len(keys):
+                cumulative = np.cumsum(lengths[start:])
+                end = start + max(1, int(np.searchsorted(cumulative, MAX_PAIRS_PER_CHUNK, side='right')))
+                chunk = lengths[start:end]
+                total = int(chunk.sum())
+                if total:
+                    zip_idx = np.repeat(np.arange(start, end), chunk)
+                    loc_idx = np.arange(total) + np.repeat(lo[start:end] - (np.cumsum(chunk) - chunk), chunk)
+                    dist = haversine_miles(zip_lat[zip_idx], zip_lon[zip_idx],
+                                           loc_lat[loc_idx], loc_lon[loc_idx])
+                    for b, band in enumerate(bands):
+                        counts[:, b] += np.bincount(zip_idx[dist <= band], minlength=len(zip_lat))
+                start = end
+    return counts
+
+
+def _rows(zip_codes, business_type, counts, now):
+    nonzero_zip, nonzero_band = np.nonzero(counts)
+    for z, b in zip(nonzero_zip.tolist(), nonzero_band.tolist()):
+        yield {
+            'zip_code': str(zip_codes[z]),
+            'business_type': business_type,
+            'radius_miles': RADIUS_BANDS[b],
+            'competitors': int(counts[z, b]),
+            'updated_at': now,
+        }
+
+
+def recompute(business_type=None):
+    """Rebuild the table (or one business type's rows); returns rows written"""
+    zip_codes, zip_lat, zip_lon = _centroids()
+    query = db.session.query(Location.business_type, Location.latitude, Location.longitude)\
+        .filter(Location.business_type.isnot(None),
+                Location.latitude.isnot(None), Location.longitude.isnot(None))
+    if business_type:
+        query = query.filter(Location.business_type == business_type)
+    locations = query.all()
+
+    by_type = {}
+    for kind, lat, lon in locations:
+        by_type.setdefault(kind, ([], []))
+        by_type[kind][0].append(lat)
+        by_type[kind][1].append(lon)
+
+    table = CompetitorDensity.__table__
+    delete = table.delete()
+    if business_type:
+        delete = delete.where(table.c.business_type == business_type)
+    db.session.execute(delete)
+
+    now = datetime.utcnow()
+    written = 0
+    for kind, (lat, lon) in by_type.items():
+        counts = count_competitors(zip_lat, zip_lon, np.array(lat), np.array(lon))
+        batch = []
+        for row in _rows(zip_codes, kind, counts, now):
+            batch.append(row)
+            if len(batch) >= INSERT_BATCH:
+                db.session.execute(table.insert(), batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            db.session.execute(table.insert(), batch)
+            written += len(batch)
+    db.session.commit()
+    return written
+
+
+def apply_location_changes(connection, added=(), removed=()):
+    """Adjust counts for location row snapshots within the caller's transaction"""
+    zip_codes, zip_lat, zip_lon = _centroids()
+    if not len(zip_codes):
+        return
+
+    deltas = {}
+    for rows, sign in ((added, 1), (removed, -1)):
+        for row in rows:
+            if row.get('business_type') is None or row.get('latitude') is None \
+                    or row.get('longitude') is None:
+                continue
+            dist = haversine_miles(row['latitude'], row['longitude'], zip_lat, zip_lon)
+            near = np.nonzero(dist <= max(RADIUS_BANDS))[0]
+            for z in near.tolist():
+                for band in RADIUS_BANDS:
+                    if dist[z] <= band:
+                        key = (str(zip_codes[z]), row['business_type'], band)
+                        deltas[key] = deltas.get(key, 0) + sign
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    table = CompetitorDensity.__table__
+    now = datetime.utcnow()
+    insert = insert_for(connection, table)
+    upsert = insert.on_conflict_do_update(
+        index_elements=['zip_code', 'business_type', 'radius_miles'],
+        set_={'competitors': table.c.competitors + insert.excluded.competitors,
+              'updated_at': insert.excluded.updated_at})
+    connection.execute(upsert, [
+        {'zip_code': z, 'business_type': t, 'radius_miles': r, 'competitors': delta, 'updated_at': now}
+        for (z, t, r), delta in deltas.items()
+    ])
+    connection.execute(table.delete().where(table.c.competitors <= 0))
+
+
+def density_for(zip_codes, business_type, radius=DEFAULT_RADIUS):
+    """{zip_code: competitors} for some ZIPs (missing means 0)"""
+    counts = {}
+    zip_codes = list(zip_codes)
+    for start in range(0, len(zip_codes), 500):
+        rows = db.session.query(CompetitorDensity.zip_code, CompetitorDensity.competitors)\
+            .filter(CompetitorDensity.business_type == business_type,
+                    CompetitorDensity.radius_miles == radius,
+                    CompetitorDensity.zip_code.in_(zip_codes[start:start + 500]))
+        counts.update(rows)
+    return counts
+
+
+def density_column(columns, business_type, radius=DEFAULT_RADIUS):
+    """Competitor counts aligned with the demographic column rows"""
+    rows = db.session.query(CompetitorDensity.zip_code, CompetitorDensity.competitors)\
+        .filter(CompetitorDensity.business_type == business_type,
+                CompetitorDensity.radius_miles == radius).all()
+    counts = np.zeros(len(columns))
+    if rows:
+        zips, values = zip(*rows)
+        idx = columns.lookup(zips)
+        known = idx >= 0
+        counts[idx[known]] = np.array(values, dtype=np.float64)[known]
+    return counts
@@ -0,0 +1,177 @@
+"""Per-table data versions and delete tombstones.
+
+Every transaction that writes a versioned table bumps that table's
+counter in data_versions, and every delete leaves a tombstone. ORM writes
+are handled by a flush listener; Core-level bulk writers call bump()
+themselves. The counters key caches (rendered tiles, column arrays, the
+spatial index) and the ETags of the JSON APIs; tombstones let ?since=
+clients drop rows that were deleted after their last sync.
+"""
+import hashlib
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.extensions import db
+from app.models import DataVersion, Tombstone
+from app.services import changes
+from app.services.upsert import insert_for
+
+# table -> (key column, owner column or None) recorded in tombstones
+VERSIONED_TABLES = {
+    'demographics': ('zip_code', None),
+    'locations': ('id', 'user_id'),
+}
+
+# Tables that only need a counter (cache keys), no tombstones
+COUNTED_TABLES = ('user', 'zip_boundaries')
+
+# Clients that last synced before this get a full reload instead of a delta
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+# Rows flushed just before a sync may commit just after it; hand out
+# as_of timestamps this far in the past so the next delta still sees them
+SYNC_SLACK = timedelta(seconds=5)
+
+# Bulk writers stamp updated_at when a transaction begins, so they commit
+# once a transaction has run this long (checked between batches) to stay
+# well inside SYNC_SLACK, and take a fresh timestamp for the next one
+BULK_TRANSACTION_SECONDS = 1.0
+
+# A map view requests a burst of tiles at once; don't re-read per tile
+TTL_SECONDS = 2.0
+
+_cache = {}
+
+
+def table_versions(*tables):
+    """{table: (counter, last bump time)} for versioned tables (0 if never written)"""
+    now = time.monotonic()
+    versions = {}
+    missing = []
+    for table in tables:
+        cached = _cache.get(table)
+        if cached is None or now - cached[0] > TTL_SECONDS:
+            missing.append(table)
+        else:
+            versions[table] = cached[1]
+    if missing:
+        rows = {name: (version, updated_at) for name, version, updated_at in
+                db.session.query(DataVersion.table_name, DataVersion.version, DataVersion.updated_at)
+                .filter(DataVersion.table_name.in_(missing))}
+        for table in missing:
+            versions[table] = rows.get(table, (0, None))
+            _cache[table] = (now, versions[table])
+    return versions
+
+
+def data_version(*tables):
+    """Short hex digest identifying the current contents of the tables"""
+    versions = table_versions(*tables)
+    # The bump time keeps versions distinct across a rebuilt database
+    parts = [f'{table}:{versions[table][0]}:{versions[table][1]}' for table in tables]
+    return hashlib.sha1(';'.join(parts).encode()).hexdigest()[:16]
+
+
+def invalidate(*tables):
+    """Forget cached versions after a write in this process"""
+    for table in tables or list(_cache):
+        _cache.pop(table, None)
+
+
+def bump(connection, *tables):
+    """Increment table versions inside the caller's transaction.
+
+    Returns the {table: (counter, updated_at)} this transaction wrote,
+    in the form table_versions() reads them back.
+    """
+    table = DataVersion.__table__
+    now = datetime.utcnow()
+    insert = insert_for(connection, table)
+    connection.execute(insert.on_conflict_do_update(
+        index_elements=['table_name'],
+        set_={'version': table.c.version + 1, 'updated_at': now},
+    ), [{'table_name': name, 'version': 1, 'updated_at': now} for name in tables])
+    # The transaction holds the rows' write lock: nobody else bumped since
+    return {name: (version, updated_at) for name, version, updated_at in connection.execute(
+        db.select(table.c.table_name, table.c.version, table.c.updated_at)
+        .where(table.c.table_name.in_(tables)))}
+
+
+def record_deletes(connection, table_name, rows):
+    """Write tombstones for deleted row snapshots and prune expired ones"""
+    key, owner = VERSIONED_TABLES[table_name]
+    now = datetime.utcnow()
+    table = Tombstone.__table__
+    connection.execute(table.insert(), [
+        {'table_name': table_name, 'row_key': str(row[key]),
+         'user_id': row.get(owner) if owner else None, 'deleted_at': now}
+        for row in rows
+    ])
+    connection.execute(table.delete().where(table.c.deleted_at < now - TOMBSTONE_RETENTION))
+
+
+def deleted_since(table_name, since, user_id=None):
+    """Keys of rows deleted after `since` (scoped to an owner if given)"""
+    query = db.session.query(Tombstone.row_key)\
+        .filter(Tombstone.table_name == table_name, Tombstone.deleted_at > since)
+    if user_id is not None:
+        query = query.filter(Tombstone.user_id == user_id)
+    return sorted({key for key, in query})
+
+
+def sync_timestamp():
+    """The as_of to return with a response, for the client's next ?since="""
+    return datetime.utcnow() - SYNC_SLACK
+
+
+def within_retention(since):
+    """Whether tombstones still cover everything deleted after `since`"""
+    return since >= datetime.utcnow() - TOMBSTONE_RETENTION
+
+
+def _invalidator(table):
+    def on_change(added, removed, versions):
+        invalidate(table)
+    return on_change
+
+
+# Writes committed by this process are seen by its caches immediately,
+# whether or not the module caching the table has been imported yet
+for _table in (*VERSIONED_TABLES, *COUNTED_TABLES):
+    changes.subscribe(_table, _invalidator(_table))
+
+
+def _tracked_table(obj):
+    table = getattr(obj, '__tablename__', None)
+    return table if table in VERSIONED_TABLES or table in COUNTED_TABLES else None
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_writes(session, flush_context):
+    touched = set()
+    deleted = {}
+    # session.new / dirty / deleted are rebuilt on every access: walk each once
+    for obj in session.new:
+        table = _tracked_table(obj)
+        if table:
+            touched.add(table)
+    for obj in session.dirty:
+        table = _tracked_table(obj)
+        if table and session.is_modified(obj, include_collections=False):
+            touched.add(table)
+    for obj in session.deleted:
+        table = _tracked_table(obj)
+        if not table:
+            continue
+        touched.add(table)
+        if table in VERSIONED_TABLES:
+            key, owner = VERSIONED_TABLES[table]
+            deleted.setdefault(table, []).append(
+                {key: getattr(obj, key), owner: getattr(obj, owner)} if owner else {key: getattr(obj, key)})
+    if not touched:
+        return
+    connection = session.connection()
+    changes.record_versions(session, bump(connection, *sorted(touched)))
+    for table, rows in deleted.items():
+        record_deletes(connection, table, rows)
@@ -0,0 +1,243 @@
+"""Streaming bulk import of demographic rows (Census ACS extracts).
+
+Input is read in batches (CSV via the csv module, Parquet via pyarrow's
+batch iterator), each value coerced to its column type, and every batch
+written with one INSERT ... ON CONFLICT(zip_code) DO UPDATE. The update
+only fires where some imported value differs from what is stored, so
+updated_at, the demographics data version and everything keyed on it
+only move for rows that really changed. Columns missing from the file
+are left untouched.
+"""
+import csv
+import os
+import time
+from datetime import datetime
+from app.extensions import db
+from app.models import Demographic
+from app.services import changes
+from app.services.admin_stats import rebuild as rebuild_admin_stats
+from app.services.data_version import BULK_TRANSACTION_SECONDS, bump, invalidate
+from app.services.upsert import insert_for
+
+BATCH_SIZE = 5000
+# Rows per transaction at most; BULK_TRANSACTION_SECONDS usually commits sooner
+COMMIT_ROWS = 100_000
+
+# column -> type
+COLUMNS = {
+    'zip_code': str,
+    'city': str,
+    'state': str,
+    'population': int,
+    'median_income': int,
+    'median_age': float,
+    'median_home_value': int,
+    'households': int,
+    'latitude': float,
+    'longitude': float,
+}
+
+# Header aliases, including the ACS 5-year detailed table estimates
+ALIASES = {
+    'zip': 'zip_code',
+    'zipcode': 'zip_code',
+    'zcta': 'zip_code',
+    'zcta5': 'zip_code',
+    'geo_id': 'zip_code',
+    'geoid': 'zip_code',
+    'b01003_001e': 'population',
+    'b19013_001e': 'median_income',
+    'b01002_001e': 'median_age',
+    'b25077_001e': 'median_home_value',
+    'b11001_001e': 'households',
+    'lat': 'latitude',
+    'intptlat': 'latitude',
+    'lon': 'longitude',
+    'lng': 'longitude',
+    'intptlong': 'longitude',
+}
+
+# How many rejected rows to keep for the report
+MAX_ERRORS = 20
+
+
+class ImportFileError(ValueError):
+    pass
+
+
+def _canonical(name):
+    name = name.strip().lower()
+    return ALIASES.get(name, name)
+
+
+def _zip_code(raw):
+    # ACS GEO_IDs look like 860Z200US64101, NAMEs like "ZCTA5 64101"
+    raw = raw.strip()
+    if 'US' in raw:
+        raw = raw.rsplit('US', 1)[1]
+    raw = raw.split()[-1] if raw else raw
+    if raw.isdigit():
+        raw = raw.zfill(5)
+    if not raw or len(raw) > 10:
+        raise ValueError('missing or malformed zip_code')
+    return raw
+
+
+def _number(raw, kind):
+    if raw is None:
+        return None
+    if isinstance(raw, str):
+        raw = raw.strip().replace(',', '')
+        if raw in ('', '-', 'N', '(X)', 'null', 'NULL'):
+            return None
+    value = float(raw)
+    # ACS annotates suppressed estimates with large negative sentinels
+    if value != value or value <= -99999:
+        return None
+    return int(round(value)) if kind is int else value
+
+
+def coerce(record):
+    """Typed column dict for one input record; raises ValueError if invalid"""
+    row = {}
+    for name, value in record.items():
+        kind = COLUMNS[name]
+        if name == 'zip_code':
+            row[name] = _zip_code(str(value) if value is not None else '')
+        elif kind is str:
+            value = str(value).strip() if value is not None else ''
+            row[name] = value or None
+        else:
+            try:
+                row[name] = _number(value, kind)
+            except ValueError:
+                raise ValueError(f'{name} is not a number: {value!r}')
+    if row.get('state') and len(row['state']) == 2:
+        row['state'] = row['state'].upper()
+    if row.get('latitude') is not None and not -90 <= row['latitude'] <= 90:
+        raise ValueError(f'latitude out of range: {row["latitude"]}')
+    if row.get('longitude') is not None and not -180 <= row['longitude'] <= 180:
+        raise ValueError(f'longitude out of range: {row["longitude"]}')
+    return row
+
+
+def _csv_batches(path, batch_size):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        first = f.readline()
+        delimiter = '\t' if '\t' in first else ','
+        header = [_canonical(h) for h in next(csv.reader([first], delimiter=delimiter))]
+        wanted = [(i, name) for i, name in enumerate(header) if name in COLUMNS]
+        yield [name for _, name in wanted]
+        batch = []
+        for line, record in enumerate(csv.reader(f, delimiter=delimiter), start=2):
+            batch.append((line, {name: record[i] if i < len(record) else None for i, name in wanted}))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def _parquet_batches(path, batch_size):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportFileError('Reading Parquet files needs pyarrow (pip install pyarrow)')
+    parquet = pq.ParquetFile(path)
+    wanted = {}
+    for name in parquet.schema_arrow.names:
+        if _canonical(name) in COLUMNS:
+            wanted.setdefault(_canonical(name), name)
+    yield list(wanted)
+    line = 1
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=list(wanted.values())):
+        data = batch.to_pydict()
+        rows = []
+        for i in range(batch.num_rows):
+            line += 1
+            rows.append((line, {name: data[source][i] for name, source in wanted.items()}))
+        yield rows
+
+
+def read_batches(path, batch_size=BATCH_SIZE):
+    """Yield the recognised column names, then lists of (line, raw record)"""
+    if os.path.splitext(path)[1].lower() in ('.parquet', '.pq'):
+        return _parquet_batches(path, batch_size)
+    return _csv_batches(path, batch_size)
+
+
+def _upsert_statement(connection, columns):
+    table = Demographic.__table__
+    insert = insert_for(connection, table)
+    updated = [name for name in columns if name != 'zip_code']
+    set_ = {name: insert.excluded[name] for name in updated}
+    set_['updated_at'] = insert.excluded.updated_at
+    changed = db.or_(*[table.c[name].is_distinct_from(insert.excluded[name]) for name in updated]) \
+        if updated else db.false()
+    return insert.on_conflict_do_update(index_elements=['zip_code'], set_=set_, where=changed)\
+        .returning(*table.c)
+
+
+def import_demographics(path, batch_size=BATCH_SIZE, commit_rows=COMMIT_ROWS):
+    """Upsert a CSV/Parquet file into demographics; returns stats.
+
+    stats has read / rejected / changed counts, the columns imported, the
+    first few rejected rows as (line, reason), and the elapsed seconds.
+    """
+    started = time.perf_counter()
+    batches = read_batches(path, batch_size)
+    columns = next(batches)
+    if 'zip_code' not in columns:
+        raise ImportFileError('The file has no zip_code (or ZCTA/GEO_ID) column')
+
+    stats = {'read': 0, 'rejected': 0, 'changed': 0, 'columns': columns, 'errors': []}
+    changed_rows, committed = [], []
+    connection = db.engine.connect()
+    try:
+        transaction = connection.begin()
+        opened, now = time.perf_counter(), datetime.utcnow()
+        statement = _upsert_statement(connection, columns)
+        pending = 0
+        for batch in batches:
+            rows = {}
+            for line, record in batch:
+                stats['read'] += 1
+                try:
+                    row = coerce(record)
+                except ValueError as exc:
+                    stats['rejected'] += 1
+                    if len(stats['errors']) < MAX_ERRORS:
+                        stats['errors'].append((line, str(exc)))
+                    continue
+                row['updated_at'] = now
+                # Last occurrence of a ZIP wins, as it would row by row
+                rows[row['zip_code']] = row
+            if not rows:
+                continue
+            result = connection.execute(statement, list(rows.values()))
+            changed_rows.extend(dict(r._mapping) for r in result)
+            pending += len(rows)
+            if pending >= commit_rows or time.perf_counter() - opened >= BULK_TRANSACTION_SECONDS:
+                if changed_rows:
+                    bump(connection, 'demographics')
+                    rebuild_admin_stats(connection, 'demographics')
+                transaction.commit()
+                committed.extend(changed_rows)
+                changed_rows, pending = [], 0
+                transaction = connection.begin()
+                opened, now = time.perf_counter(), datetime.utcnow()
+        if changed_rows:
+            bump(connection, 'demographics')
+            rebuild_admin_stats(connection, 'demographics')
+        transaction.commit()
+        committed.extend(changed_rows)
+    finally:
+        connection.close()
+        # Even if a later batch failed, earlier commits are in the table
+        if committed:
+            invalidate('demographics')
+            changes.notify('demographics', added=committed)
+
+    stats['changed'] = len(committed)
+    stats['seconds'] = time.perf_counter() - started
+    return stats
@@ -0,0 +1,182 @@
+"""Server-side filtering, field projection and keyset pagination for demographics"""
+from datetime import datetime
+from app.extensions import db
+from app.models import Demographic
+from app.models.demographic import (INCOME_BUCKETS, POPULATION_BUCKETS,
+                                    HOME_VALUE_BUCKETS, income_range)
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 5000
+
+# Fields a client can request with ?fields=
+COLUMN_FIELDS = ('id', 'zip_code', 'city', 'state', 'population', 'median_income',
+                 'median_age', 'median_home_value', 'households', 'latitude', 'longitude')
+DERIVED_FIELDS = ('income_range',)
+DEFAULT_FIELDS = COLUMN_FIELDS + DERIVED_FIELDS
+
+
+class FilterError(ValueError):
+    """Raised for malformed filter parameters (reported as 400)"""
+
+
+def _split(args, *names):
+    """Collect comma separated and repeated values for a parameter"""
+    values = []
+    for name in names:
+        for raw in args.getlist(name):
+            values.extend(v.strip().lower() for v in raw.split(',') if v.strip())
+    return values
+
+
+def _choices(args, buckets, *names):
+    values = _split(args, *names)
+    unknown = [v for v in values if v not in buckets]
+    if unknown:
+        raise FilterError(f'Unknown {names[0]} filter: {", ".join(unknown)}')
+    return values
+
+
+def parse_bbox(raw):
+    """Parse 'min_lon,min_lat,max_lon,max_lat' (Leaflet toBBoxString order)"""
+    if not raw:
+        return None
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in raw.split(','))
+    except ValueError:
+        raise FilterError('bbox must be min_lon,min_lat,max_lon,max_lat')
+    if min_lon > max_lon or min_lat > max_lat:
+        raise FilterError('bbox minimums must not exceed maximums')
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def parse_filters(args):
+    """Build the filter dict from request args"""
+    return {
+        'income': _choices(args, INCOME_BUCKETS, 'income'),
+        'population': _choices(args, POPULATION_BUCKETS, 'population'),
+        'home_value': _choices(args, HOME_VALUE_BUCKETS, 'home_value', 'home-value'),
+        'q': args.get('q', '').strip().lower(),
+        'bbox': parse_bbox(args.get('bbox')),
+    }
+
+
+def parse_fields(raw):
+    if not raw:
+        return list(DEFAULT_FIELDS)
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in DEFAULT_FIELDS]
+    if unknown:
+        raise FilterError(f'Unknown fields: {", ".join(unknown)}')
+    return fields
+
+
+def parse_limit(raw):
+    if not raw:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise FilterError('limit must be an integer')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def parse_since(raw):
+    """Parse a ?since= timestamp (the as_of of an earlier response)"""
+    if not raw:
+        return None
+    try:
+        since = datetime.fromisoformat(raw.strip().replace('Z', ''))
+    except ValueError:
+        raise FilterError('since must be an ISO timestamp, e.g. the as_of of an earlier response')
+    # Stored timestamps are naive UTC
+    return since.replace(tzinfo=None)
+
+
+def _bucket_clause(column, buckets, keys):
+    clauses = []
+    for key in keys:
+        low, high = buckets[key]
+        bounds = []
+        if low is not None:
+            bounds.append(column >= low)
+        if high is not None:
+            bounds.append(column < high)
+        clause = db.and_(*bounds)
+        if low is None:
+            # The map has always treated a missing value as zero
+            clause = db.or_(clause, column.is_(None))
+        clauses.append(clause)
+    return db.or_(*clauses)
+
+
+def _prefix_clause(expr, prefix):
+    # A range instead of LIKE so SQLite can use the index
+    return db.and_(expr >= prefix, expr < prefix + '\uffff')
+
+
+def filter_conditions(filters):
+    """SQL conditions for a parsed filter dict"""
+    conditions = []
+    if filters['income']:
+        conditions.append(_bucket_clause(Demographic.median_income, INCOME_BUCKETS, filters['income']))
+    if filters['population']:
+        conditions.append(_bucket_clause(Demographic.population, POPULATION_BUCKETS, filters['population']))
+    if filters['home_value']:
+        conditions.append(_bucket_clause(Demographic.median_home_value, HOME_VALUE_BUCKETS, filters['home_value']))
+    if filters['q']:
+        conditions.append(db.or_(
+            _prefix_clause(Demographic.zip_code, filters['q']),
+            _prefix_clause(db.func.lower(Demographic.city), filters['q']),
+        ))
+    if filters['bbox']:
+        min_lon, min_lat, max_lon, max_lat = filters['bbox']
+        conditions.append(Demographic.latitude.between(min_lat, max_lat))
+        conditions.append(Demographic.longitude.between(min_lon, max_lon))
+    return conditions
+
+
+def query_demographics(filters, fields, limit=DEFAULT_PAGE_SIZE, after=None, since=None):
+    """Return (rows, next_cursor) for one page ordered by zip code.
+
+    With `since`, only rows updated after that time are returned.
+    """
+    selected = [f for f in COLUMN_FIELDS if f in fields]
+    if 'zip_code' not in selected:
+        selected.append('zip_code')
+    if 'income_range' in fields and 'median_income' not in selected:
+        selected.append('median_income')
+
+    query = db.session.query(*[getattr(Demographic, f) for f in selected])\
+        .filter(*filter_conditions(filters))
+    if after:
+        query = query.filter(Demographic.zip_code > after)
+    if since:
+        query = query.filter(Demographic.updated_at > since)
+    records = query.order_by(Demographic.zip_code).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        next_cursor = records[-1].zip_code
+
+    rows = []
+    for record in records:
+        values = record._mapping
+        row = {f: values[f] for f in fields if f in values}
+        if 'income_range' in fields:
+            row['income_range'] = income_range(values['median_income'])
+        rows.append(row)
+    return rows, next_cursor
+
+
+def changed_outside(filters, since):
+    """Zip codes updated after `since` that no longer match the filters"""
+    conditions = filter_conditions(filters)
+    if not conditions:
+        return []
+    # NULL-valued comparisons don't match the filters either
+    matches = db.func.coalesce(db.and_(*conditions), False)
+    query = db.session.query(Demographic.zip_code)\
+        .filter(Demographic.updated_at > since, db.not_(matches))\
+        .order_by(Demographic.zip_code)
+    return [zip_code for zip_code, in query]
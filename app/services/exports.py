@@ -0,0 +1,177 @@
+"""Streaming table exports (CSV, NDJSON, Parquet) in constant memory.
+
+Rows are read with a server-side cursor (stream_results + yield_per) as
+plain Core tuples, never ORM objects, and each batch is encoded and
+handed to the response before the next one is fetched. The first bytes
+go out as soon as the first batch is read, and memory stays at one batch
+whatever the table size. gzip, when asked for, is applied incrementally
+to the same stream.
+
+Parquet needs the optional `pyarrow` package; each batch becomes a row
+group.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from sqlalchemy import select
+from app.database import READ_BIND
+from app.extensions import db
+from app.models import Location, SavedAddress, SearchHistory
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORTS = {
+    'locations': Location,
+    'saved_addresses': SavedAddress,
+    'search_history': SearchHistory,
+}
+MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+BATCH_SIZE = 5000
+GZIP_LEVEL = 6
+
+
+class ExportError(Exception):
+    """Unknown table or format, or a format that can't be produced here"""
+
+
+def check_export(table, fmt, compress=False):
+    if table not in EXPORTS:
+        raise ExportError(f'Unknown table: {table}')
+    if fmt not in MIMETYPES:
+        raise ExportError(f'format must be one of {", ".join(MIMETYPES)}')
+    if fmt == 'parquet':
+        if pyarrow is None:
+            raise ExportError('Parquet export needs the pyarrow package')
+        if compress:
+            raise ExportError('Parquet files are already compressed')
+
+
+def _batches(table):
+    """Lists of row tuples, BATCH_SIZE at a time, from a server-side cursor"""
+    # Long reads go to the read-only pool when there is one
+    engine = db.engines.get(READ_BIND) or db.engine
+    statement = select(*table.columns).order_by(*table.primary_key.columns)
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=BATCH_SIZE)\
+            .execute(statement)
+        for partition in result.partitions():
+            yield partition
+
+
+def _iso(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _text(value):
+    """A value for a text cell: ISO dates, JSON columns as JSON"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'))
+    return value
+
+
+def _csv(table):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.name for column in table.columns])
+    for rows in _batches(table):
+        writer.writerows([['' if v is None else _text(v) for v in row] for row in rows])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # A table with no rows still gets its header
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ndjson(table):
+    names = [column.name for column in table.columns]
+    for rows in _batches(table):
+        yield ''.join(json.dumps(dict(zip(names, row)), default=_iso, separators=(',', ':')) + '\n'
+                      for row in rows).encode()
+
+
+def _arrow_type(column):
+    if isinstance(column.type, db.JSON):
+        return pyarrow.string()
+    python_type = column.type.python_type
+    if python_type is bool:
+        return pyarrow.bool_()
+    if python_type is int:
+        return pyarrow.int64()
+    if python_type is float:
+        return pyarrow.float64()
+    if python_type is datetime:
+        return pyarrow.timestamp('us')
+    return pyarrow.string()
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands its contents out after every row group"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet(table):
+    schema = pyarrow.schema([(column.name, _arrow_type(column)) for column in table.columns])
+    json_columns = {i for i, column in enumerate(table.columns) if isinstance(column.type, db.JSON)}
+    sink = _Sink()
+    with pyarrow.parquet.ParquetWriter(sink, schema) as writer:
+        for rows in _batches(table):
+            values = list(zip(*rows))
+            arrays = [[_text(v) for v in values[i]] if i in json_columns else values[i]
+                      for i in range(len(schema))]
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(a, type=t) for a, t in zip(arrays, schema.types)], schema=schema))
+            yield sink.drain()
+    # The footer is written on close
+    yield sink.drain()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+ENCODERS = {'csv': _csv, 'ndjson': _ndjson, 'parquet': _parquet}
+
+
+def stream_export(table, fmt, compress=False):
+    """Generator of the encoded export (call check_export() first)"""
+    chunks = ENCODERS[fmt](EXPORTS[table].__table__)
+    return _gzip(chunks) if compress else chunks
@@ -0,0 +1,123 @@
+"""Bulk loader for ZIP (ZCTA) centroids.
+
+Reads the Census Gazetteer ZCTA file (tab separated, GEOID / INTPTLAT /
+INTPTLONG columns) or any CSV with zip_code / latitude / longitude
+columns, streaming it in chunks and writing each chunk with one
+executemany. Rows whose coordinates did not change are left alone, so
+updated_at (and the demographics data version) only moves when
+something did.
+"""
+import csv
+import time
+from datetime import datetime
+from sqlalchemy import bindparam
+from app.extensions import db
+from app.models import Demographic
+from app.services.data_version import BULK_TRANSACTION_SECONDS, bump, invalidate
+from app.services.upsert import insert_for
+
+CHUNK_SIZE = 5000
+
+ZIP_HEADERS = ('geoid', 'zcta5', 'zcta', 'zip_code', 'zip', 'zipcode')
+LAT_HEADERS = ('intptlat', 'latitude', 'lat')
+LON_HEADERS = ('intptlong', 'longitude', 'lon', 'lng')
+
+
+def _column(header, names):
+    for i, name in enumerate(header):
+        if name in names:
+            return i
+    raise ValueError(f'No column named any of: {", ".join(names)}')
+
+
+def read_centroids(path):
+    """Yield (zip_code, lat, lon) from a gazetteer/CSV file; bad rows yield None"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        first = f.readline()
+        delimiter = '\t' if '\t' in first else ','
+        header = [h.strip().lower() for h in next(csv.reader([first], delimiter=delimiter))]
+        zip_i = _column(header, ZIP_HEADERS)
+        lat_i = _column(header, LAT_HEADERS)
+        lon_i = _column(header, LON_HEADERS)
+        for record in csv.reader(f, delimiter=delimiter):
+            try:
+                zip_code = record[zip_i].strip()
+                lat = float(record[lat_i])
+                lon = float(record[lon_i])
+            except (IndexError, ValueError):
+                yield None
+                continue
+            # Spreadsheets drop the leading zero of New England ZIPs
+            if zip_code.isdigit():
+                zip_code = zip_code.zfill(5)
+            if not zip_code or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                yield None
+                continue
+            yield zip_code, lat, lon
+
+
+def _write_chunk(connection, chunk, create_missing, now):
+    table = Demographic.__table__
+    if create_missing:
+        insert = insert_for(connection, table)
+        statement = insert.on_conflict_do_update(
+            index_elements=['zip_code'],
+            set_={'latitude': insert.excluded.latitude,
+                  'longitude': insert.excluded.longitude,
+                  'updated_at': insert.excluded.updated_at},
+            where=db.or_(table.c.latitude.is_distinct_from(insert.excluded.latitude),
+                         table.c.longitude.is_distinct_from(insert.excluded.longitude)))
+        rows = [{'zip_code': z, 'latitude': lat, 'longitude': lon, 'updated_at': now}
+                for z, lat, lon in chunk]
+    else:
+        statement = table.update()\
+            .where(table.c.zip_code == bindparam('zip'))\
+            .where(db.or_(table.c.latitude.is_distinct_from(bindparam('lat')),
+                          table.c.longitude.is_distinct_from(bindparam('lon'))))\
+            .values(latitude=bindparam('lat'), longitude=bindparam('lon'), updated_at=now)
+        rows = [{'zip': z, 'lat': lat, 'lon': lon} for z, lat, lon in chunk]
+    return connection.execute(statement, rows).rowcount
+
+
+def load_centroids(path, create_missing=False, chunk_size=CHUNK_SIZE):
+    """Load centroids into demographics.latitude/longitude; returns stats.
+
+    Without create_missing only ZIPs that already have a demographics row
+    are updated; with it, ZIPs not yet in the table get a row holding just
+    the centroid, to be filled in by a later demographic import.
+    """
+    started = time.perf_counter()
+    stats = {'read': 0, 'skipped': 0, 'changed': 0}
+    chunk, changed = [], 0
+    connection = db.engine.connect()
+    try:
+        transaction = connection.begin()
+        opened, now = time.perf_counter(), datetime.utcnow()
+        for row in read_centroids(path):
+            if row is None:
+                stats['skipped'] += 1
+                continue
+            stats['read'] += 1
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                changed += max(_write_chunk(connection, chunk, create_missing, now), 0)
+                chunk = []
+                if time.perf_counter() - opened >= BULK_TRANSACTION_SECONDS:
+                    if changed:
+                        bump(connection, 'demographics')
+                    transaction.commit()
+                    stats['changed'] += changed
+                    changed = 0
+                    transaction = connection.begin()
+                    opened, now = time.perf_counter(), datetime.utcnow()
+        if chunk:
+            changed += max(_write_chunk(connection, chunk, create_missing, now), 0)
+        if changed:
+            bump(connection, 'demographics')
+        transaction.commit()
+        stats['changed'] += changed
+    finally:
+        connection.close()
+        invalidate('demographics')
+    stats['seconds'] = time.perf_counter() - started
+    return stats
@@ -0,0 +1,67 @@
+"""Web Mercator tile math and great-circle distances"""
+import math
+import numpy as np
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.05112878
+# Ground resolution of zoom 0 at the equator
+METERS_PER_PIXEL_Z0 = 156543.03392
+EARTH_RADIUS_MILES = 3958.8
+
+
+def project(lat, lon, zoom):
+    """Global pixel coordinates of lat/lon (scalars or arrays) at a zoom level"""
+    lat = np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)
+    scale = TILE_SIZE * 2 ** zoom
+    x = (np.asarray(lon) + 180.0) / 360.0 * scale
+    sin_lat = np.sin(np.radians(lat))
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * scale
+    return x, y
+
+
+def unproject(x, y, zoom):
+    """Inverse of project(): (lat, lon) of global pixel coordinates"""
+    scale = TILE_SIZE * 2 ** zoom
+    lon = x / scale * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / scale))))
+    return lat, lon
+
+
+def tile_bounds(zoom, x, y, pad_pixels=0):
+    """(min_lon, min_lat, max_lon, max_lat) of an XYZ tile, optionally padded"""
+    max_lat, min_lon = unproject(x * TILE_SIZE - pad_pixels, y * TILE_SIZE - pad_pixels, zoom)
+    min_lat, max_lon = unproject((x + 1) * TILE_SIZE + pad_pixels,
+                                 (y + 1) * TILE_SIZE + pad_pixels, zoom)
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def tiles_covering(bbox, zoom):
+    """Yield (x, y) for every tile at a zoom level that intersects a bbox"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    last = 2 ** zoom - 1
+    x0, y0 = project(max_lat, min_lon, zoom)
+    x1, y1 = project(min_lat, max_lon, zoom)
+    for x in range(max(0, int(x0 // TILE_SIZE)), min(last, int(x1 // TILE_SIZE)) + 1):
+        for y in range(max(0, int(y0 // TILE_SIZE)), min(last, int(y1 // TILE_SIZE)) + 1):
+            yield x, y
+
+
+def meters_per_pixel(lat, zoom):
+    return METERS_PER_PIXEL_Z0 * math.cos(math.radians(lat)) / 2 ** zoom
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """Great-circle distance in miles; broadcasts over NumPy arrays"""
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def radius_bbox(lat, lon, miles):
+    """Bounding box (min_lon, min_lat, max_lon, max_lat) enclosing a circle"""
+    dlat = math.degrees(miles / EARTH_RADIUS_MILES)
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    dlon = min(180.0, dlat / cos_lat)
+    return (max(-180.0, lon - dlon), max(-90.0, lat - dlat),
+            min(180.0, lon + dlon), min(90.0, lat + dlat))
@@ -0,0 +1,224 @@
+"""Kernel-density heat surfaces rendered into XYZ map tiles.
+
+Points (ZIP centroids weighted by a demographic metric, or business
+locations) are binned onto the tile's pixel grid and blurred with a
+separable Gaussian, all in NumPy. Additive metrics (population,
+households, locations) are summed; per-ZIP medians are averaged with the
+kernel as weights so overlapping ZIPs don't add up to nonsense values.
+"""
+import json
+import struct
+import zlib
+from collections import OrderedDict
+import numpy as np
+from app.extensions import db
+from app.metrics import cache_event
+from app.models import Demographic, Location
+from app.services.data_version import data_version
+from app.services.demographic_query import filter_conditions
+from app.services.geo import TILE_SIZE, project, tile_bounds, meters_per_pixel
+
+# metric -> (source table, how overlapping kernels combine)
+METRICS = {
+    'population': ('demographics', 'sum'),
+    'households': ('demographics', 'sum'),
+    'median_income': ('demographics', 'mean'),
+    'median_home_value': ('demographics', 'mean'),
+    'median_age': ('demographics', 'mean'),
+    'locations': ('locations', 'sum'),
+}
+
+# Kernel bandwidth on the ground, clamped to a pixel range so very low and
+# very high zooms stay cheap to render
+BANDWIDTH_METERS = {'demographics': 4000.0, 'locations': 1500.0}
+MIN_SIGMA_PX = 1.5
+MAX_SIGMA_PX = 48.0
+
+MAX_POINT_SETS = 8
+
+
+def _heat_lut():
+    """256-entry RGB ramp: blue -> cyan -> lime -> yellow -> red"""
+    stops = np.array([[0, 0, 255], [0, 255, 255], [0, 255, 0], [255, 255, 0], [255, 0, 0]], float)
+    positions = np.linspace(0, 1, len(stops))
+    ramp = np.linspace(0, 1, 256)
+    return np.stack([np.interp(ramp, positions, stops[:, c]) for c in range(3)], axis=1).astype(np.uint8)
+
+
+HEAT_LUT = _heat_lut()
+
+
+class PointSet:
+    """Weighted points for one metric/filter combination"""
+
+    def __init__(self, metric, lat, lon, weight):
+        self.metric = metric
+        self.source, self.mode = METRICS[metric]
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.weight = np.asarray(weight, dtype=np.float64)
+        # Colour scale: robust range of the weights so outliers don't wash
+        # out every other tile
+        if len(self.weight):
+            self.low, self.high = np.percentile(self.weight, [2, 98]) if self.mode == 'mean' \
+                else (0.0, np.percentile(self.weight, 98))
+        else:
+            self.low, self.high = 0.0, 1.0
+        if self.high <= self.low:
+            self.high = self.low + 1.0
+
+    def __len__(self):
+        return len(self.weight)
+
+    def extent(self):
+        if not len(self):
+            return None
+        return float(self.lon.min()), float(self.lat.min()), float(self.lon.max()), float(self.lat.max())
+
+
+_point_sets = OrderedDict()
+
+
+def load_points(metric, filters, scope=None, business_type=None, version=None):
+    """Load (and memoise per data version) the points behind a heat surface"""
+    key = (metric, json.dumps(filters, sort_keys=True), scope, business_type, version)
+    cache_event('heat_points', key in _point_sets)
+    if key in _point_sets:
+        _point_sets.move_to_end(key)
+        return _point_sets[key]
+
+    source, _ = METRICS[metric]
+    if source == 'demographics':
+        column = getattr(Demographic, metric)
+        rows = db.session.query(Demographic.latitude, Demographic.longitude, column)\
+            .filter(Demographic.latitude.isnot(None), Demographic.longitude.isnot(None),
+                    column.isnot(None), *filter_conditions(filters))\
+            .all()
+    else:
+        query = db.session.query(Location.latitude, Location.longitude, db.literal(1.0))\
+            .filter(Location.latitude.isnot(None), Location.longitude.isnot(None))
+        if scope != 'all':
+            query = query.filter(Location.user_id == scope)
+        if business_type:
+            query = query.filter(Location.business_type == business_type)
+        rows = query.all()
+
+    columns = list(zip(*rows)) if rows else ([], [], [])
+    points = PointSet(metric, *columns)
+    _point_sets[key] = points
+    while len(_point_sets) > MAX_POINT_SETS:
+        _point_sets.popitem(last=False)
+    return points
+
+
+def _blur(grid, sigma):
+    """Separable Gaussian blur (valid region only) via sliding windows"""
+    radius = int(np.ceil(3 * sigma))
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-offsets ** 2 / (2 * sigma ** 2))
+    windows = np.lib.stride_tricks.sliding_window_view(grid, len(kernel), axis=1)
+    grid = windows @ kernel
+    windows = np.lib.stride_tricks.sliding_window_view(grid, len(kernel), axis=0)
+    return windows @ kernel
+
+
+def render_surface(points, zoom, x, y):
+    """Heat values for a tile as (value, coverage) float arrays, or None if empty.
+
+    For 'sum' metrics value is the kernel-summed weight; for 'mean' metrics it
+    is the kernel-weighted average. Coverage is the summed kernel (1.0 at a
+    lone point) and drives transparency.
+    """
+    if not len(points):
+        return None
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(zoom, x, y)
+    center_lat = (min_lat + max_lat) / 2
+    sigma = BANDWIDTH_METERS[points.source] / meters_per_pixel(center_lat, zoom)
+    sigma = float(np.clip(sigma, MIN_SIGMA_PX, MAX_SIGMA_PX))
+    pad = int(np.ceil(3 * sigma))
+
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(zoom, x, y, pad_pixels=pad)
+    mask = (points.lat >= min_lat) & (points.lat <= max_lat) & \
+           (points.lon >= min_lon) & (points.lon <= max_lon)
+    if not mask.any():
+        return None
+
+    px, py = project(points.lat[mask], points.lon[mask], zoom)
+    size = TILE_SIZE + 2 * pad
+    ix = np.clip((px - x * TILE_SIZE + pad).astype(np.int64), 0, size - 1)
+    iy = np.clip((py - y * TILE_SIZE + pad).astype(np.int64), 0, size - 1)
+    flat = iy * size + ix
+
+    counts = np.bincount(flat, minlength=size * size).reshape(size, size).astype(np.float64)
+    weighted = np.bincount(flat, weights=points.weight[mask], minlength=size * size)
+    coverage = _blur(counts, sigma)
+    total = _blur(weighted.reshape(size, size), sigma)
+    if points.mode == 'sum':
+        value = total
+    else:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = np.where(coverage > 1e-3, total / coverage, np.nan)
+    return value.astype(np.float32), coverage.astype(np.float32)
+
+
+def colorize(points, value, coverage):
+    """RGBA uint8 image for a rendered surface"""
+    norm = (np.nan_to_num(value, nan=points.low) - points.low) / (points.high - points.low)
+    norm = np.clip(norm, 0.0, 1.0)
+    rgba = np.empty(value.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = HEAT_LUT[(norm * 255).astype(np.uint8)]
+    if points.mode == 'sum':
+        alpha = np.clip(norm * 2.0, 0.0, 1.0)
+    else:
+        alpha = np.clip(coverage, 0.0, 1.0)
+    rgba[..., 3] = (alpha * 200).astype(np.uint8)
+    return rgba
+
+
+def encode_png(rgba):
+    """Minimal RGBA PNG encoder (no imaging library needed)"""
+    height, width = rgba.shape[:2]
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + \
+            struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + \
+        chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + chunk(b'IEND', b'')
+
+
+EMPTY_PNG = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+EMPTY_F32 = np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype='<f4').tobytes()
+
+
+def render_tile(points, zoom, x, y, fmt='png'):
+    """Encoded tile bytes: 'png' image or 'f32' raw little-endian float32 values"""
+    surface = render_surface(points, zoom, x, y)
+    if surface is None:
+        return EMPTY_PNG if fmt == 'png' else EMPTY_F32
+    value, coverage = surface
+    if fmt == 'png':
+        return encode_png(colorize(points, value, coverage))
+    if points.mode == 'sum':
+        value = np.where(coverage > 1e-3, value, np.nan)
+    return value.astype('<f4').tobytes()
+
+
+def tile_key(metric, filters, zoom, x, y, fmt, scope, business_type, version):
+    return '|'.join([metric, fmt, json.dumps(filters, sort_keys=True), str(scope),
+                     str(business_type), version, f'{zoom}/{x}/{y}'])
+
+
+def get_tile(cache, metric, filters, zoom, x, y, fmt='png', scope=None, business_type=None):
+    """(cache key, tile bytes), rendering and caching the tile on a miss"""
+    version = data_version(METRICS[metric][0])
+    key = tile_key(metric, filters, zoom, x, y, fmt, scope, business_type, version)
+    data = cache.get(key)
+    if data is None:
+        points = load_points(metric, filters, scope, business_type, version)
+        data = render_tile(points, zoom, x, y, fmt)
+        cache.set(key, data)
+    return key, data
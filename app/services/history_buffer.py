@@ -0,0 +1,250 @@
+"""Write-behind buffer for search history.
+
+The map logs a history entry on every filter click. Instead of an INSERT
+and COMMIT per click, entries are queued in memory and written by a
+background thread in multi-row INSERTs, every FLUSH_INTERVAL seconds or
+as soon as FLUSH_SIZE entries are waiting.
+
+Per user, a burst of clicks collapses to its final filter set (an entry
+replaces the user's still-queued one if it came within DEBOUNCE_SECONDS)
+and an entry identical to the user's previous one is dropped while that
+one is still queued or less than DEBOUNCE_SECONDS old; the same search
+made again later is recorded again, so it returns to the top. Buffered
+entries are flushed at interpreter exit, which covers gunicorn's
+graceful worker shutdown.
+
+A batch the database rejects is retried row by row: rows that fail on
+their own are logged and dropped, so one bad entry can't hold up the
+rest. When the database itself is unavailable, everything not yet
+written goes back on the queue for the next attempt.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from sqlalchemy.exc import OperationalError
+from app.extensions import db
+from app.metrics import Counter, Gauge, Histogram, register
+from app.models import SearchHistory
+
+FLUSH_INTERVAL = 5.0
+FLUSH_SIZE = 200
+DEBOUNCE_SECONDS = 2.0
+# Rows per INSERT statement
+INSERT_CHUNK = 500
+
+FLUSH_SECONDS = register(Histogram('search_history_flush_seconds',
+                                   'Time to write one batch of buffered search history.'))
+ENTRIES = register(Counter('search_history_entries_total',
+                           'Search history entries by what the buffer did with them.', ('outcome',)))
+
+
+def _key(zip_code, filters):
+    return zip_code, json.dumps(filters, sort_keys=True)
+
+
+class HistoryBuffer:
+    """Queued search history entries for one app"""
+
+    def __init__(self, app, interval=FLUSH_INTERVAL, size=FLUSH_SIZE, debounce=DEBOUNCE_SECONDS):
+        self.app = app
+        self.interval = interval
+        self.size = size
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = []
+        # user_id -> (index in _pending or None, entry key, monotonic time)
+        self._last = {}
+        # Users with rows in the batch being written
+        self._writing = set()
+        self._thread = None
+        self._pid = None
+        self.stats = {
+            'queued': 0,
+            'debounced': 0,
+            'deduplicated': 0,
+            'written': 0,
+            'dropped': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'last_flush_seconds': 0.0,
+            'max_flush_seconds': 0.0,
+        }
+
+    def depth(self):
+        return len(self._pending)
+
+    def add(self, user_id, zip_code, filters):
+        """Queue an entry; returns 'queued', 'debounced' or 'deduplicated'"""
+        key = _key(zip_code, filters)
+        now = time.monotonic()
+        entry = {'user_id': user_id, 'zip_code': zip_code, 'filters': filters,
+                 'search_date': datetime.utcnow()}
+        with self._lock:
+            index, last_key, last_time = self._last.get(user_id, (None, None, 0.0))
+            recent = now - last_time < self.debounce
+            if key == last_key and (index is not None or recent):
+                # A repeat within the same burst
+                self._last[user_id] = (index, key, now)
+                outcome = 'deduplicated'
+            elif index is not None and recent:
+                # Still queued and part of the same burst: keep the final state
+                self._pending[index] = entry
+                self._last[user_id] = (index, key, now)
+                outcome = 'debounced'
+            else:
+                self._pending.append(entry)
+                self._last[user_id] = (len(self._pending) - 1, key, now)
+                outcome = 'queued'
+            self.stats[outcome] += 1
+            full = len(self._pending) >= self.size
+        ENTRIES.inc(outcome)
+        self._ensure_thread()
+        if full:
+            self._wake.set()
+        return outcome
+
+    def has_pending(self, user_id):
+        """Whether the user has entries queued or being written"""
+        with self._lock:
+            return user_id in self._writing or self._last.get(user_id, (None,))[0] is not None
+
+    def flush(self):
+        """Write everything queued so far; returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+                self._writing = {row['user_id'] for row in rows}
+                self._forget_queued()
+            if not rows:
+                return 0
+            started = time.perf_counter()
+            try:
+                with self.app.app_context():
+                    written = self._write(rows)
+            except Exception:
+                self.stats['flush_errors'] += 1
+                raise
+            finally:
+                with self._lock:
+                    self._writing = set()
+            elapsed = time.perf_counter() - started
+            FLUSH_SECONDS.observe(elapsed)
+            ENTRIES.inc('written', amount=written)
+            self.stats['flushes'] += 1
+            self.stats['written'] += written
+            self.stats['last_flush_seconds'] = elapsed
+            self.stats['max_flush_seconds'] = max(self.stats['max_flush_seconds'], elapsed)
+            return written
+
+    def _write(self, rows):
+        """Insert rows a chunk per statement; a failed chunk is retried row by row"""
+        table = SearchHistory.__table__
+        written = 0
+        for start in range(0, len(rows), INSERT_CHUNK):
+            chunk = rows[start:start + INSERT_CHUNK]
+            try:
+                db.session.execute(table.insert().values(chunk))
+                db.session.commit()
+                written += len(chunk)
+                continue
+            except OperationalError:
+                # The database, not the rows: retry them all later
+                db.session.rollback()
+                self._requeue(rows[start:])
+                raise
+            except Exception:
+                db.session.rollback()
+            for i, row in enumerate(chunk):
+                try:
+                    db.session.execute(table.insert().values([row]))
+                    db.session.commit()
+                    written += 1
+                except OperationalError:
+                    db.session.rollback()
+                    self._requeue(chunk[i:] + rows[start + INSERT_CHUNK:])
+                    raise
+                except Exception:
+                    db.session.rollback()
+                    self.stats['dropped'] += 1
+                    ENTRIES.inc('dropped')
+                    self.app.logger.exception('Dropped a search history entry that could not be '
+                                              'written: %r', row)
+        return written
+
+    def _requeue(self, rows):
+        """Put unwritten rows back in front of anything queued since"""
+        with self._lock:
+            self._pending[:0] = rows
+            self._reindex()
+
+    def _reindex(self):
+        """Point each user's _last entry at their newest queued row"""
+        newest = {}
+        for i, entry in enumerate(self._pending):
+            newest[entry['user_id']] = i
+        last = {user: (None, key, t) for user, (_, key, t) in self._last.items()}
+        for user, i in newest.items():
+            entry = self._pending[i]
+            last[user] = (i, _key(entry['zip_code'], entry['filters']), last.get(user, (None, None, 0.0))[2])
+        self._last = last
+
+    def _forget_queued(self):
+        """Drop queue positions, and users whose last entry is past the debounce window"""
+        now = time.monotonic()
+        self._last = {user: (None, key, t) for user, (_, key, t) in self._last.items()
+                      if now - t < self.debounce}
+
+    def snapshot_stats(self):
+        return dict(self.stats, depth=self.depth())
+
+    def _ensure_thread(self):
+        # A forked worker inherits the object but not the thread
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='history-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Search history flush failed')
+
+    def close(self):
+        """Flush what is left (called at exit)"""
+        try:
+            self.flush()
+        except Exception:
+            self.app.logger.exception('Search history lost at shutdown: %d entries', self.depth())
+
+
+_create_lock = threading.Lock()
+
+
+def get_history_buffer(app):
+    """The app's HistoryBuffer, created on first use"""
+    # The flush thread needs the app itself, not the current_app proxy
+    app = getattr(app, '_get_current_object', lambda: app)()
+    with _create_lock:
+        buffer = app.extensions.get('history_buffer')
+        if buffer is None:
+            buffer = HistoryBuffer(app,
+                                   interval=app.config.get('HISTORY_FLUSH_INTERVAL', FLUSH_INTERVAL),
+                                   size=app.config.get('HISTORY_FLUSH_SIZE', FLUSH_SIZE))
+            app.extensions['history_buffer'] = buffer
+            atexit.register(buffer.close)
+            register(Gauge('search_history_buffer_depth',
+                           'Search history entries waiting to be written.', buffer.depth))
+        return buffer
@@ -0,0 +1,154 @@
+"""Who is making a request, without a user query per request.
+
+Flask-Login calls load_user() on every authenticated request. Loaded
+users are kept in a small TTL+LRU cache as detached copies and merged
+into the request's session with load=False, which costs no SQL. Entries
+are tagged with the 'user' table's data version, so a change committed
+by any worker is picked up within the version TTL; changes committed by
+this process drop their entries immediately.
+
+Read-only API endpoints go one step further with identity(): the user id
+and admin flag are stored as claims in the signed session cookie at
+login and re-issued when older than SESSION_CLAIMS_MAX_AGE, so those
+endpoints authorize from the cookie alone.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from flask import current_app, has_request_context, session
+from flask_login import current_user
+from sqlalchemy.orm import make_transient_to_detached
+from app.extensions import db, login_manager
+from app.metrics import cache_event
+from app.models import User
+from app.services import changes
+from app.services.data_version import data_version
+
+CACHE_SIZE = 1024
+CACHE_TTL = 60.0
+CLAIMS_MAX_AGE = 300
+CLAIMS_KEY = '_identity'
+
+Identity = namedtuple('Identity', 'id is_admin')
+
+
+class UserCache:
+    """Detached User copies by id, least recently used evicted first"""
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, version):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            stored_at, stored_version, user = entry
+            if stored_version != version or time.monotonic() - stored_at > self.ttl:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def put(self, user_id, version, user):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic(), version, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = UserCache()
+
+
+def _configure():
+    _cache.size = current_app.config.get('USER_CACHE_SIZE', CACHE_SIZE)
+    _cache.ttl = current_app.config.get('USER_CACHE_TTL', CACHE_TTL)
+
+
+def _detached_copy(user):
+    copy = User(**{attr.key: getattr(user, attr.key) for attr in User.__mapper__.column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+
+def load_user(user_id):
+    """The User for a session, from the cache when possible"""
+    _configure()
+    if not _cache.ttl:
+        return db.session.get(User, user_id)
+    version = data_version('user')
+    cached = _cache.get(user_id, version)
+    cache_event('user', cached is not None)
+    if cached is not None:
+        # Attaches a copy to this session without loading it
+        return db.session.merge(cached, load=False)
+    user = db.session.get(User, user_id)
+    if user is not None:
+        _cache.put(user_id, version, _detached_copy(user))
+    return user
+
+
+def _on_change(added, removed, versions):
+    _cache.discard(*{row['id'] for row in list(added) + list(removed)})
+
+
+changes.subscribe('user', _on_change)
+
+
+# ============= SESSION CLAIMS =============
+
+def store_claims(user):
+    """Put the user's id and admin flag in the signed session"""
+    session[CLAIMS_KEY] = {'id': user.id, 'is_admin': bool(user.is_admin), 'iat': int(time.time())}
+
+
+def clear_claims():
+    session.pop(CLAIMS_KEY, None)
+
+
+def _claims():
+    max_age = current_app.config.get('SESSION_CLAIMS_MAX_AGE', CLAIMS_MAX_AGE)
+    claims = session.get(CLAIMS_KEY)
+    if not max_age or not claims:
+        return None
+    # Only trusted for the session's own login, and only for a while
+    if str(claims['id']) != session.get('_user_id') or time.time() - claims['iat'] > max_age:
+        return None
+    return Identity(claims['id'], claims['is_admin'])
+
+
+def identity():
+    """Identity of the logged-in user (None if anonymous), from claims if fresh"""
+    if not has_request_context():
+        return None
+    found = _claims()
+    if found is not None:
+        return found
+    if not current_user.is_authenticated:
+        return None
+    if current_app.config.get('SESSION_CLAIMS_MAX_AGE', CLAIMS_MAX_AGE):
+        store_claims(current_user)
+    return Identity(current_user.id, bool(current_user.is_admin))
+
+
+def identity_required(f):
+    """login_required for read-only endpoints that only need identity()"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if identity() is None:
+            return login_manager.unauthorized()
+        return f(*args, **kwargs)
+    return decorated_function
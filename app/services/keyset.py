@@ -0,0 +1,81 @@
+"""Keyset pagination over a sortable column with the row id as tie-breaker.
+
+A page is fetched with WHERE (column, id) > (last column value, last id)
+instead of OFFSET, so page 1000 costs the same as page 1 as long as the
+column is indexed. Cursors are opaque URL-safe strings.
+"""
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+from app.extensions import db
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class CursorError(ValueError):
+    """Raised for a cursor that wasn't produced by encode_cursor()"""
+
+
+def encode_cursor(value, row_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(raw, column):
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(raw + '=' * (-len(raw) % 4)))
+        if value is not None and column.type.python_type is datetime:
+            value = datetime.fromisoformat(value)
+        return value, int(row_id)
+    except (ValueError, TypeError):
+        raise CursorError('Invalid page cursor')
+
+
+def _order(query, column, id_column, descending):
+    # NULLs sort first ascending and last descending (SQLite's own order,
+    # so the column's index still serves the ORDER BY)
+    if descending:
+        return query.order_by(column.desc().nulls_last(), id_column.desc())
+    return query.order_by(column.asc().nulls_first(), id_column.asc())
+
+
+def keyset_page(query, column, id_column, descending=False, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Return (records, next_cursor) for one page of `query` ordered by column, id"""
+    nulls = None
+    if cursor:
+        value, row_id = decode_cursor(cursor, column)
+        if value is None:
+            if descending:
+                query = query.filter(column.is_(None), id_column < row_id)
+            else:
+                query = query.filter(db.or_(db.and_(column.is_(None), id_column > row_id), column.isnot(None)))
+        elif descending:
+            # The NULLs that follow are fetched separately: an OR here
+            # would stop SQLite from seeking in the index
+            if column.expression.nullable:
+                nulls = query.filter(column.is_(None))
+            query = query.filter(tuple_(column, id_column) < (value, row_id))
+        else:
+            query = query.filter(tuple_(column, id_column) > (value, row_id))
+    records = _order(query, column, id_column, descending).limit(limit + 1).all()
+    if nulls is not None and len(records) <= limit:
+        records += _order(nulls, column, id_column, descending).limit(limit + 1 - len(records)).all()
+
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        last = records[-1]
+        next_cursor = encode_cursor(getattr(last, column.key), getattr(last, id_column.key))
+    return records, next_cursor
+
+
+def parse_limit(raw):
+    try:
+        limit = int(raw) if raw else DEFAULT_PAGE_SIZE
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
@@ -0,0 +1,432 @@
+"""Streaming bulk import of business locations, geocoded offline.
+
+The CSV is read in batches and every row coerced and validated; rows
+that fail are reported by line and skipped, the rest are inserted with
+one executemany per batch and committed every COMMIT_ROWS rows, or
+sooner once a transaction has run BULK_TRANSACTION_SECONDS.
+
+Rows without coordinates are geocoded without any network call, best
+match first:
+
+1. the geocode_cache table, keyed on the normalized street address
+   (filled by `flask load-geocodes` and by imported rows that came with
+   coordinates for an address it didn't know yet, so a re-import of the
+   same list is exact);
+2. the centroid of the row's ZIP from the demographics table.
+
+Rows that match neither are still imported, without coordinates, unless
+require_coordinates is set.
+
+Competitor density, admin counters and the locations data version are
+kept current in the same transactions. A large import doesn't replay its
+rows into the in-memory location indexes; they are rebuilt from the
+table on their next use instead.
+"""
+import csv
+import io
+import re
+import time
+from datetime import datetime
+import numpy as np
+from app.extensions import db
+from app.models import GeocodeCache, Location
+from app.services import admin_stats, changes, spatial_index
+from app.services.columns import demographic_columns
+from app.services.competitor_density import apply_location_changes, recompute
+from app.services.data_version import BULK_TRANSACTION_SECONDS, bump, invalidate
+from app.services.upsert import insert_for
+
+BATCH_SIZE = 5000
+COMMIT_ROWS = 100_000
+# Above this many rows, competitor density is recomputed per business type
+# and the in-memory indexes reload, instead of applying the rows one by one
+INCREMENTAL_ROWS = 5000
+
+# column -> maximum length (None for numbers)
+COLUMNS = {
+    'name': 100,
+    'address': 200,
+    'city': 100,
+    'state': 2,
+    'zip_code': 10,
+    'business_type': 50,
+    'latitude': None,
+    'longitude': None,
+}
+
+ALIASES = {
+    'business_name': 'name',
+    'business': 'name',
+    'street': 'address',
+    'street_address': 'address',
+    'address1': 'address',
+    'zip': 'zip_code',
+    'zipcode': 'zip_code',
+    'postal_code': 'zip_code',
+    'type': 'business_type',
+    'category': 'business_type',
+    'lat': 'latitude',
+    'lon': 'longitude',
+    'lng': 'longitude',
+    'long': 'longitude',
+}
+
+# Spellings folded together by address_key()
+ABBREVIATIONS = {
+    'street': 'st', 'avenue': 'ave', 'av': 'ave', 'road': 'rd', 'boulevard': 'blvd',
+    'drive': 'dr', 'lane': 'ln', 'court': 'ct', 'place': 'pl', 'terrace': 'ter',
+    'circle': 'cir', 'highway': 'hwy', 'parkway': 'pkwy', 'square': 'sq',
+    'suite': 'ste', 'apartment': 'apt', 'building': 'bldg', 'floor': 'fl',
+    'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+    'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se', 'southwest': 'sw',
+}
+
+# How many rejected rows to keep for the report
+MAX_ERRORS = 1000
+
+
+class ImportFileError(ValueError):
+    pass
+
+
+def address_key(address, city, state, zip_code):
+    """Normalized cache key of an address, or None without a street address"""
+    if not address:
+        return None
+    # 'N.W.' -> 'nw', "O'Hare" -> 'ohare', other punctuation separates words
+    words = re.sub(r'[^a-z0-9]+', ' ', re.sub(r"[.']", '', address.lower())).split()
+    street = ' '.join(ABBREVIATIONS.get(word, word) for word in words)
+    if not street:
+        return None
+    city = ' '.join(re.sub(r'[^a-z0-9]+', ' ', (city or '').lower()).split())
+    return f'{street}|{city}|{(state or "").lower()}|{(zip_code or "")[:5]}'
+
+
+def _coordinate(raw, name, limit):
+    raw = raw.strip() if raw else ''
+    if not raw:
+        return None
+    try:
+        value = float(raw)
+    except ValueError:
+        raise ValueError(f'{name} is not a number: {raw!r}')
+    if not -limit <= value <= limit:
+        raise ValueError(f'{name} out of range: {value}')
+    return value
+
+
+def coerce(record):
+    """Typed location dict for one CSV record; raises ValueError if invalid"""
+    row = {}
+    for name, length in COLUMNS.items():
+        if length is None:
+            continue
+        value = (record.get(name) or '').strip()
+        if len(value) > length:
+            raise ValueError(f'{name} is longer than {length} characters')
+        row[name] = value or None
+    if not row['name']:
+        raise ValueError('name is required')
+    if row['state']:
+        if len(row['state']) != 2 or not row['state'].isalpha():
+            raise ValueError(f'state must be a 2-letter code: {row["state"]!r}')
+        row['state'] = row['state'].upper()
+    zip_code = row['zip_code']
+    if zip_code:
+        # Spreadsheets drop the leading zero of New England ZIPs
+        if zip_code.isdigit() and len(zip_code) < 5:
+            zip_code = zip_code.zfill(5)
+        if not re.fullmatch(r'\d{5}(-\d{4})?', zip_code):
+            raise ValueError(f'malformed zip_code: {row["zip_code"]!r}')
+        row['zip_code'] = zip_code
+    row['latitude'] = _coordinate(record.get('latitude'), 'latitude', 90)
+    row['longitude'] = _coordinate(record.get('longitude'), 'longitude', 180)
+    if (row['latitude'] is None) != (row['longitude'] is None):
+        raise ValueError('latitude and longitude must be given together')
+    return row
+
+
+def read_batches(source, batch_size=BATCH_SIZE):
+    """Yield the recognised column names, then lists of (line, raw record).
+
+    source is a path or a binary file object (an upload's stream).
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            yield from read_batches(f, batch_size)
+        return
+    f = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+    first = f.readline()
+    delimiter = '\t' if '\t' in first else ','
+    # 'Business Name' and 'business-name' read as business_name
+    header = [re.sub(r'[\s\-]+', '_', h.strip().lower())
+              for h in next(csv.reader([first], delimiter=delimiter), [])]
+    wanted = {}
+    for i, name in enumerate(header):
+        wanted.setdefault(ALIASES.get(name, name), i)
+    wanted = [(i, name) for name, i in wanted.items() if name in COLUMNS]
+    yield [name for _, name in wanted]
+    batch = []
+    for line, record in enumerate(csv.reader(f, delimiter=delimiter), start=2):
+        if not any(record):
+            continue
+        batch.append((line, {name: record[i] if i < len(record) else None for i, name in wanted}))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def cached_coordinates(connection, keys):
+    """{address_key: (lat, lon)} from the geocode cache"""
+    table = GeocodeCache.__table__
+    found = {}
+    keys = list(keys)
+    for start in range(0, len(keys), 500):
+        rows = connection.execute(db.select(table.c.address_key, table.c.latitude, table.c.longitude)
+                                  .where(table.c.address_key.in_(keys[start:start + 500])))
+        found.update((key, (lat, lon)) for key, lat, lon in rows)
+    return found
+
+
+def _zip_centroids(columns, zip_codes):
+    """{zip_code: (lat, lon)} for the ZIPs with a known centroid"""
+    zip_codes = list(zip_codes)
+    idx = columns.lookup(zip_codes)
+    found = {}
+    for zip_code, i in zip(zip_codes, idx.tolist()):
+        if i >= 0 and np.isfinite(columns.latitude[i]) and np.isfinite(columns.longitude[i]):
+            found[zip_code] = (float(columns.latitude[i]), float(columns.longitude[i]))
+    return found
+
+
+def remember(connection, coordinates, source, now):
+    """Store {address_key: (lat, lon)} in the geocode cache.
+
+    A seeded file (source 'file') replaces existing entries. Coordinates
+    learned from an import only fill in addresses the cache doesn't know
+    yet, so an uploaded CSV can never move a seeded or earlier address.
+    """
+    if not coordinates:
+        return
+    table = GeocodeCache.__table__
+    insert = insert_for(connection, table)
+    if source == 'file':
+        statement = insert.on_conflict_do_update(
+            index_elements=['address_key'],
+            set_={'latitude': insert.excluded.latitude, 'longitude': insert.excluded.longitude,
+                  'source': insert.excluded.source, 'updated_at': insert.excluded.updated_at},
+        )
+    else:
+        statement = insert.on_conflict_do_nothing(index_elements=['address_key'])
+    connection.execute(statement, [{'address_key': key, 'latitude': lat, 'longitude': lon, 'source': source, 'updated_at': now}
+        for key, (lat, lon) in coordinates.items()])
+
+
+def geocode(connection, rows, geocoded, columns):
+    """Fill in missing coordinates in place, counting each row's source.
+
+    columns is the demographic column snapshot the ZIP centroids come
+    from. Returns the {address_key: (lat, lon)} the rows supplied.
+    """
+    keys = [address_key(row['address'], row['city'], row['state'], row['zip_code']) for row in rows]
+    learned, wanted = {}, set()
+    for row, key in zip(rows, keys):
+        if row['latitude'] is not None:
+            geocoded['file'] += 1
+            if key:
+                learned[key] = (row['latitude'], row['longitude'])
+        elif key:
+            wanted.add(key)
+
+    cached = cached_coordinates(connection, wanted) if wanted else {}
+    # Another row of the same batch may have had this address's coordinates
+    cached.update((key, coordinates) for key, coordinates in learned.items() if key in wanted)
+    missing = []
+    for row, key in zip(rows, keys):
+        if row['latitude'] is not None:
+            continue
+        if key in cached:
+            row['latitude'], row['longitude'] = cached[key]
+            geocoded['cache'] += 1
+        else:
+            missing.append(row)
+
+    centroids = _zip_centroids(columns, {row['zip_code'][:5] for row in missing if row['zip_code']})
+    for row in missing:
+        centroid = centroids.get(row['zip_code'][:5]) if row['zip_code'] else None
+        if centroid:
+            row['latitude'], row['longitude'] = centroid
+            geocoded['zip'] += 1
+        else:
+            geocoded['missing'] += 1
+    return learned
+
+
+def _counter_deltas(rows):
+    _, _, keys, _ = admin_stats.TRACKED['locations']
+    deltas = {}
+    for row in rows:
+        for key in keys(row):
+            deltas[key] = deltas.get(key, 0) + 1
+    return deltas
+
+
+def import_locations(source, user_id, batch_size=BATCH_SIZE, commit_rows=COMMIT_ROWS,
+                     require_coordinates=False, incremental_rows=INCREMENTAL_ROWS,
+                     learn_geocodes=True):
+    """Insert the locations of a CSV file (path or binary stream) owned by user_id.
+
+    With learn_geocodes the coordinates the file supplies are added to
+    the shared geocode cache (new addresses only); leave it off for
+    uploads from users who aren't trusted to geocode for everyone.
+
+    Returns stats: read / rejected / imported counts, how the coordinates
+    were found (file, cache, zip, missing), the first MAX_ERRORS rejected
+    rows as (line, reason), and the elapsed seconds.
+    """
+    started = time.perf_counter()
+    batches = read_batches(source, batch_size)
+    columns = next(batches)
+    if 'name' not in columns:
+        raise ImportFileError('The file has no name (or business_name) column')
+
+    stats = {'read': 0, 'rejected': 0, 'imported': 0, 'columns': columns, 'errors': [],
+             'geocoded': {'file': 0, 'cache': 0, 'zip': 0, 'missing': 0}}
+    # Read before the import's transaction: on SQLite it holds the write lock
+    demographics = demographic_columns()
+    table = Location.__table__
+    # Ids are only needed for rows that are replayed to the in-memory indexes,
+    # and RETURNING in parameter order makes SQLite insert row by row
+    insert_returning = table.insert().returning(table.c.id, sort_by_parameter_order=True)
+    # committed keeps rows for the indexes only while the import is small
+    pending, committed, business_types = [], [], set()
+    # (counter before, after) of the locations version, per transaction
+    versions = []
+    connection = db.engine.connect()
+    try:
+        transaction = connection.begin()
+        opened, now = time.perf_counter(), datetime.utcnow()
+        for batch in batches:
+            rows = []
+            for line, record in batch:
+                stats['read'] += 1
+                try:
+                    rows.append((line, coerce(record)))
+                except ValueError as exc:
+                    stats['rejected'] += 1
+                    if len(stats['errors']) < MAX_ERRORS:
+                        stats['errors'].append((line, str(exc)))
+            if not rows:
+                continue
+            learned = geocode(connection, [row for _, row in rows], stats['geocoded'], demographics)
+            if require_coordinates:
+                located = []
+                for line, row in rows:
+                    if row['latitude'] is not None:
+                        located.append((line, row))
+                        continue
+                    stats['rejected'] += 1
+                    stats['geocoded']['missing'] -= 1
+                    if len(stats['errors']) < MAX_ERRORS:
+                        stats['errors'].append((line, 'no coordinates: address not in the '
+                                                      'geocode cache and ZIP unknown'))
+                rows = located
+            if learn_geocodes:
+                remember(connection, learned, 'import', now)
+            rows = [dict(row, user_id=user_id, created_at=now, updated_at=now) for _, row in rows]
+            if not rows:
+                continue
+            if stats['imported'] + len(pending) + len(rows) <= incremental_rows:
+                for row, location_id in zip(rows, connection.execute(insert_returning, rows).scalars()):
+                    row['id'] = location_id
+            else:
+                connection.execute(table.insert(), rows)
+            pending.extend(rows)
+            if len(pending) >= commit_rows or time.perf_counter() - opened >= BULK_TRANSACTION_SECONDS:
+                _commit(connection, transaction, pending, stats, committed, business_types,
+                        incremental_rows, versions)
+                pending = []
+                transaction = connection.begin()
+                opened, now = time.perf_counter(), datetime.utcnow()
+        _commit(connection, transaction, pending, stats, committed, business_types, incremental_rows,
+                versions)
+    finally:
+        connection.close()
+        # Even if a later batch failed, earlier commits are in the table
+        if stats['imported']:
+            invalidate('locations')
+            if stats['imported'] <= incremental_rows:
+                changes.notify('locations', added=committed, versions=_span(versions))
+            else:
+                # Too many rows to replay: rebuild the in-memory index instead
+                spatial_index.reset()
+                # One grid pass per type instead of a distance scan per row
+                for business_type in sorted(business_types - {None}):
+                    recompute(business_type)
+
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+def _commit(connection, transaction, rows, stats, committed, business_types, incremental_rows,
+            versions):
+    """Counters and versions for one transaction's rows, then commit"""
+    if rows:
+        admin_stats.apply(connection, _counter_deltas(rows))
+        # Past incremental_rows the import ends with a recompute instead
+        if stats['imported'] + len(rows) <= incremental_rows:
+            apply_location_changes(connection, added=rows)
+        after = bump(connection, 'locations')['locations']
+        versions.append((after[0] - 1, after))
+    transaction.commit()
+    stats['imported'] += len(rows)
+    business_types.update(row['business_type'] for row in rows)
+    if stats['imported'] <= incremental_rows:
+        committed.extend(rows)
+
+
+def _span(versions):
+    """The versions of consecutive transactions as one write, or None if others wrote between"""
+    for (_, previous), (before, _) in zip(versions, versions[1:]):
+        if before != previous[0]:
+            return None
+    return (versions[0][0], versions[-1][1]) if versions else None
+
+
+def load_geocodes(source, batch_size=BATCH_SIZE):
+    """Seed the geocode cache from a CSV of addresses with coordinates.
+
+    Takes the same columns as an import (address, city, state, zip_code,
+    latitude, longitude); returns read / rejected / cached counts.
+    """
+    started = time.perf_counter()
+    batches = read_batches(source, batch_size)
+    columns = next(batches)
+    if not {'address', 'latitude', 'longitude'} <= set(columns):
+        raise ImportFileError('The file needs address, latitude and longitude columns')
+
+    stats = {'read': 0, 'rejected': 0, 'cached': 0, 'errors': []}
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        for batch in batches:
+            coordinates = {}
+            for line, record in batch:
+                stats['read'] += 1
+                try:
+                    record = dict(record, name=record.get('name') or '-')
+                    row = coerce(record)
+                    key = address_key(row['address'], row['city'], row['state'], row['zip_code'])
+                    if key is None or row['latitude'] is None:
+                        raise ValueError('address, latitude and longitude are required')
+                except ValueError as exc:
+                    stats['rejected'] += 1
+                    if len(stats['errors']) < MAX_ERRORS:
+                        stats['errors'].append((line, str(exc)))
+                    continue
+                coordinates[key] = (row['latitude'], row['longitude'])
+            remember(connection, coordinates, 'file', now)
+            stats['cached'] += len(coordinates)
+    stats['seconds'] = time.perf_counter() - started
+    return stats
@@ -0,0 +1,150 @@
+"""Password hashing on a bounded process pool.
+
+PBKDF2 at a realistic cost takes a few hundred milliseconds of pure CPU.
+Done inline, a burst of logins occupies every worker and the map API
+queues behind it. Instead, hashes are computed in a small per-worker
+process pool (the request thread just waits on the result, without the
+GIL) with at most PASSWORD_HASH_QUEUE hashes in flight; past that,
+callers get HashingBusy, which the routes turn into a 429.
+
+PASSWORD_HASH_METHOD sets the cost. Hashes made with other parameters
+still verify, and needs_rehash() tells login to replace them.
+"""
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+from app.metrics import Counter, Gauge, register
+
+HASH_METHOD = 'pbkdf2:sha256:600000'
+# Waiting longer than this for a hash counts as overloaded
+HASH_TIMEOUT = 10.0
+
+HASHES = register(Counter('password_hashes_total', 'Password hash operations by result.',
+                          ('operation', 'result')))
+
+
+class HashingBusy(Exception):
+    """All hashing slots are taken; try again shortly"""
+
+
+class HashPool:
+    """A process pool with a cap on queued plus running hashes"""
+
+    def __init__(self, workers, queue):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(queue)
+        self.inflight = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def run(self, operation, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            HASHES.inc(operation, 'rejected')
+            raise HashingBusy()
+        with self._lock:
+            self.inflight += 1
+            if self._executor is None:
+                # Created on first use, i.e. in the gunicorn worker, not the master
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            executor = self._executor
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        # The slot is held until the hash is done, not just while the caller waits
+        future.add_done_callback(self._release)
+        try:
+            result = future.result(timeout=HASH_TIMEOUT)
+        except FutureTimeout:
+            # Dropped if it hasn't started; a running hash keeps its slot until it ends
+            future.cancel()
+            HASHES.inc(operation, 'timeout')
+            raise HashingBusy()
+        HASHES.inc(operation, 'ok')
+        return result
+
+    def _release(self, future=None):
+        with self._lock:
+            self.inflight -= 1
+        self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool():
+    """The app's HashPool, or None to hash inline"""
+    if not has_app_context():
+        return None
+    app = current_app._get_current_object()
+    workers = app.config.get('PASSWORD_HASH_WORKERS', 0)
+    if not workers:
+        return None
+    with _pools_lock:
+        # Keyed by pid as well: a forked child must not reuse the parent's pool
+        key = (id(app), os.getpid())
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = HashPool(workers, app.config.get('PASSWORD_HASH_QUEUE', workers * 4))
+            atexit.register(pool.shutdown)
+        return pool
+
+
+def _inflight():
+    return sum(pool.inflight for (_, pid), pool in list(_pools.items()) if pid == os.getpid())
+
+
+register(Gauge('password_hash_inflight', 'Password hashes queued or running.', _inflight))
+
+
+def _method():
+    if has_app_context():
+        return current_app.config.get('PASSWORD_HASH_METHOD', HASH_METHOD)
+    return HASH_METHOD
+
+
+def hash_password(password):
+    """Hash with the configured method (raises HashingBusy when saturated)"""
+    pool = _pool()
+    if pool is None:
+        return generate_password_hash(password, method=_method())
+    return pool.run('hash', generate_password_hash, password, _method())
+
+
+def verify_password(pwhash, password):
+    """Check a password against a stored hash (raises HashingBusy when saturated)"""
+    if not pwhash:
+        return False
+    pool = _pool()
+    if pool is None:
+        return check_password_hash(pwhash, password)
+    return pool.run('verify', check_password_hash, pwhash, password)
+
+
+_prefixes = {}
+
+
+def _stored_prefix(method):
+    """The method as werkzeug writes it into hashes ('scrypt' -> 'scrypt:32768:8:1')"""
+    prefix = _prefixes.get(method)
+    if prefix is None:
+        # Once per method and process: the only way to get werkzeug's defaults
+        prefix = _prefixes[method] = generate_password_hash('', method=method).split('$', 1)[0]
+    return prefix
+
+
+def needs_rehash(pwhash):
+    """Whether a hash was made with other parameters than the configured ones"""
+    return pwhash.split('$', 1)[0] != _stored_prefix(_method())
@@ -0,0 +1,130 @@
+"""Weighted opportunity scores for every ZIP in one vectorised pass.
+
+Each feature is scaled to 0..1 across all ZIPs (log-scaled for the
+skewed counts and values, clipped to the 2nd-98th percentile so a few
+outliers don't flatten everyone else). The score is the weighted mean of
+the scaled features, 0-100. Missing values count as 0.
+"""
+import numpy as np
+from app.services.columns import demographic_columns
+from app.services.competitor_density import DEFAULT_RADIUS, density_column
+from app.services.demographic_query import FilterError
+
+# feature -> (column, log-scale?)
+FEATURES = {
+    'income': ('median_income', False),
+    'population': ('population', True),
+    'households': ('households', True),
+    'median_age': ('median_age', False),
+    'home_value': ('median_home_value', True),
+}
+# Competitors of the business_type within the radius band of the ZIP
+# centroid (only with a business_type)
+COMPETITION = 'competition'
+
+DEFAULT_WEIGHTS = {
+    'income': 1.0,
+    'population': 1.0,
+    'households': 0.5,
+    'median_age': 0.0,
+    'home_value': 0.5,
+    COMPETITION: -1.0,
+}
+
+DEFAULT_LIMIT = 25
+MAX_LIMIT = 1000
+
+
+def parse_weights(raw):
+    """Parse 'income:2,population:1,competition:-1'.
+
+    Given weights replace the defaults; features not listed get 0.
+    """
+    if not raw:
+        return dict(DEFAULT_WEIGHTS)
+    weights = {name: 0.0 for name in DEFAULT_WEIGHTS}
+    for part in raw.split(','):
+        name, _, value = part.partition(':')
+        name = name.strip()
+        if name not in weights:
+            raise FilterError(f'Unknown weight: {name}')
+        try:
+            weights[name] = float(value)
+        except ValueError:
+            raise FilterError(f'Weight for {name} must be a number')
+    if not any(weights.values()):
+        raise FilterError('At least one weight must be non-zero')
+    return weights
+
+
+def parse_top(raw):
+    if not raw:
+        return DEFAULT_LIMIT
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise FilterError('limit must be an integer')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def scale(values, log=False):
+    """Scale to 0..1 by the 2nd-98th percentile; NaN becomes 0"""
+    values = np.log1p(np.clip(values, 0, None)) if log else values
+    finite = values[np.isfinite(values)]
+    if not len(finite):
+        return np.zeros(len(values))
+    low, high = np.percentile(finite, [2, 98])
+    if high <= low:
+        high = low + 1.0
+    return np.nan_to_num(np.clip((values - low) / (high - low), 0.0, 1.0), nan=0.0)
+
+
+def score_zips(weights, business_type=None, state=None, limit=DEFAULT_LIMIT,
+               radius=DEFAULT_RADIUS):
+    """Top ZIPs by weighted opportunity score"""
+    columns = demographic_columns()
+    if not len(columns):
+        return []
+
+    components = {}
+    for name, (column, log) in FEATURES.items():
+        if weights.get(name):
+            components[name] = columns.derive(
+                ('scaled', column, log), lambda: scale(getattr(columns, column), log))
+
+    competitors = None
+    if business_type:
+        competitors = density_column(columns, business_type, radius)
+        if weights.get(COMPETITION):
+            components[COMPETITION] = scale(competitors, log=True)
+
+    total_weight = sum(abs(weights[name]) for name in components)
+    score = np.zeros(len(columns))
+    for name, values in components.items():
+        # A negative weight rewards low values (e.g. few competitors)
+        weight = weights[name]
+        score += weight * values if weight > 0 else -weight * (1.0 - values)
+    if total_weight:
+        score = score / total_weight * 100.0
+
+    candidates = np.arange(len(columns))
+    if state:
+        candidates = candidates[columns.state == state.upper()]
+    if len(candidates) > limit:
+        top = np.argpartition(-score[candidates], limit - 1)[:limit]
+        candidates = candidates[top]
+    candidates = candidates[np.argsort(-score[candidates], kind='stable')]
+
+    results = []
+    for i in candidates.tolist():
+        row = {
+            'zip_code': columns.text('zip_code', i),
+            'city': columns.text('city', i),
+            'state': columns.text('state', i),
+            'score': round(float(score[i]), 2),
+            'components': {name: round(float(values[i]), 3) for name, values in components.items()},
+        }
+        if competitors is not None:
+            row['competitors'] = int(competitors[i])
+        results.append(row)
+    return results
@@ -0,0 +1,317 @@
+"""In-memory grid index over Location coordinates.
+
+Points are bucketed into fixed CELL_DEGREES cells and stored in NumPy
+arrays sorted by cell key, so a bounding box becomes one searchsorted
+per grid row plus a vectorised exact test. Inserts and deletes land in a
+small overlay (recent rows plus a set of hidden ids) that is merged into
+the sorted arrays once it grows past COMPACT_THRESHOLD.
+
+Each process builds the index lazily from the database and follows its
+own commits through app.services.changes. Writes made by other worker
+processes are picked up by comparing the locations data version: the
+index records the (counter, updated_at) it is current for, and moves to
+the counter of its own commit only if that commit was the one write
+since. Otherwise another worker or a bulk import wrote in between, and
+the index is dropped and rebuilt.
+"""
+import threading
+import numpy as np
+from app.extensions import db
+from app.metrics import cache_event
+from app.models import Location
+from app.services import changes
+from app.services.data_version import table_versions
+from app.services.demographic_query import FilterError, parse_bbox
+from app.services.geo import haversine_miles, radius_bbox
+
+CELL_DEGREES = 0.05
+GRID_COLUMNS = int(round(360 / CELL_DEGREES))
+GRID_ROWS = int(round(180 / CELL_DEGREES))
+COMPACT_THRESHOLD = 5000
+# k-nearest searches widen until they find k points or reach this radius
+MAX_SEARCH_MILES = 3000.0
+DEFAULT_K = 10
+MAX_RESULTS = 5000
+
+
+def _cells(lat, lon):
+    row = np.clip(np.floor((np.asarray(lat) + 90.0) / CELL_DEGREES), 0, GRID_ROWS - 1)
+    col = np.clip(np.floor((np.asarray(lon) + 180.0) / CELL_DEGREES), 0, GRID_COLUMNS - 1)
+    return row.astype(np.int64), col.astype(np.int64)
+
+
+class LocationIndex:
+    def __init__(self, rows=(), version=None):
+        self.version = version
+        self._type_codes = {}
+        self._added = {}
+        self._removed = set()
+        self._overlay = None
+        self._build(list(rows))
+
+    def _type_code(self, business_type):
+        # -1 for untyped locations
+        if business_type is None:
+            return -1
+        return self._type_codes.setdefault(business_type, len(self._type_codes))
+
+    def _build(self, rows):
+        """rows: (id, lat, lon, user_id, business_type) tuples"""
+        ids = np.array([r[0] for r in rows], dtype=np.int64)
+        lat = np.array([r[1] for r in rows], dtype=np.float64)
+        lon = np.array([r[2] for r in rows], dtype=np.float64)
+        users = np.array([r[3] for r in rows], dtype=np.int64)
+        types = np.array([self._type_code(r[4]) for r in rows], dtype=np.int32)
+        row, col = _cells(lat, lon)
+        keys = row * GRID_COLUMNS + col
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.ids, self.lat, self.lon = ids[order], lat[order], lon[order]
+        self.users, self.types = users[order], types[order]
+        # Arrays computed from these (e.g. the cluster ordering); dropped on compact
+        self.derived = {}
+
+    def derive(self, key, compute):
+        """Memoise something computed from the sorted arrays"""
+        if key not in self.derived:
+            self.derived[key] = compute()
+        return self.derived[key]
+
+    def type_names(self):
+        """Business type of each type code"""
+        names = [None] * len(self._type_codes)
+        for name, code in self._type_codes.items():
+            names[code] = name
+        return names
+
+    # ----- maintenance -----
+
+    def add(self, location_id, lat, lon, user_id, business_type):
+        self._removed.add(location_id)
+        self._added[location_id] = (lat, lon, user_id, self._type_code(business_type))
+        self._overlay = None
+        if len(self._added) + len(self._removed) > COMPACT_THRESHOLD:
+            self.compact()
+
+    def remove(self, location_id):
+        self._added.pop(location_id, None)
+        self._removed.add(location_id)
+        self._overlay = None
+
+    def compact(self):
+        """Merge the overlay into the sorted arrays"""
+        names = {code: name for name, code in self._type_codes.items()}
+        keep = ~np.isin(self.ids, np.fromiter(self._removed, dtype=np.int64)) \
+            if self._removed else np.ones(len(self.ids), dtype=bool)
+        rows = list(zip(self.ids[keep].tolist(), self.lat[keep].tolist(), self.lon[keep].tolist(),
+                        self.users[keep].tolist(), [names.get(t) for t in self.types[keep].tolist()]))
+        rows.extend((i, lat, lon, user, names.get(t)) for i, (lat, lon, user, t) in self._added.items())
+        self._added, self._removed, self._overlay = {}, set(), None
+        self._build(rows)
+
+    # ----- queries -----
+
+    def hidden_ids(self):
+        """Ids whose rows in the sorted arrays are deleted or superseded"""
+        return np.fromiter(self._removed, dtype=np.int64)
+
+    def added_arrays(self):
+        """(ids, lat, lon, users, types) of rows added since the last compact"""
+        if self._overlay is None:
+            items = list(self._added.items())
+            self._overlay = (
+                np.array([i for i, _ in items], dtype=np.int64),
+                np.array([v[0] for _, v in items], dtype=np.float64),
+                np.array([v[1] for _, v in items], dtype=np.float64),
+                np.array([v[2] for _, v in items], dtype=np.int64),
+                np.array([v[3] for _, v in items], dtype=np.int32),
+            )
+        return self._overlay
+
+    def _gather(self, bbox, user_id=None, business_type=None):
+        """(ids, lat, lon) of visible points inside a bbox"""
+        min_lon, min_lat, max_lon, max_lat = bbox
+        row0, col0 = _cells(min_lat, min_lon)
+        row1, col1 = _cells(max_lat, max_lon)
+        rows = np.arange(row0, row1 + 1, dtype=np.int64)
+        lo = np.searchsorted(self.keys, rows * GRID_COLUMNS + col0, side='left')
+        hi = np.searchsorted(self.keys, rows * GRID_COLUMNS + col1, side='right')
+        lengths = hi - lo
+        # Concatenate the [lo, hi) runs without a Python loop
+        idx = np.arange(lengths.sum()) + np.repeat(lo - (np.cumsum(lengths) - lengths), lengths)
+
+        parts = [(self.ids[idx], self.lat[idx], self.lon[idx], self.users[idx], self.types[idx])]
+        if self._added:
+            parts.append(self.added_arrays())
+        ids, lat, lon, users, types = (np.concatenate(p) for p in zip(*parts))
+
+        mask = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+        if user_id is not None:
+            mask &= users == user_id
+        if business_type is not None:
+            code = self._type_codes.get(business_type)
+            if code is None:
+                mask[:] = False
+            else:
+                mask &= types == code
+        if self._removed:
+            base_count = len(idx)
+            hidden = np.isin(ids[:base_count], self.hidden_ids())
+            mask[:base_count] &= ~hidden
+        return ids[mask], lat[mask], lon[mask]
+
+    def within(self, bbox, user_id=None, business_type=None, limit=MAX_RESULTS):
+        """Ids of points inside a bbox (at most limit, in id order)"""
+        ids, _, _ = self._gather(bbox, user_id, business_type)
+        return np.sort(ids)[:limit]
+
+    def nearest(self, lat, lon, k=None, radius=None, user_id=None, business_type=None):
+        """(ids, distances in miles) nearest first.
+
+        With a radius only points inside it are considered; with k at most k
+        are returned. Without a radius the search ring doubles from one cell
+        until k points are found.
+        """
+        if radius is not None:
+            search = radius
+        else:
+            k = k or DEFAULT_K
+            search = CELL_DEGREES * 69.0
+        while True:
+            ids, plat, plon = self._gather(radius_bbox(lat, lon, search), user_id, business_type)
+            dist = haversine_miles(lat, lon, plat, plon)
+            inside = dist <= search
+            if radius is not None or inside.sum() >= k or search >= MAX_SEARCH_MILES:
+                break
+            search = min(search * 2, MAX_SEARCH_MILES)
+
+        ids, dist = ids[inside], dist[inside]
+        if k is not None and len(ids) > k:
+            top = np.argpartition(dist, k - 1)[:k]
+            ids, dist = ids[top], dist[top]
+        order = np.argsort(dist, kind='stable')
+        return ids[order], dist[order]
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def _load_rows():
+    return db.session.query(Location.id, Location.latitude, Location.longitude,
+                            Location.user_id, Location.business_type)\
+        .filter(Location.latitude.isnot(None), Location.longitude.isnot(None))\
+        .all()
+
+
+class _LockedIndex:
+    """Context manager yielding the current index with the lock held"""
+
+    def __enter__(self):
+        global _index
+        version = table_versions('locations')['locations']
+        _lock.acquire()
+        try:
+            stale = _index is None or _index.version != version
+            cache_event('location_index', not stale)
+            if stale:
+                _index = LocationIndex(_load_rows(), version)
+        except Exception:
+            _lock.release()
+            raise
+        return _index
+
+    def __exit__(self, *exc):
+        _lock.release()
+
+
+def location_index():
+    """`with location_index() as index:` - the up-to-date process-wide index"""
+    return _LockedIndex()
+
+
+def reset():
+    """Drop the index so the next query rebuilds it from the database"""
+    global _index
+    with _lock:
+        _index = None
+
+
+def _apply_changes(added, removed, versions):
+    global _index
+    with _lock:
+        if _index is None:
+            return
+        if versions is None or _index.version[0] != versions[0]:
+            # Someone else wrote since the index was current: the rows alone won't do
+            _index = None
+            return
+        for row in removed:
+            _index.remove(row['id'])
+        for row in added:
+            if row.get('latitude') is not None and row.get('longitude') is not None:
+                _index.add(row['id'], row['latitude'], row['longitude'],
+                           row['user_id'], row.get('business_type'))
+        _index.version = versions[1]
+
+
+changes.subscribe('locations', _apply_changes)
+
+
+def parse_point(raw):
+    """Parse 'lat,lon'"""
+    try:
+        lat, lon = (float(v) for v in raw.split(','))
+    except ValueError:
+        raise FilterError('near must be lat,lon')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise FilterError('near is out of range')
+    return lat, lon
+
+
+def _positive(args, name, cast):
+    raw = args.get(name)
+    if not raw:
+        return None
+    try:
+        value = cast(raw)
+    except ValueError:
+        raise FilterError(f'{name} must be a number')
+    if value <= 0:
+        raise FilterError(f'{name} must be positive')
+    return value
+
+
+def parse_spatial_args(args):
+    """Spatial parameters of /api/locations, or None when there are none"""
+    if not args.get('bbox') and not args.get('near'):
+        return None
+    near = parse_point(args['near']) if args.get('near') else None
+    k = _positive(args, 'k', int)
+    radius = _positive(args, 'radius', float)
+    limit = _positive(args, 'limit', int)
+    return {
+        'bbox': parse_bbox(args.get('bbox')),
+        'near': near,
+        'k': min(k, MAX_RESULTS) if k else None,
+        'radius': radius,
+        'limit': min(limit or MAX_RESULTS, MAX_RESULTS),
+        'business_type': args.get('business_type') or None,
+    }
+
+
+def find_locations(spatial, user_id=None):
+    """Run a parsed spatial query; returns (ids, distances or None)"""
+    with location_index() as index:
+        if spatial['near']:
+            lat, lon = spatial['near']
+            k = spatial['k'] or (None if spatial['radius'] else DEFAULT_K)
+            ids, dist = index.nearest(lat, lon, k=k, radius=spatial['radius'],
+                                      user_id=user_id, business_type=spatial['business_type'])
+            if spatial['bbox']:
+                keep = np.isin(ids, index.within(spatial['bbox'], user_id,
+                                                 spatial['business_type'], limit=None))
+                ids, dist = ids[keep], dist[keep]
+            return ids[:spatial['limit']].tolist(), dist[:spatial['limit']].tolist()
+        ids = index.within(spatial['bbox'], user_id, spatial['business_type'], spatial['limit'])
+        return ids.tolist(), None
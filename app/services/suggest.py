@@ -0,0 +1,220 @@
+"""Typeahead suggestions for the map's ZIP / city search box.
+
+Every ZIP and every city (all ZIPs sharing a city and state) is an
+entry, numbered in descending order of population so that ranking a set
+of matches is just taking its smallest entry numbers. A city is
+population-weighted to one centroid and keyed under both 'austin' and
+'austin tx'; a state is only suggested when the query is its exact code.
+
+Prefix matches come from one searchsorted range over the sorted keys.
+When they don't fill the list, queries of three or more characters also
+match inside city names through a trigram index: the posting lists
+(entry numbers, ascending) of the query's trigrams are intersected and
+the survivors checked in rank order until the list is full.
+
+The index is derived from the demographic column snapshot, so it is
+rebuilt with the snapshot whenever the demographics data version changes
+(an import, an edit).
+"""
+import re
+from collections import defaultdict
+import numpy as np
+from app.services.columns import demographic_columns
+from app.services.demographic_query import FilterError
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+MAX_QUERY = 100
+TRIGRAM = 3
+
+_SEPARATORS = re.compile(r'[^0-9a-z]+')
+
+
+def normalize(text):
+    """Lowercase words separated by single spaces: 'St. Louis, MO' -> 'st louis mo'"""
+    return _SEPARATORS.sub(' ', (text or '').lower()).strip()
+
+
+def parse_suggest_args(args):
+    """q and limit of /api/search/suggest"""
+    query = normalize(args.get('q', '')[:MAX_QUERY])
+    try:
+        limit = int(args.get('limit') or DEFAULT_LIMIT)
+    except ValueError:
+        raise FilterError('limit must be an integer')
+    return query, max(1, min(limit, MAX_LIMIT))
+
+
+def _trigrams(key):
+    return {key[i:i + TRIGRAM] for i in range(len(key) - TRIGRAM + 1)}
+
+
+def _weighted(values, weights, groups, n):
+    known = np.isfinite(values) & np.isfinite(weights) & (weights > 0)
+    total = np.bincount(groups, np.where(known, weights, 0.0), minlength=n)
+    sums = np.bincount(groups, np.where(known, weights * values, 0.0), minlength=n)
+    # Cities without populated ZIPs fall back to a plain mean of their centroids
+    finite = np.isfinite(values)
+    count = np.bincount(groups, finite, minlength=n)
+    plain = np.bincount(groups, np.where(finite, values, 0.0), minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, sums / total, np.where(count > 0, plain / count, np.nan))
+
+
+def _coordinate(value):
+    return float(value) if np.isfinite(value) else None
+
+
+class SuggestIndex:
+    def __init__(self, columns):
+        n = len(columns)
+        population = np.nan_to_num(np.asarray(columns.population, dtype=np.float64))
+        lat = np.asarray(columns.latitude, dtype=np.float64)
+        lon = np.asarray(columns.longitude, dtype=np.float64)
+
+        # Cities: one group per distinct (city, state)
+        cities = np.char.add(np.char.add(np.asarray(columns.city), '|'), np.asarray(columns.state))
+        named = np.asarray(columns.city) != ''
+        city_keys, groups = np.unique(cities[named], return_inverse=True)
+        m = len(city_keys)
+        city_population = np.bincount(groups, population[named], minlength=m)
+        city_lat = _weighted(lat[named], population[named], groups, m)
+        city_lon = _weighted(lon[named], population[named], groups, m)
+        city_zips = np.bincount(groups, minlength=m)
+        city_rows = np.flatnonzero(named)
+        # A representative row per city for its display name
+        first_row = np.full(m, -1, dtype=np.int64)
+        first_row[groups[::-1]] = city_rows[::-1]
+
+        # Entries: ZIPs (kind 0) then cities (kind 1), renumbered by population
+        kind = np.concatenate([np.zeros(n, dtype=np.int8), np.ones(m, dtype=np.int8)])
+        row = np.concatenate([np.arange(n), first_row])
+        rank_population = np.concatenate([population, city_population])
+        order = np.lexsort((kind, -rank_population))
+        self.kind, self.row = kind[order], row[order]
+        self.population = rank_population[order]
+        self.latitude = np.concatenate([lat, city_lat])[order]
+        self.longitude = np.concatenate([lon, city_lon])[order]
+        self.zips = np.concatenate([np.ones(n, dtype=np.int64), city_zips])[order]
+        self.columns = columns
+        entry_of = np.empty(len(order), dtype=np.int64)
+        entry_of[order] = np.arange(len(order))
+
+        # Prefix keys: every ZIP code, every city alone and with its state
+        zip_text = [str(z) for z in columns.zip_code.tolist()]
+        keys, entries = [], []
+        for i, zip_code in enumerate(zip_text):
+            if zip_code:
+                keys.append(zip_code)
+                entries.append(entry_of[i])
+        self.city_names = []
+        for g, key in enumerate(city_keys.tolist()):
+            city, state = key.rsplit('|', 1)
+            name = normalize(city)
+            full = normalize(f'{city} {state}')
+            self.city_names.append(full)
+            keys.append(name)
+            entries.append(entry_of[n + g])
+            if full != name:
+                keys.append(full)
+                entries.append(entry_of[n + g])
+        keys = np.array(keys, dtype=str) if keys else np.array([], dtype='U1')
+        entries = np.array(entries, dtype=np.int64)
+        key_order = np.argsort(keys, kind='stable')
+        self.keys, self.key_entries = keys[key_order], entries[key_order]
+
+        # Trigrams of 'city state' names -> entry numbers, ascending
+        postings = defaultdict(list)
+        self.city_name_of = {}
+        for g, full in enumerate(self.city_names):
+            entry = int(entry_of[n + g])
+            self.city_name_of[entry] = full
+            for gram in _trigrams(full):
+                postings[gram].append(entry)
+        self.postings = {gram: np.sort(np.array(ids, dtype=np.int64)) for gram, ids in postings.items()}
+
+        # States by exact code
+        states = np.asarray(columns.state)
+        coded = states != ''
+        codes, state_groups = np.unique(states[coded], return_inverse=True)
+        k = len(codes)
+        state_population = np.bincount(state_groups, population[coded], minlength=k)
+        state_lat = _weighted(lat[coded], population[coded], state_groups, k)
+        state_lon = _weighted(lon[coded], population[coded], state_groups, k)
+        state_zips = np.bincount(state_groups, minlength=k)
+        self.states = {code.lower(): (code, int(state_population[s]), int(state_zips[s]),
+                                      state_lat[s], state_lon[s])
+                       for s, code in enumerate(codes.tolist())}
+
+    def _prefix(self, query, limit):
+        lo = np.searchsorted(self.keys, query, side='left')
+        hi = np.searchsorted(self.keys, query[:-1] + chr(ord(query[-1]) + 1), side='left')
+        entries = self.key_entries[lo:hi]
+        # A city has at most two keys, so the 2 * limit best keys hold limit cities
+        if len(entries) > 2 * limit:
+            entries = np.partition(entries, 2 * limit)[:2 * limit]
+        return np.unique(entries)[:limit].tolist()
+
+    def _infix(self, query, limit, seen):
+        grams = sorted((self.postings.get(gram) for gram in _trigrams(query)),
+                       key=lambda ids: -1 if ids is None else len(ids))
+        if not grams or grams[0] is None:
+            return []
+        candidates = grams[0]
+        for ids in grams[1:]:
+            candidates = np.intersect1d(candidates, ids, assume_unique=True)
+            if not len(candidates):
+                return []
+        found = []
+        for entry in candidates.tolist():
+            if entry not in seen and query in self.city_name_of[entry]:
+                found.append(entry)
+                if len(found) == limit:
+                    break
+        return found
+
+    def _entry(self, entry):
+        i = int(self.row[entry])
+        city, state = self.columns.text('city', i), self.columns.text('state', i)
+        suggestion = {
+            'type': 'zip' if self.kind[entry] == 0 else 'city',
+            'city': city,
+            'state': state,
+            'population': int(self.population[entry]),
+            'latitude': _coordinate(self.latitude[entry]),
+            'longitude': _coordinate(self.longitude[entry]),
+        }
+        place = ', '.join(part for part in (city, state) if part)
+        if suggestion['type'] == 'zip':
+            suggestion['zip_code'] = self.columns.text('zip_code', i)
+            suggestion['label'] = f'{suggestion["zip_code"]} {place}'.strip()
+        else:
+            suggestion['zips'] = int(self.zips[entry])
+            suggestion['label'] = place
+        return suggestion
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        """Suggestions for a normalized query, most populous first"""
+        if not query or not len(self.keys):
+            return []
+        results = []
+        state = self.states.get(query)
+        if state:
+            code, population, zips, lat, lon = state
+            results.append({'type': 'state', 'label': code, 'state': code, 'population': population,
+                            'zips': zips, 'latitude': _coordinate(lat), 'longitude': _coordinate(lon)})
+        entries = self._prefix(query, limit)
+        if len(entries) < limit and len(query) >= TRIGRAM:
+            entries += self._infix(query, limit - len(entries), set(entries))
+        results.extend(self._entry(entry) for entry in entries)
+        return results[:limit]
+
+
+def suggest_index():
+    """The index for the current demographics version"""
+    columns = demographic_columns()
+    return columns.derive('suggest_index', lambda: SuggestIndex(columns))
+
+
+def suggest(query, limit=DEFAULT_LIMIT):
+    return suggest_index().suggest(query, limit)
@@ -0,0 +1,98 @@
+"""Size-bounded on-disk LRU cache for rendered tiles.
+
+Entries are files named by the SHA-1 of their key; access time is tracked
+through the file mtime so every gunicorn worker shares the same cache and
+LRU order. When the total size passes the limit the least recently used
+files are removed until it is back under 90% of the limit.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from app.metrics import cache_event
+
+
+class TileCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            cache_event('tiles', False)
+            return None
+        cache_event('tiles', True)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def set(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        target = self.max_bytes * 0.9
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self._size = size
+
+    def stats(self):
+        with self._lock:
+            self._size = self._scan_size()
+            return {'bytes': self._size, 'max_bytes': self.max_bytes}
+
+
+_caches = {}
+
+
+def get_tile_cache(app):
+    """Per-app TileCache configured from TILE_CACHE_DIR / TILE_CACHE_MAX_BYTES"""
+    directory = app.config['TILE_CACHE_DIR']
+    if directory not in _caches:
+        _caches[directory] = TileCache(directory, app.config['TILE_CACHE_MAX_BYTES'])
+    return _caches[directory]
@@ -0,0 +1,183 @@
+"""Demographic totals of the trade area around arbitrary points.
+
+A trade area is every ZIP whose centroid lies within a radius of a site.
+Population and households are summed; median income and home value are
+averaged weighted by households, median age weighted by population.
+With weighting='linear' a ZIP counts for 1 - distance/radius instead of
+in full, so the edge of the ring matters less than its middle.
+
+ZIP centroids come from the demographic column snapshot, bucketed into a
+grid whose cells are at least as wide as the largest radius asked for
+(cached per power-of-two cell size). Any number of sites and rings is
+one pass: the (site, ZIP) pairs of the 3x3 cells around every site are
+gathered with searchsorted, their distances computed in one vectorised
+call, and each ring's totals summed per site with bincount.
+"""
+import math
+import numpy as np
+from app.services.columns import demographic_columns
+from app.services.demographic_query import FilterError
+from app.services.geo import haversine_miles
+
+MAX_RADIUS_MILES = 100.0
+MAX_RINGS = 5
+MAX_SITES = 500
+WEIGHTINGS = ('centroid', 'linear')
+
+
+def parse_radii(raw):
+    """Sorted distinct radii (miles) from '3' or '1,3,5' or a list of numbers"""
+    if raw is None or raw == '':
+        raise FilterError('radius is required')
+    values = raw.split(',') if isinstance(raw, str) else (raw if isinstance(raw, list) else [raw])
+    try:
+        radii = sorted({float(value) for value in values})
+    except (TypeError, ValueError):
+        raise FilterError('radius must be a number of miles, or several separated by commas')
+    if len(radii) > MAX_RINGS:
+        raise FilterError(f'at most {MAX_RINGS} radii')
+    if not all(0 < radius <= MAX_RADIUS_MILES for radius in radii):
+        raise FilterError(f'radius must be between 0 and {MAX_RADIUS_MILES:g} miles')
+    return radii
+
+
+def _weighting(raw):
+    weighting = raw or WEIGHTINGS[0]
+    if weighting not in WEIGHTINGS:
+        raise FilterError(f'weighting must be one of {", ".join(WEIGHTINGS)}')
+    return weighting
+
+
+def _site(lat, lon):
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        raise FilterError('lat and lon are required numbers')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise FilterError('lat/lon out of range')
+    return lat, lon
+
+
+def parse_trade_area_args(args):
+    """Site, radii and weighting of GET /api/trade-area"""
+    return [_site(args.get('lat'), args.get('lon'))], parse_radii(args.get('radius')), \
+        _weighting(args.get('weighting'))
+
+
+def parse_trade_area_json(data):
+    """Sites, radii and weighting of a POST /api/trade-area body.
+
+    {"sites": [{"lat": .., "lon": .., "id": optional}, ...], "radius": [1, 3],
+    "weighting": "centroid"}; returns ids (None where not given) too.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('sites'), list):
+        raise FilterError('body must be a JSON object with a "sites" list')
+    sites = data['sites']
+    if not sites:
+        raise FilterError('sites is empty')
+    if len(sites) > MAX_SITES:
+        raise FilterError(f'at most {MAX_SITES} sites per request')
+    points, ids = [], []
+    for site in sites:
+        if not isinstance(site, dict):
+            raise FilterError('each site must be an object with lat and lon')
+        points.append(_site(site.get('lat'), site.get('lon')))
+        ids.append(site.get('id'))
+    return points, parse_radii(data.get('radius')), _weighting(data.get('weighting')), ids
+
+
+def _cell_miles(radius):
+    return 2.0 ** max(0, math.ceil(math.log2(radius)))
+
+
+def _centroid_grid(columns, cell_miles):
+    """ZIP rows with centroids, sorted by grid cell, for cells cell_miles wide"""
+    def compute():
+        rows = np.nonzero(np.isfinite(columns.latitude) & np.isfinite(columns.longitude))[0]
+        lat, lon = columns.latitude[rows], columns.longitude[rows]
+        max_abs_lat = float(np.abs(lat).max()) + 1.0 if len(rows) else 0.0
+        cell_lat = cell_miles / 69.0
+        cell_lon = cell_lat / max(math.cos(math.radians(min(max_abs_lat, 85.0))), 0.05)
+        width = int(math.ceil(360.0 / cell_lon)) + 2
+        keys = np.floor((lat + 90.0) / cell_lat).astype(np.int64) * width \
+            + np.floor((lon + 180.0) / cell_lon).astype(np.int64)
+        order = np.argsort(keys, kind='stable')
+        return keys[order], rows[order], cell_lat, cell_lon, width
+    return columns.derive(('trade_area_grid', cell_miles), compute)
+
+
+def _pairs(columns, lat, lon, radius):
+    """(site, ZIP row) pairs whose centroids may lie within radius of the site"""
+    keys, rows, cell_lat, cell_lon, width = _centroid_grid(columns, _cell_miles(radius))
+    site_row = np.floor((lat + 90.0) / cell_lat).astype(np.int64)
+    site_col = np.floor((lon + 180.0) / cell_lon).astype(np.int64)
+    sites, zips = [], []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            cell = (site_row + dy) * width + site_col + dx
+            lo = np.searchsorted(keys, cell, side='left')
+            hi = np.searchsorted(keys, cell, side='right')
+            lengths = hi - lo
+            total = int(lengths.sum())
+            if total:
+                sites.append(np.repeat(np.arange(len(lat)), lengths))
+                zips.append(rows[np.arange(total) + np.repeat(lo - (np.cumsum(lengths) - lengths), lengths)])
+    if not sites:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(sites), np.concatenate(zips)
+
+
+def _weighted_mean(site, weight, values, by, n):
+    """Per-site mean of values weighted by weight * by, over known values"""
+    known = np.isfinite(values) & np.isfinite(by)
+    w = np.where(known, weight * by, 0.0)
+    total = np.bincount(site, w, minlength=n)
+    sums = np.bincount(site, w * np.where(known, values, 0.0), minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, sums / total, np.nan)
+
+
+def _rounded(value, digits=0):
+    if not np.isfinite(value):
+        return None
+    return round(float(value), digits) if digits else int(round(float(value)))
+
+
+def trade_areas(sites, radii, weighting='centroid'):
+    """Per site, a list of ring totals (one per radius, ascending)"""
+    columns = demographic_columns()
+    lat = np.array([site[0] for site in sites], dtype=np.float64)
+    lon = np.array([site[1] for site in sites], dtype=np.float64)
+    n = len(sites)
+    site, row = _pairs(columns, lat, lon, max(radii))
+    distance = haversine_miles(lat[site], lon[site], columns.latitude[row], columns.longitude[row])
+    population = columns.population[row]
+    households = columns.households[row]
+
+    rings = []
+    for radius in radii:
+        inside = distance <= radius
+        weight = inside * (1.0 - distance / radius) if weighting == 'linear' else inside.astype(np.float64)
+        rings.append({
+            'radius': radius,
+            'zips': np.bincount(site, inside, minlength=n).astype(np.int64),
+            'population': np.bincount(site, weight * np.nan_to_num(population), minlength=n),
+            'households': np.bincount(site, weight * np.nan_to_num(households), minlength=n),
+            'median_income': _weighted_mean(site, weight, columns.median_income[row], households, n),
+            'median_home_value': _weighted_mean(site, weight, columns.median_home_value[row], households, n),
+            'median_age': _weighted_mean(site, weight, columns.median_age[row], population, n),
+        })
+
+    results = []
+    for i in range(n):
+        results.append([{
+            'radius_miles': ring['radius'],
+            'zips': int(ring['zips'][i]),
+            'population': int(round(ring['population'][i])),
+            'households': int(round(ring['households'][i])),
+            'median_income': _rounded(ring['median_income'][i]),
+            'median_home_value': _rounded(ring['median_home_value'][i]),
+            'median_age': _rounded(ring['median_age'][i], 1),
+        } for ring in rings])
+    return results
+
@@ -0,0 +1,13 @@
+"""Dialect-aware INSERT ... ON CONFLICT for Core-level bulk writes"""
+
+
+def insert_for(bind, table):
+    """An insert() for the bind's dialect that supports on_conflict_do_update()"""
+    # Imported here: loading the Postgres dialect is slow and SQLite installs don't need it
+    if bind.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table)
+    if bind.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(table)
+    raise NotImplementedError(f'Upserts are not supported on {bind.dialect.name}')
@@ -0,0 +1,28 @@
+"""Flush listeners that have to be installed when the app boots.
+
+They are kept free of heavy imports: the NumPy-backed service a hook
+feeds is only imported once a matching row is actually written.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.models import Location
+from app.services.changes import snapshot, old_snapshot
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_locations(session, flush_context):
+    """Keep competitor_density current within the location's transaction"""
+    added, removed = [], []
+    for obj in session.new:
+        if isinstance(obj, Location):
+            added.append(snapshot(obj))
+    for obj in session.dirty:
+        if isinstance(obj, Location) and session.is_modified(obj, include_collections=False):
+            removed.append(old_snapshot(obj))
+            added.append(snapshot(obj))
+    for obj in session.deleted:
+        if isinstance(obj, Location):
+            removed.append(old_snapshot(obj))
+    if added or removed:
+        from app.services.competitor_density import apply_location_changes
+        apply_location_changes(session.connection(), added, removed)
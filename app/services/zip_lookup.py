@@ -0,0 +1,278 @@
+"""Which ZIP is a point in: a point-in-polygon index over ZIP boundaries.
+
+Every ZIP's bounding box is registered in the CELL_DEGREES grid cells it
+overlaps, in NumPy arrays sorted by cell key. A batch of points becomes
+one searchsorted for candidate ZIPs, a vectorised bounding-box test, and
+then an exact even-odd crossing test of each candidate ZIP's
+full-resolution edges against all of its candidate points at once.
+
+The index is built per process from zip_boundaries and rebuilt when the
+zip_boundaries data version changes. assign_zips() uses it to set the
+zip_code of locations (from their coordinates) and saved addresses
+(from the geocode cache) in bulk.
+"""
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from sqlalchemy import bindparam
+from app.extensions import db
+from app.metrics import cache_event
+from app.models import GeocodeCache, Location, SavedAddress, ZipBoundary
+from app.services.data_version import BULK_TRANSACTION_SECONDS, bump, data_version, invalidate
+from app.services.demographic_query import FilterError
+
+CELL_DEGREES = 0.25
+GRID_COLUMNS = int(round(360 / CELL_DEGREES))
+GRID_ROWS = int(round(180 / CELL_DEGREES))
+# Bound the (edges x points) crossing matrices
+MAX_CROSSINGS_PER_CHUNK = 1_000_000
+# Rows read and updated per round by assign_zips()
+ASSIGN_CHUNK = 20_000
+ASSIGN_TABLES = ('locations', 'saved_addresses')
+
+
+def _cells(lat, lon):
+    row = np.clip(np.floor((np.asarray(lat) + 90.0) / CELL_DEGREES), 0, GRID_ROWS - 1)
+    col = np.clip(np.floor((np.asarray(lon) + 180.0) / CELL_DEGREES), 0, GRID_COLUMNS - 1)
+    return row.astype(np.int64), col.astype(np.int64)
+
+
+class BoundaryIndex:
+    def __init__(self, rows=(), version=None):
+        """rows: (zip_code, min_lon, min_lat, max_lon, max_lat, vertices, ring_sizes)"""
+        self.version = version
+        rows = list(rows)
+        self.zip_codes = np.array([row[0] for row in rows], dtype=object)
+        bounds = np.array([row[1:5] for row in rows], dtype=np.float64).reshape(-1, 4)
+        self.min_lon, self.min_lat, self.max_lon, self.max_lat = bounds.T
+
+        # All rings end to end; an edge joins vertex i to i + 1 unless i ends a ring
+        vertices = [np.frombuffer(row[5], dtype=np.float64).reshape(-1, 2) for row in rows]
+        sizes = [np.frombuffer(row[6], dtype=np.int32) for row in rows]
+        counts = np.array([len(v) for v in vertices], dtype=np.int64)
+        self.end = np.cumsum(counts)
+        self.start = self.end - counts
+        points = np.vstack(vertices) if rows else np.zeros((0, 2))
+        self.x, self.y = np.ascontiguousarray(points[:, 0]), np.ascontiguousarray(points[:, 1])
+        self.edge = np.ones(len(points), dtype=bool)
+        ring_ends = np.cumsum(np.concatenate(sizes)) - 1 if rows else np.zeros(0, dtype=np.int64)
+        self.edge[ring_ends] = False
+        self._build_grid()
+
+    def _build_grid(self):
+        r0, c0 = _cells(self.min_lat, self.min_lon)
+        r1, c1 = _cells(self.max_lat, self.max_lon)
+        widths = c1 - c0 + 1
+        counts = (r1 - r0 + 1) * widths
+        total = int(counts.sum())
+        zips = np.repeat(np.arange(len(counts)), counts)
+        offset = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = np.repeat(r0, counts) + offset // np.repeat(widths, counts)
+        cols = np.repeat(c0, counts) + offset % np.repeat(widths, counts)
+        keys = rows * GRID_COLUMNS + cols
+        order = np.argsort(keys, kind='stable')
+        self.cell_keys, self.cell_zips = keys[order], zips[order]
+
+    def __len__(self):
+        return len(self.zip_codes)
+
+    def _inside(self, z, lon, lat):
+        """Even-odd test of points against ZIP z's rings"""
+        a, b = self.start[z], self.end[z]
+        edge = self.edge[a:b - 1]
+        x1, y1 = self.x[a:b - 1][edge], self.y[a:b - 1][edge]
+        x2, y2 = self.x[a + 1:b][edge], self.y[a + 1:b][edge]
+        inside = np.zeros(len(lon), dtype=bool)
+        step = max(1, MAX_CROSSINGS_PER_CHUNK // max(len(x1), 1))
+        for s in range(0, len(lon), step):
+            px, py = lon[s:s + step], lat[s:s + step]
+            spans = (y1[:, None] > py) != (y2[:, None] > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crossing_x = x1[:, None] + (py - y1[:, None]) * (x2 - x1)[:, None] / (y2 - y1)[:, None]
+            crossings = np.count_nonzero(spans & (px < crossing_x), axis=0)
+            inside[s:s + step] = crossings % 2 == 1
+        return inside
+
+    def locate(self, lat, lon):
+        """Index into zip_codes of the ZIP containing each point (-1 if none)"""
+        lat = np.asarray(lat, dtype=np.float64).ravel()
+        lon = np.asarray(lon, dtype=np.float64).ravel()
+        found = np.full(len(lat), -1, dtype=np.int64)
+        if not len(self) or not len(lat):
+            return found
+        rows, cols = _cells(lat, lon)
+        keys = rows * GRID_COLUMNS + cols
+        lo = np.searchsorted(self.cell_keys, keys, side='left')
+        hi = np.searchsorted(self.cell_keys, keys, side='right')
+        lengths = hi - lo
+        total = int(lengths.sum())
+        if not total:
+            return found
+        point = np.repeat(np.arange(len(lat)), lengths)
+        zips = self.cell_zips[np.arange(total) + np.repeat(lo - (np.cumsum(lengths) - lengths), lengths)]
+        boxed = (lon[point] >= self.min_lon[zips]) & (lon[point] <= self.max_lon[zips]) \
+            & (lat[point] >= self.min_lat[zips]) & (lat[point] <= self.max_lat[zips])
+        point, zips = point[boxed], zips[boxed]
+        if not len(zips):
+            return found
+
+        order = np.argsort(zips, kind='stable')
+        point, zips = point[order], zips[order]
+        starts = np.flatnonzero(np.r_[True, zips[1:] != zips[:-1]])
+        for s, e in zip(starts.tolist(), np.r_[starts[1:], len(zips)].tolist()):
+            candidates = point[s:e]
+            # ZCTAs don't overlap; where slivers do, the first ZIP wins
+            candidates = candidates[found[candidates] < 0]
+            if len(candidates):
+                inside = self._inside(zips[s], lon[candidates], lat[candidates])
+                found[candidates[inside]] = zips[s]
+        return found
+
+    def zip_codes_at(self, lat, lon):
+        """ZIP code (or None) of each point"""
+        return [self.zip_codes[i] if i >= 0 else None for i in self.locate(lat, lon).tolist()]
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def _load_rows():
+    return db.session.query(ZipBoundary.zip_code, ZipBoundary.min_lon, ZipBoundary.min_lat,
+                            ZipBoundary.max_lon, ZipBoundary.max_lat, ZipBoundary.vertices,
+                            ZipBoundary.ring_sizes).all()
+
+
+def boundary_index():
+    """The up-to-date process-wide index (immutable, safe to use unlocked)"""
+    global _index
+    version = data_version('zip_boundaries')
+    with _lock:
+        stale = _index is None or _index.version != version
+        cache_event('boundary_index', not stale)
+        if stale:
+            _index = BoundaryIndex(_load_rows(), version)
+        return _index
+
+
+def zip_at(lat, lon):
+    """The ZIP containing a point, or None"""
+    return boundary_index().zip_codes_at([lat], [lon])[0]
+
+
+def parse_point_args(args):
+    """lat and lon of /api/boundaries/lookup"""
+    try:
+        lat, lon = float(args.get('lat', '')), float(args.get('lon', ''))
+    except ValueError:
+        raise FilterError('lat and lon are required numbers')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise FilterError('lat/lon out of range')
+    return lat, lon
+
+
+# ============= BULK ASSIGNMENT =============
+
+def _location_points(connection, rows):
+    ids = [row[0] for row in rows]
+    return ids, [row[1] for row in rows], [row[2] for row in rows], [row[3] for row in rows]
+
+
+def _saved_address_points(connection, rows):
+    """Coordinates of saved addresses from the geocode cache (no network)"""
+    from app.services.location_import import address_key, cached_coordinates
+    keys = [address_key(address, city, state, zip_code) for _, address, city, state, zip_code in rows]
+    known = cached_coordinates(connection, {key for key in keys if key})
+    # Keys end in the ZIP, which is what an address without one is missing:
+    # accept the cache entry if the rest of the address matches exactly one
+    cache = GeocodeCache.__table__
+    for key in {key for key in keys if key and key.endswith('|') and key not in known}:
+        matches = connection.execute(db.select(cache.c.latitude, cache.c.longitude)
+                                     .where(cache.c.address_key.startswith(key, autoescape=True))
+                                     .limit(2)).all()
+        if len(matches) == 1:
+            known[key] = tuple(matches[0])
+    located = [(row[0], known[key], row[4]) for row, key in zip(rows, keys) if key in known]
+    return ([row_id for row_id, _, _ in located], [lat for _, (lat, _), _ in located],
+            [lon for _, (_, lon), _ in located], [zip_code for _, _, zip_code in located])
+
+
+def assign_zips(table, overwrite=False, chunk_size=ASSIGN_CHUNK):
+    """Set zip_code from the boundaries for a table's rows; returns stats.
+
+    Locations are placed by their coordinates, saved addresses by their
+    address's entry in the geocode cache. Only rows without a zip_code
+    are changed unless overwrite is set. stats has checked / located /
+    changed counts, rows outside every boundary and, for saved addresses,
+    rows the geocode cache has no coordinates for.
+    """
+    if table not in ASSIGN_TABLES:
+        raise ValueError(f'table must be one of {", ".join(ASSIGN_TABLES)}')
+    started = time.perf_counter()
+    index = boundary_index()
+    model = Location if table == 'locations' else SavedAddress
+    columns = model.__table__.c
+    if table == 'locations':
+        query = db.select(columns.id, columns.latitude, columns.longitude, columns.zip_code)\
+            .where(columns.latitude.isnot(None), columns.longitude.isnot(None))
+        points = _location_points
+    else:
+        query = db.select(columns.id, columns.address, columns.city, columns.state, columns.zip_code)
+        points = _saved_address_points
+    if not overwrite:
+        query = query.where(db.or_(columns.zip_code.is_(None), columns.zip_code == ''))
+    values = {'zip_code': bindparam('new_zip_code')}
+    if table == 'locations':
+        # Delta syncs (?since=) pick rows up by updated_at
+        values['updated_at'] = bindparam('now')
+    statement = model.__table__.update().where(columns.id == bindparam('row_id')).values(**values)
+
+    stats = {'checked': 0, 'located': 0, 'changed': 0, 'outside': 0, 'ungeocoded': 0}
+    last_id, changed = 0, 0
+    connection = db.engine.connect()
+    try:
+        transaction = connection.begin()
+        opened, now = time.perf_counter(), datetime.utcnow()
+        while True:
+            rows = connection.execute(query.where(columns.id > last_id)
+                                      .order_by(columns.id).limit(chunk_size)).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            stats['checked'] += len(rows)
+            ids, lat, lon, current = points(connection, rows)
+            stats['ungeocoded'] += len(rows) - len(ids)
+            found = index.zip_codes_at(lat, lon)
+            updates = []
+            for row_id, old, new in zip(ids, current, found):
+                if new is None:
+                    stats['outside'] += 1
+                    continue
+                stats['located'] += 1
+                if new != old:
+                    updates.append({'row_id': row_id, 'new_zip_code': new})
+            if updates:
+                if table == 'locations':
+                    updates = [dict(update, now=now) for update in updates]
+                connection.execute(statement, updates)
+                changed += len(updates)
+            if time.perf_counter() - opened >= BULK_TRANSACTION_SECONDS:
+                if changed and table == 'locations':
+                    bump(connection, 'locations')
+                transaction.commit()
+                stats['changed'] += changed
+                changed = 0
+                transaction = connection.begin()
+                opened, now = time.perf_counter(), datetime.utcnow()
+        if changed and table == 'locations':
+            bump(connection, 'locations')
+        transaction.commit()
+        stats['changed'] += changed
+    finally:
+        connection.close()
+        # Even if a later chunk failed, earlier commits are in the table
+        if stats['changed'] and table == 'locations':
+            invalidate('locations')
+    stats['seconds'] = time.perf_counter() - started
+    return stats
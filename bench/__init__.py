@@ -0,0 +1 @@
+"""Load-test and benchmark suite (see `python -m bench --help`)"""
@@ -0,0 +1,168 @@
+"""Benchmark command line.
+
+    python -m bench generate --scale 1.0            # synthetic national dataset
+    python -m bench run                             # in-process, via the test client
+    python -m bench run --http http://127.0.0.1:8000 --server-pid <pid>
+    python -m bench startup --budget 1.5             # cold start to first response
+    python -m bench compare old.json new.json
+
+The benchmark database, snapshots and tile cache live in bench/data/ so
+they never touch the development database.
+"""
+import argparse
+import os
+import sys
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def _use_bench_database(path):
+    path = os.path.abspath(path or os.path.join(DATA_DIR, 'bench.db'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Must be set before create_app() reads the config
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ.setdefault('SNAPSHOT_DIR', os.path.join(DATA_DIR, 'snapshots'))
+    os.environ.setdefault('TILE_CACHE_DIR', os.path.join(DATA_DIR, 'tile_cache'))
+    return path
+
+
+def _app():
+    from app import create_app
+    return create_app()
+
+
+def _centres(limit=500):
+    from app.models import Demographic
+    rows = (Demographic.query.with_entities(Demographic.latitude, Demographic.longitude)
+            .filter(Demographic.latitude.isnot(None))
+            .order_by(Demographic.zip_code).all())
+    if not rows:
+        sys.exit('The benchmark database is empty; run `python -m bench generate` first')
+    step = max(1, len(rows) // limit)
+    return [(float(lat), float(lon)) for lat, lon in rows[::step]]
+
+
+def generate(args):
+    path = _use_bench_database(args.db)
+    if os.path.exists(path):
+        if not args.force:
+            sys.exit(f'{path} already exists (use --force to replace it)')
+        os.remove(path)
+    from bench.dataset import generate as build
+    app = _app()
+    with app.app_context():
+        build(scale=args.scale, seed=args.seed)
+        # Build the column snapshot now rather than in the first timed request
+        from app.services.columns import demographic_columns
+        demographic_columns()
+    print(path)
+
+
+def run(args):
+    # Before anything imports app.config, which reads DATABASE_URL
+    _use_bench_database(args.db)
+    from bench.report import summarise, peak_rss_mb, write_results, print_results
+    from bench.scenarios import SCENARIOS
+    scenarios = args.scenarios.split(',') if args.scenarios else list(SCENARIOS)
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f'Unknown scenarios: {", ".join(unknown)} (choose from {", ".join(SCENARIOS)})')
+
+    app = _app()
+    with app.app_context():
+        from app.models import Demographic, Location, User
+        centres = _centres()
+        counts = {'zips': Demographic.query.count(), 'locations': Location.query.count(),
+                  'users': User.query.count()}
+
+    meta = {'mode': 'http' if args.http else 'in-process', 'seed': args.seed, 'dataset': counts}
+    if args.http:
+        from bench.driver import run_http
+        raw = run_http(args.http, scenarios, centres, args.seed,
+                       concurrency=args.concurrency, duration=args.duration)
+        meta.update(concurrency=args.concurrency, duration=args.duration)
+        if args.server_pid:
+            meta['server_peak_rss_mb'] = peak_rss_mb(args.server_pid)
+    else:
+        from bench.driver import run_in_process
+        app.config['HISTORY_FLUSH_INTERVAL'] = args.flush_interval
+        raw = run_in_process(app, scenarios, args.requests, centres, args.seed)
+        meta['requests'] = args.requests
+    meta['peak_rss_mb'] = peak_rss_mb()
+
+    results = {name: summarise(*raw[name]) for name in scenarios}
+    print_results(results)
+    print(write_results(results, meta, args.output))
+
+
+def startup(args):
+    from bench.report import summarise, write_results, print_results
+    from bench.startup import PHASES, run_startup
+    path = _use_bench_database(args.db)
+    if not os.path.exists(path):
+        sys.exit(f'{path} does not exist; run `python -m bench generate` first')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings, errors = run_startup(args.config, args.path, args.runs, root)
+
+    results = {phase: summarise(timings[phase], errors if phase == 'total' else 0, None)
+               for phase in PHASES}
+    print_results(results)
+    meta = {'mode': 'startup', 'config': args.config, 'path': args.path, 'runs': args.runs,
+            'budget_s': args.budget}
+    print(write_results(results, meta, args.output))
+
+    p95 = results['total']['p95_ms'] / 1000.0
+    if errors or p95 > args.budget:
+        sys.exit(f'Cold start p95 {p95:.3f}s ({errors} errors) is over the {args.budget:.3f}s budget')
+    print(f'Cold start p95 {p95:.3f}s is within the {args.budget:.3f}s budget')
+
+
+def compare(args):
+    from bench.report import compare as diff
+    diff(args.old, args.new)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description='Business heat map benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('generate', help='Create the synthetic benchmark database')
+    p.add_argument('--scale', type=float, default=1.0, help='1.0 = 33k ZIPs, 1M locations, 100k users')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--db', help='SQLite file (default bench/data/bench.db)')
+    p.add_argument('--force', action='store_true', help='Replace an existing database')
+    p.set_defaults(func=generate)
+
+    p = commands.add_parser('run', help='Run scenarios and write a result file')
+    p.add_argument('--db', help='SQLite file (default bench/data/bench.db)')
+    p.add_argument('--scenarios', help='Comma-separated subset (default: all)')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--requests', type=int, default=200, help='Requests per scenario (in-process)')
+    p.add_argument('--flush-interval', type=float, default=5.0, help='Search history flush interval')
+    p.add_argument('--http', metavar='URL', help='Load-test a running server instead')
+    p.add_argument('--concurrency', type=int, default=8, help='Client processes (HTTP)')
+    p.add_argument('--duration', type=float, default=10.0, help='Seconds per scenario (HTTP)')
+    p.add_argument('--server-pid', type=int, help='Report the server\'s peak RSS (HTTP, Linux)')
+    p.add_argument('--output', help='Result file (default bench/results/<time>-<revision>.json)')
+    p.set_defaults(func=run)
+
+    p = commands.add_parser('startup', help='Time cold starts to the first response')
+    p.add_argument('--db', help='SQLite file (default bench/data/bench.db)')
+    p.add_argument('--config', default='production', help='create_app() profile')
+    p.add_argument('--path', default='/auth/login', help='First request')
+    p.add_argument('--runs', type=int, default=10)
+    p.add_argument('--budget', type=float, default=1.5, help='Seconds allowed for the p95 cold start')
+    p.add_argument('--output', help='Result file (default bench/results/<time>-<revision>.json)')
+    p.set_defaults(func=startup)
+
+    p = commands.add_parser('compare', help='Diff two result files')
+    p.add_argument('old')
+    p.add_argument('new')
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Synthetic national dataset for benchmarks.
+
+At scale 1.0: ~33k ZIPs, 1M locations, 100k users with search history
+and saved addresses. ZIP centroids are clustered around a few hundred
+"metros" inside the contiguous US so bbox and radius queries see
+realistic densities. Everything is derived from a seed, so two runs with
+the same seed and scale produce the same database.
+
+Rows are written with Core executemany in large transactions; users all
+share one precomputed password hash (hashing 100k passwords would take
+longer than the benchmark).
+"""
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.models import Demographic, Location, User, SearchHistory, SavedAddress
+from app.services.admin_stats import rebuild as rebuild_admin_stats
+from app.services.data_version import bump, invalidate
+
+ZIP_COUNT = 33_000
+LOCATION_COUNT = 1_000_000
+USER_COUNT = 100_000
+HISTORY_PER_USER = 5
+SAVED_PER_USER = 1
+METROS = 300
+
+BUSINESS_TYPES = ('restaurant', 'cafe', 'retail', 'grocery', 'pharmacy', 'gym', 'salon',
+                  'bank', 'gas_station', 'auto_repair', 'hotel', 'clinic')
+STATES = ('AL', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'ID', 'IL', 'IN', 'IA', 'KS',
+          'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ',
+          'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT',
+          'VT', 'VA', 'WA', 'WV', 'WI', 'WY')
+# Contiguous US
+MIN_LAT, MAX_LAT = 25.0, 49.0
+MIN_LON, MAX_LON = -124.5, -67.5
+
+BENCH_PASSWORD = 'bench-password'
+ADMIN_USERNAME = 'bench_admin'
+BATCH = 20_000
+
+
+def _insert(connection, table, rows):
+    for start in range(0, len(rows), BATCH):
+        connection.execute(table.insert(), rows[start:start + BATCH])
+
+
+def _zips(rng, count):
+    metro_lat = rng.uniform(MIN_LAT + 1, MAX_LAT - 1, METROS)
+    metro_lon = rng.uniform(MIN_LON + 1, MAX_LON - 1, METROS)
+    metro_state = rng.choice(STATES, METROS)
+    # Big metros own more ZIPs
+    weights = rng.pareto(1.2, METROS) + 1
+    metro = rng.choice(METROS, count, p=weights / weights.sum())
+    lat = np.clip(metro_lat[metro] + rng.normal(0, 0.35, count), MIN_LAT, MAX_LAT)
+    lon = np.clip(metro_lon[metro] + rng.normal(0, 0.45, count), MIN_LON, MAX_LON)
+    codes = rng.choice(np.arange(501, 99951), count, replace=False)
+    codes.sort()
+    population = np.round(rng.lognormal(8.6, 1.2, count)).astype(int)
+    income = np.round(rng.lognormal(11.0, 0.35, count), -2).astype(int)
+    now = datetime.utcnow()
+    rows = []
+    for i in range(count):
+        rows.append({
+            'zip_code': f'{codes[i]:05d}',
+            'city': f'Metro {metro[i]:03d}',
+            'state': str(metro_state[metro[i]]),
+            'population': int(population[i]),
+            'median_income': int(income[i]),
+            'median_age': round(float(rng.normal(38, 6)), 1),
+            'median_home_value': int(round(income[i] * rng.uniform(2.5, 6.0), -3)),
+            'households': int(population[i] // rng.uniform(2.2, 3.0)),
+            'latitude': float(lat[i]),
+            'longitude': float(lon[i]),
+            'updated_at': now,
+        })
+    return rows, lat, lon
+
+
+def generate(scale=1.0, seed=42, log=print):
+    """Fill the app's (empty) database with the synthetic dataset; returns counts"""
+    rng = np.random.default_rng(seed)
+    zip_count = max(100, int(ZIP_COUNT * scale))
+    user_count = max(10, int(USER_COUNT * scale))
+    location_count = max(100, int(LOCATION_COUNT * scale))
+    started = time.perf_counter()
+
+    if db.session.query(Demographic.id).first() or db.session.query(User.id).first():
+        raise RuntimeError('The benchmark database must be empty')
+
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        zip_rows, zip_lat, zip_lon = _zips(rng, zip_count)
+        _insert(connection, Demographic.__table__, zip_rows)
+        log(f'{zip_count} ZIPs')
+
+        users = [{'username': ADMIN_USERNAME, 'email': f'{ADMIN_USERNAME}@bench.local',
+                  'password_hash': password_hash, 'is_admin': True, 'created_at': now}]
+        users += [{'username': f'bench_user_{i}', 'email': f'bench_user_{i}@bench.local',
+                   'password_hash': password_hash, 'is_admin': False, 'created_at': now}
+                  for i in range(1, user_count)]
+        _insert(connection, User.__table__, users)
+        user_ids = [row[0] for row in connection.execute(
+            db.select(User.id).order_by(User.id))]
+        log(f'{user_count} users')
+
+        near = rng.integers(0, zip_count, location_count)
+        lat = zip_lat[near] + rng.normal(0, 0.03, location_count)
+        lon = zip_lon[near] + rng.normal(0, 0.04, location_count)
+        owner = rng.choice(user_ids, location_count)
+        kind = rng.choice(BUSINESS_TYPES, location_count)
+        for start in range(0, location_count, BATCH):
+            end = min(start + BATCH, location_count)
+            _insert(connection, Location.__table__, [{
+                'name': f'Business {i}',
+                'address': f'{i % 9000 + 100} Main St',
+                'city': zip_rows[near[i]]['city'],
+                'state': zip_rows[near[i]]['state'],
+                'zip_code': zip_rows[near[i]]['zip_code'],
+                'latitude': float(lat[i]),
+                'longitude': float(lon[i]),
+                'business_type': str(kind[i]),
+                'created_at': now,
+                'updated_at': now,
+                'user_id': int(owner[i]),
+            } for i in range(start, end)])
+        log(f'{location_count} locations')
+
+        income_keys = ('low', 'middle', 'upper', 'high')
+        history = []
+        for user_id in user_ids:
+            for _ in range(HISTORY_PER_USER):
+                picked = [k for k in income_keys if rng.random() < 0.4]
+                history.append({
+                    'user_id': user_id,
+                    'zip_code': zip_rows[int(rng.integers(zip_count))]['zip_code'],
+                    'filters': {'income': picked, 'population': []},
+                    'search_date': now - timedelta(minutes=int(rng.integers(0, 60 * 24 * 90))),
+                })
+        _insert(connection, SearchHistory.__table__, history)
+        saved = []
+        for user_id in user_ids:
+            for _ in range(SAVED_PER_USER):
+                z = zip_rows[int(rng.integers(zip_count))]
+                saved.append({
+                    'user_id': user_id, 'name': 'Saved spot', 'address': '1 Bench Way',
+                    'city': z['city'], 'state': z['state'], 'zip_code': z['zip_code'],
+                    'address_type': 'commercial', 'filters_used': {},
+                    'created_at': now,
+                })
+        _insert(connection, SavedAddress.__table__, saved)
+        log(f'{len(history)} search history rows, {len(saved)} saved addresses')
+        bump(connection, 'demographics', 'locations', 'user')
+        rebuild_admin_stats(connection)
+    invalidate()
+
+    counts = {'zips': zip_count, 'users': user_count, 'locations': location_count,
+              'search_history': len(history), 'saved_addresses': len(saved)}
+    log(f'Generated in {time.perf_counter() - started:.1f}s')
+    return counts
@@ -0,0 +1,114 @@
+"""Drive the app in-process (Flask test client) or over HTTP.
+
+The in-process driver measures the application itself: routing, SQL,
+serialisation, with no network or server in the way. The HTTP driver
+runs a pool of processes against a server started separately (gunicorn
+in production configuration) and measures what a client sees under
+concurrency.
+"""
+import http.cookiejar
+import json
+import multiprocessing
+import time
+import urllib.parse
+import urllib.request
+from bench.dataset import ADMIN_USERNAME, BENCH_PASSWORD
+from bench.scenarios import SCENARIOS, ANONYMOUS, make_rng
+
+
+def _login(client):
+    response = client.post('/auth/login', data={'username': ADMIN_USERNAME, 'password': BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f'Benchmark login failed ({response.status_code})')
+
+
+def run_in_process(app, scenarios, requests, centres, seed, warmup=5):
+    """{scenario: (latencies in seconds, errors, elapsed)} via the test client"""
+    results = {}
+    for name in scenarios:
+        client = app.test_client()
+        if name not in ANONYMOUS:
+            _login(client)
+        rng = make_rng(seed, name)
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for i in range(warmup + requests):
+            method, path, body = SCENARIOS[name](rng, centres)
+            if name in ANONYMOUS:
+                client = app.test_client()
+            t = time.perf_counter()
+            try:
+                status = client.open(path, method=method, **(body or {})).status_code
+            except Exception:
+                # An error handler that fails itself propagates through the test client
+                status = 500
+            elapsed = time.perf_counter() - t
+            if i < warmup:
+                started = time.perf_counter()
+                continue
+            latencies.append(elapsed)
+            if status >= 400:
+                errors += 1
+        results[name] = (latencies, errors, time.perf_counter() - started)
+    return results
+
+
+# ============= HTTP LOAD =============
+
+def _opener(base_url, logged_in):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    if logged_in:
+        form = urllib.parse.urlencode({'username': ADMIN_USERNAME, 'password': BENCH_PASSWORD}).encode()
+        opener.open(base_url + '/auth/login', form).read()
+    return opener
+
+
+def _request(opener, base_url, method, path, body):
+    data, headers = None, {}
+    if body and 'json' in body:
+        data = json.dumps(body['json']).encode()
+        headers['Content-Type'] = 'application/json'
+    elif body and 'data' in body:
+        data = urllib.parse.urlencode(body['data']).encode()
+    request = urllib.request.Request(base_url + path, data=data, headers=headers, method=method)
+    with opener.open(request) as response:
+        response.read()
+        return response.status
+
+
+def _http_worker(args):
+    base_url, name, seed, worker, duration, centres = args
+    rng = make_rng(f'{seed}:{worker}', name)
+    anonymous = name in ANONYMOUS
+    opener = _opener(base_url, not anonymous)
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        method, path, body = SCENARIOS[name](rng, centres)
+        if anonymous:
+            opener = _opener(base_url, False)
+        t = time.perf_counter()
+        try:
+            status = _request(opener, base_url, method, path, body)
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError:
+            status = 599
+        latencies.append(time.perf_counter() - t)
+        if status >= 400:
+            errors += 1
+    return latencies, errors
+
+
+def run_http(base_url, scenarios, centres, seed, concurrency=8, duration=10.0):
+    """{scenario: (latencies, errors, elapsed)} from `concurrency` client processes"""
+    results = {}
+    with multiprocessing.Pool(concurrency) as pool:
+        for name in scenarios:
+            started = time.perf_counter()
+            chunks = pool.map(_http_worker, [(base_url.rstrip('/'), name, seed, worker, duration, centres)
+                                             for worker in range(concurrency)])
+            latencies = [value for chunk, _ in chunks for value in chunk]
+            errors = sum(e for _, e in chunks)
+            results[name] = (latencies, errors, time.perf_counter() - started)
+    return results
@@ -0,0 +1,100 @@
+"""Summaries, peak RSS, result files and comparisons"""
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+from datetime import datetime
+import numpy as np
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def summarise(latencies, errors, elapsed):
+    """Latency percentiles (ms) and throughput for one scenario"""
+    values = np.array(latencies) * 1000.0
+    if not len(values):
+        return {'requests': 0, 'errors': errors}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'mean_ms': round(float(values.mean()), 3),
+        'max_ms': round(float(values.max()), 3),
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else None,
+    }
+
+
+def peak_rss_mb(pid=None):
+    """Peak resident set size of this process, or of another one via /proc"""
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # KiB on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(results, meta, path=None):
+    """Write a result file (default bench/results/<time>-<revision>.json)"""
+    revision = git_revision()
+    payload = dict(meta, revision=revision, python=platform.python_version(),
+                   platform=platform.platform(), created_at=datetime.utcnow().isoformat(),
+                   results=results)
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        path = os.path.join(RESULTS_DIR, f'{stamp}-{revision or "unknown"}.json')
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+    return path
+
+
+def print_results(results, out=print):
+    out(f'{"scenario":<24}{"reqs":>7}{"err":>5}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"req/s":>10}')
+    for name, row in results.items():
+        if not row.get('requests'):
+            out(f'{name:<24}{0:>7}{row.get("errors", 0):>5}')
+            continue
+        out(f'{name:<24}{row["requests"]:>7}{row["errors"]:>5}{row["p50_ms"]:>10.2f}'
+            f'{row["p95_ms"]:>10.2f}{row["p99_ms"]:>10.2f}{row["throughput_rps"] or 0:>10.1f}')
+
+
+def compare(old_path, new_path, out=print):
+    """Print the change per scenario between two result files"""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    out(f'{old.get("revision")} -> {new.get("revision")}')
+    out(f'{"scenario":<24}{"p50":>18}{"p95":>18}{"p99":>18}{"req/s":>18}')
+    for name in sorted(set(old['results']) | set(new['results'])):
+        a, b = old['results'].get(name, {}), new['results'].get(name, {})
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            if a.get(key) and b.get(key):
+                cells.append(f'{b[key]:>9.2f} ({(b[key] / a[key] - 1) * 100:+5.0f}%)')
+            else:
+                cells.append(f'{b.get(key, "-")!s:>18}')
+        out(f'{name:<24}' + ''.join(f'{c:>18}' for c in cells))
+    for key in ('peak_rss_mb', 'server_peak_rss_mb'):
+        if old.get(key) or new.get(key):
+            out(f'{key}: {old.get(key)} -> {new.get(key)}')
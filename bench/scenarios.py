@@ -0,0 +1,80 @@
+"""Benchmark scenarios: each yields (method, path, form or JSON body).
+
+Scenarios draw their parameters from a seeded RNG and the dataset's
+metro centres, so every run issues the same request sequence.
+"""
+import random
+from bench.dataset import ADMIN_USERNAME, BENCH_PASSWORD, BUSINESS_TYPES
+
+INCOME = ('low', 'middle', 'upper', 'high')
+
+
+def _bbox(rng, centres, span=0.6):
+    lat, lon = rng.choice(centres)
+    return f'{lon - span:.4f},{lat - span / 2:.4f},{lon + span:.4f},{lat + span / 2:.4f}'
+
+
+def demographics(rng, centres):
+    filters = ','.join(rng.sample(INCOME, rng.randint(1, 3)))
+    return 'GET', f'/api/demographics?limit=1000&income={filters}&bbox={_bbox(rng, centres, 3.0)}', None
+
+
+def demographics_columnar(rng, centres):
+    method, path, body = demographics(rng, centres)
+    return method, path + '&format=columnar', body
+
+
+def locations_bbox(rng, centres):
+    return 'GET', f'/api/locations?bbox={_bbox(rng, centres)}&limit=500', None
+
+
+def locations_near(rng, centres):
+    lat, lon = rng.choice(centres)
+    kind = rng.choice(BUSINESS_TYPES)
+    return 'GET', f'/api/locations?near={lat:.4f},{lon:.4f}&k=25&business_type={kind}', None
+
+
+def location_clusters(rng, centres):
+    # A 1280x800 map viewport at a random zoom
+    zoom = rng.randint(4, 12)
+    lat, lon = rng.choice(centres)
+    span = 1280 / (256 * 2 ** zoom) * 360 / 2
+    bbox = f'{lon - span:.4f},{lat - span / 2:.4f},{lon + span:.4f},{lat + span / 2:.4f}'
+    return 'GET', f'/api/locations/clusters?bbox={bbox}&zoom={zoom}', None
+
+
+def search_history_post(rng, centres):
+    filters = {'income': rng.sample(INCOME, rng.randint(0, 3)), 'population': []}
+    return 'POST', '/api/search-history', {'json': {'filters': filters}}
+
+
+def search_history_get(rng, centres):
+    return 'GET', '/api/search-history', None
+
+
+def login(rng, centres):
+    return 'POST', '/auth/login', {'data': {'username': ADMIN_USERNAME, 'password': BENCH_PASSWORD}}
+
+
+def admin_panel(rng, centres):
+    return 'GET', '/admin/', None
+
+
+SCENARIOS = {
+    'demographics': demographics,
+    'demographics_columnar': demographics_columnar,
+    'locations_bbox': locations_bbox,
+    'locations_near': locations_near,
+    'location_clusters': location_clusters,
+    'search_history_post': search_history_post,
+    'search_history_get': search_history_get,
+    'login': login,
+    'admin_panel': admin_panel,
+}
+
+# Scenarios that must not run with a logged-in session
+ANONYMOUS = ('login',)
+
+
+def make_rng(seed, scenario):
+    return random.Random(f'{seed}:{scenario}')
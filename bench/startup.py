@@ -0,0 +1,52 @@
+"""Cold start: fresh interpreter to first response.
+
+Each run starts a new Python process that imports the app, calls
+create_app() and serves one request through the test client, reporting
+when each phase finished. Phases are measured from just before the
+process was spawned, so interpreter start-up is included.
+"""
+import json
+import subprocess
+import sys
+import time
+
+PHASES = ('import', 'create_app', 'first_request', 'total')
+
+PROBE = '''
+import json, sys, time
+from app import create_app
+imported = time.time()
+app = create_app(sys.argv[1])
+created = time.time()
+status = app.test_client().get(sys.argv[2]).status_code
+served = time.time()
+print(json.dumps({'imported': imported, 'created': created, 'served': served, 'status': status}))
+'''
+
+
+def measure(config_name, path, cwd):
+    """Seconds per phase for one cold start"""
+    spawned = time.time()
+    output = subprocess.run([sys.executable, '-c', PROBE, config_name, path], cwd=cwd,
+                            check=True, capture_output=True, text=True).stdout
+    probe = json.loads(output.strip().splitlines()[-1])
+    return {
+        'import': probe['imported'] - spawned,
+        'create_app': probe['created'] - probe['imported'],
+        'first_request': probe['served'] - probe['created'],
+        'total': probe['served'] - spawned,
+    }, probe['status']
+
+
+def run_startup(config_name, path, runs, cwd):
+    """Timings per phase over `runs` cold starts, and the error count"""
+    timings = {phase: [] for phase in PHASES}
+    errors = 0
+    # One unmeasured start so .pyc files and the OS cache are warm, as on a deploy
+    measure(config_name, path, cwd)
+    for _ in range(runs):
+        phases, status = measure(config_name, path, cwd)
+        errors += status >= 500
+        for phase, seconds in phases.items():
+            timings[phase].append(seconds)
+    return timings, errors
@@ -2,17 +2,12 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from app import create_app
 from app.extensions import db
 from app.models import User, Location, Demographic
 
 def load_sample_data():
-    # Import create_app from the root app.py
-    import importlib.util
-    spec = importlib.util.spec_from_file_location("app", "app.py")
-    app_module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(app_module)
-    
-    app = app_module.create_app('development')
+    app = create_app('development')
     
     with app.app_context():
         print("Loading sample data...")
@@ -24,7 +19,7 @@ def load_sample_data():
         admin = User(
             username='admin',
             email='admin@businessheatmap.com',
-            role='admin'
+            is_admin=True
         )
         admin.set_password('admin123')
         db.session.add(admin)
@@ -32,7 +27,7 @@ def load_sample_data():
         user = User(
             username='demo_user',
             email='demo@businessheatmap.com',
-            role='user'
+            is_admin=False
         )
         user.set_password('demo123')
         db.session.add(user)
@@ -50,8 +45,7 @@ def load_sample_data():
                 latitude=39.0997,
                 longitude=-94.5786,
                 business_type='Coffee Shop',
-                notes='Prime downtown location',
-                created_by=admin.id
+                user_id=admin.id
             ),
             Location(
                 name='Suburban Fitness Center',
@@ -62,8 +56,7 @@ def load_sample_data():
                 latitude=38.9822,
                 longitude=-94.6708,
                 business_type='Fitness',
-                notes='Growing suburban area',
-                created_by=admin.id
+                user_id=admin.id
             ),
             Location(
                 name='Plaza Restaurant',
@@ -74,8 +67,7 @@ def load_sample_data():
                 latitude=39.0399,
                 longitude=-94.5919,
                 business_type='Restaurant',
-                notes='Country Club Plaza district',
-                created_by=user.id
+                user_id=user.id
             )
         ]
         